@@ -0,0 +1,7 @@
+"""Benchmarks of qzig
+
+Each benchmark is a module that is run from the repository root::
+
+    python -m benchmarks.<name>
+
+"""
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Radio requests of repeated server GETs
+
+Interviews 50 devices with a basic and an on/off cluster, and then
+sends five rounds of GETs for every device and state through
+Application.get. Every radio request takes 20 ms. The GETs run with the
+attribute cache turned off (TTL 0) and with the default TTLs.
+
+Run from the repository root::
+
+    python -m benchmarks.attribute_cache
+
+"""
+import asyncio
+import logging
+import tempfile
+
+from benchmarks import common
+import qzig.application as application
+import qzig.device as device
+import qzig.value as value
+
+DEVICES = 50
+ROUNDS = 5
+LATENCY = .02
+
+requests = []
+
+
+class Cluster():
+    def __init__(self, cluster_id):
+        self.cluster_id = cluster_id
+
+    @asyncio.coroutine
+    def read_attributes(self, attributes, **kwargs):
+        requests.append((self.cluster_id, attributes))
+        yield from asyncio.sleep(LATENCY)
+        if self.cluster_id == 0:
+            return [{a: b"bench" if a in (4, 5, 10) else 1 for a in attributes}, {}]
+        return [{a: 0 for a in attributes}, {}]
+
+    @asyncio.coroutine
+    def bind(self, *args):
+        yield from asyncio.sleep(LATENCY)
+
+    def add_listener(self, listener):
+        pass
+
+
+class Endpoint():
+    def __init__(self):
+        self.in_clusters = {0: Cluster(0), 6: Cluster(6)}
+        self.out_clusters = {}
+
+
+class Device():
+    def __init__(self, i):
+        self.ieee = "00:00:00:00:00:00:%02x:%02x" % (i // 256, i % 256)
+        self.endpoints = {0: None, 1: Endpoint()}
+        self.zdo = Cluster(-1)
+
+
+class ZigBee():
+    def __init__(self):
+        self._devices = [(d.ieee, d) for d in map(Device, range(DEVICES))]
+
+    def devices(self):
+        return self._devices
+
+
+class RPC():
+    def put(self, url, data):
+        pass
+
+    def post(self, url, data):
+        pass
+
+
+@asyncio.coroutine
+def _get_all(app):
+    urls = []
+    for dev in app._network._children:
+        urls.append("/device/" + dev.id)
+        for v in dev._children:
+            urls.extend("/state/" + s.id for s in v._children)
+    for i in range(ROUNDS):
+        yield from asyncio.gather(*[app.get(url) for url in urls])
+
+
+def _run(ttl):
+    ttls = value.ClusterReader.ttl, device.Device._info_ttl
+    if ttl is not None:
+        value.ClusterReader.ttl = device.Device._info_ttl = ttl
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory() as rootdir:
+        app = application.Application("/dev/null", "bench", rootdir=rootdir + "/", snapshot=False)
+        app._zb = ZigBee()
+        app._rpc = RPC()
+        loop.run_until_complete(app._load_devices())
+        del requests[:]
+        elapsed, _ = common.timed(common.run, _get_all(app))
+        app._network._close()
+    value.ClusterReader.ttl, device.Device._info_ttl = ttls
+    return elapsed, len(requests)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for name, ttl in [("no cache", 0), ("cache", None)]:
+        hits, misses = value.ClusterReader.stats["hits"], value.ClusterReader.stats["misses"]
+        elapsed, reads = _run(ttl)
+        print("%-8s: %6.2f s, %4d radio reads, %5d hits, %5d misses" % (
+            name, elapsed, reads, value.ClusterReader.stats["hits"] - hits,
+            value.ClusterReader.stats["misses"] - misses))
+
+
+if __name__ == "__main__":
+    main()
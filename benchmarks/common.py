@@ -0,0 +1,44 @@
+"""Helpers shared by the benchmarks"""
+import asyncio
+import time
+
+
+def timed(fn, *args):
+    """Calls a function and measures how long the call takes
+
+    :param fn: The function to call
+    :param args: The arguments for the function
+    :returns: The seconds the call took and its result
+    :rtype: Tuple
+
+    """
+    start = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - start, res
+
+
+def best_of(runs, fn, *args):
+    """Calls a function several times and keeps the fastest call
+
+    :param runs: The number of calls
+    :param fn: The function to call
+    :param args: The arguments for the function
+    :returns: The seconds the fastest call took and the result of the last call
+    :rtype: Tuple
+
+    """
+    best = None
+    for i in range(runs):
+        elapsed, res = timed(fn, *args)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def run(coro):
+    """Runs a coroutine on the event loop until it is done
+
+    :param coro: The coroutine to run
+    :returns: The result of the coroutine
+
+    """
+    return asyncio.get_event_loop().run_until_complete(coro)
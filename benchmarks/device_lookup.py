@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Device and value lookup speed during startup
+
+Builds networks of 100 to 3,000 devices with on/off, temperature,
+humidity and diagnostics values and looks every device up by IEEE and
+every value up by endpoint, cluster and index, the way the startup
+load and rejoins do through Network.add_device and Device.add_value.
+The linear scans used before are kept here for comparison.
+
+Run from the repository root::
+
+    python -m benchmarks.device_lookup
+
+"""
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+
+SIZES = [100, 1000, 3000]
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class App():
+    _gateway = None
+
+
+def _network(devices):
+    net = network.Network(App(), "bench")
+    for i in range(devices):
+        dev = device.Device(net)
+        dev.attr["ieee"] = "00:00:00:00:00:%02x:%02x:%02x" % (i >> 16, (i >> 8) & 0xff, i & 0xff)
+        net._add_child(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    return net
+
+
+def _scan_device(net, ieee, id=None):
+    try:
+        dev = next(d for d in net._children
+                   if d.ieee == ieee or d.id == id)
+    except StopIteration:
+        dev = None
+    return dev
+
+
+def _scan_value(dev, endpoint, cluster, index=0):
+    try:
+        val = next(v for v in dev._children
+                   if str(v.endpoint_id) == str(endpoint) and str(v.cluster_id) == str(cluster) and str(v.index) == str(index))
+    except StopIteration:
+        return None
+    return val
+
+
+def _restore(net, get_device, get_value):
+    for d in net._children:
+        dev = get_device(net, d.ieee)
+        for cluster in CLUSTERS:
+            assert get_value(dev, 1, cluster) is not None
+
+
+def main():
+    print("%8s %12s %12s" % ("devices", "scan", "index"))
+    for size in SIZES:
+        net = _network(size)
+        scan = common.timed(_restore, net, _scan_device, _scan_value)[0]
+        index = common.timed(_restore, net, network.Network._get_device, device.Device.get_value)[0]
+        print("%8d %9.1f ms %9.1f ms" % (size, scan * 1000, index * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Encoding speed of a full network post
+
+Builds a network of 1,000 devices with on/off, temperature, humidity and
+diagnostics values and encodes Network.get_data() the way the full
+network POST does. The isinstance chain the encoder used before, which
+also had to convert the value metadata of every value on every post, is
+kept here for comparison.
+
+Run from the repository root::
+
+    python -m benchmarks.encode_network
+
+"""
+import json
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+import qzig.state as state
+import qzig.status as status
+import qzig.timestamp as timestamp
+import qzig.util as util
+import qzig.value as value
+
+DEVICES = 1000
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class ChainEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if type(obj) is value.ValuePermission:
+            return obj.value
+        if type(obj) is value.ValueStatus:
+            return obj.value
+        if type(obj) is state.StateType:
+            return obj.value
+        if type(obj) is state.StateStatus:
+            return obj.value
+        if type(obj) is value.ValueNumberType:
+            return obj.get_data()
+        if type(obj) is value.ValueStringType:
+            return obj.get_data()
+        if type(obj) is status.StatusType:
+            return obj.value
+        if type(obj) is status.StatusLevel:
+            return obj.value
+        if type(obj) is timestamp.Timestamp:
+            return obj.isoformat()
+
+
+class App():
+    _gateway = None
+
+
+def _network(devices):
+    net = network.Network(App(), "bench")
+    for i in range(devices):
+        dev = device.Device(net)
+        net._children.append(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    return net
+
+
+def _get_data_without_metadata(net):
+    tmp = dict(net._get_raw_data())
+    tmp["device"] = []
+    for dev in net._children:
+        d = dict(dev._get_raw_data())
+        d["value"] = []
+        for val in dev._children:
+            v = dict(val._get_raw_data())
+            v["state"] = [s.get_data() for s in val._children]
+            d["value"].append(v)
+        tmp["device"].append(d)
+    return tmp
+
+
+def _encode(get_data, cls, runs):
+    return common.best_of(runs, lambda: json.dumps(get_data(), cls=cls))
+
+
+def main():
+    net = _network(DEVICES)
+    runs = 5
+
+    before, old = _encode(lambda: _get_data_without_metadata(net), ChainEncoder, runs)
+    after, new = _encode(net.get_data, util.QZigEncoder, runs)
+    assert json.loads(old) == json.loads(new)
+
+    print("%d devices, %d bytes" % (DEVICES, len(new)))
+    print("isinstance chain: %7.1f ms" % (before * 1000))
+    print("QZigEncoder:      %7.1f ms" % (after * 1000))
+
+
+if __name__ == "__main__":
+    main()
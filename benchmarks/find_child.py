@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Id lookup speed for server requests
+
+Builds networks of 10 to 10,000 devices with on/off, temperature,
+humidity and diagnostics values and resolves state ids the way
+Application.put/get/delete do. The recursive scan over the model tree
+that Network._find_child used before is kept here for comparison.
+
+Run from the repository root::
+
+    python -m benchmarks.find_child
+
+"""
+import random
+
+from benchmarks import common
+import qzig.device as device
+import qzig.model as model
+import qzig.network as network
+
+SIZES = [10, 100, 1000, 10000]
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+LOOKUPS = 1000
+
+
+class App():
+    _gateway = None
+
+
+def _network(devices):
+    net = network.Network(App(), "bench")
+    for i in range(devices):
+        dev = device.Device(net)
+        net._add_child(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    return net
+
+
+def _lookup(find, ids):
+    for id in ids:
+        assert find(id) is not None
+
+
+def main():
+    random.seed(1)
+    print("%8s %8s %14s %14s" % ("devices", "states", "scan", "index"))
+    for size in SIZES:
+        net = _network(size)
+        states = [s.id for d in net._children for v in d._children for s in v._children]
+        ids = [random.choice(states) for i in range(LOOKUPS)]
+
+        scanned = ids[:max(10, LOOKUPS * 10 // size)]
+        scan = common.timed(_lookup, lambda id: model.Model._find_child(net, id), scanned)[0] / len(scanned)
+        index = common.timed(_lookup, net._find_child, ids)[0] / len(ids)
+
+        print("%8d %8d %11.2f us %11.2f us" % (size, len(states), scan * 1e6, index * 1e6))
+
+
+if __name__ == "__main__":
+    main()
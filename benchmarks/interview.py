@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Startup interview time of a network of slow devices
+
+Interviews 200 new devices with a basic and an on/off cluster through
+Application._load_devices. Every radio request takes 20 ms. The
+interview runs one device at a time and with the default cap of 8
+devices.
+
+Run from the repository root::
+
+    python -m benchmarks.interview
+
+"""
+import asyncio
+import logging
+import tempfile
+
+from benchmarks import common
+import qzig.application as application
+
+DEVICES = 200
+LATENCY = .02
+
+
+class Cluster():
+    def __init__(self, cluster_id):
+        self.cluster_id = cluster_id
+
+    @asyncio.coroutine
+    def read_attributes(self, attributes, **kwargs):
+        yield from asyncio.sleep(LATENCY)
+        if self.cluster_id == 0:
+            return [{a: b"bench" if a in (4, 5, 10) else 1 for a in attributes}, {}]
+        return [{a: 0 for a in attributes}, {}]
+
+    @asyncio.coroutine
+    def bind(self, *args):
+        yield from asyncio.sleep(LATENCY)
+
+    def add_listener(self, listener):
+        pass
+
+
+class Endpoint():
+    def __init__(self):
+        self.in_clusters = {0: Cluster(0), 6: Cluster(6)}
+        self.out_clusters = {}
+
+
+class Device():
+    def __init__(self, i):
+        self.ieee = "00:00:00:00:00:00:%02x:%02x" % (i // 256, i % 256)
+        self.endpoints = {0: None, 1: Endpoint()}
+        self.zdo = Cluster(-1)
+
+
+class ZigBee():
+    def __init__(self):
+        self._devices = [(d.ieee, d) for d in map(Device, range(DEVICES))]
+
+    def devices(self):
+        return self._devices
+
+
+def _interview(concurrency):
+    with tempfile.TemporaryDirectory() as rootdir:
+        app = application.Application("/dev/null", "bench", rootdir=rootdir + "/", snapshot=False,
+                                      interview_concurrency=concurrency)
+        app._zb = ZigBee()
+        elapsed, _ = common.timed(common.run, app._load_devices())
+        app._network._close()
+    return elapsed
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for concurrency in [1, 8]:
+        print("concurrency %d: %6.2f s" % (concurrency, _interview(concurrency)))
+
+
+if __name__ == "__main__":
+    main()
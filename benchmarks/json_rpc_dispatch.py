@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Latency of concurrent server requests
+
+Sends 100 state PUTs spread over 50 mock devices. Every tenth device is a
+sleepy device that needs 500 ms to handle a control, the others need
+20 ms. Reports the latency from receiving a request until its result is
+written, with one request at a time and with the default concurrency.
+
+Run from the repository root::
+
+    python -m benchmarks.json_rpc_dispatch
+
+"""
+import asyncio
+import json
+import time
+
+import qzig.json_rpc as json_rpc
+
+DEVICES = 50
+REQUESTS = 100
+
+
+class MockApp():
+    def request_key(self, url):
+        return url.split("/")[2]
+
+    @asyncio.coroutine
+    def put(self, url, data):
+        device = int(self.request_key(url))
+        yield from asyncio.sleep(.5 if device % 10 == 0 else .02)
+        return True
+
+
+class MockTransport():
+    def __init__(self, sent):
+        self._sent = sent
+        self.latency = []
+        self.done = asyncio.Future()
+
+    def write(self, data):
+        for rpc in json_rpc.JsonStream().feed(data):
+            self.latency.append(time.perf_counter() - self._sent[rpc["id"]])
+        if len(self.latency) == len(self._sent):
+            self.done.set_result(True)
+
+    def close(self):
+        pass
+
+
+def _run(loop, concurrency):
+    sent = {}
+    rpc = json_rpc.JsonRPC(MockApp(), asyncio.Future(), concurrency=concurrency)
+    transport = MockTransport(sent)
+    rpc.connection_made(transport)
+
+    for i in range(REQUESTS):
+        url = "/device/%d/value/0/state/%d" % (i % DEVICES, i)
+        sent[i] = time.perf_counter()
+        rpc.data_received(json.dumps({"jsonrpc": "2.0", "id": i, "method": "PUT", "params": {"url": url, "data": {}}}).encode())
+
+    loop.run_until_complete(transport.done)
+    rpc.close()
+
+    latency = sorted(transport.latency)
+    return sum(latency) / len(latency), latency[len(latency) // 2], latency[-1]
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    print("%d PUTs over %d devices" % (REQUESTS, DEVICES))
+    for concurrency in [1, 10, 50]:
+        mean, median, worst = _run(loop, concurrency)
+        print("concurrency %3d: mean %7.3f s median %7.3f s max %7.3f s" % (concurrency, mean, median, worst))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Throughput of the JSON-RPC stream decoder
+
+Feeds thousands of state PUT requests into JsonRPC.data_received, both
+coalesced into large chunks and fragmented into small chunks, and reports
+the decoded messages per second.
+
+Run from the repository root::
+
+    python -m benchmarks.json_rpc_stream
+
+"""
+import json
+import uuid
+
+from benchmarks import common
+import qzig.json_rpc as json_rpc
+
+
+class Counter(json_rpc.JsonRPC):
+    def __init__(self):
+        super().__init__(None)
+        self.count = 0
+
+    def _handle_request(self, rpc):
+        self.count += 1
+
+    def _handle_result(self, rpc):
+        self.count += 1
+
+
+def _messages(count):
+    data = b""
+    for i in range(count):
+        id = str(uuid.uuid4())
+        rpc = {
+            "jsonrpc": "2.0",
+            "id": str(i),
+            "method": "PUT",
+            "params": {
+                "url": "/state/" + id,
+                "data": {
+                    ":id": id,
+                    ":type": "urn:seluxit:xml:bastard:state-1.1",
+                    "data": "Tëst \\ \"quoted\" {%d}" % i,
+                    "timestamp": "2017-05-19T10:16:28Z",
+                    "type": "Control"
+                }
+            }
+        }
+        data += json.dumps(rpc, ensure_ascii=False).encode()
+    return data
+
+
+def _run(data, chunk_size, expected):
+    rpc = Counter()
+
+    def _feed():
+        for i in range(0, len(data), chunk_size):
+            rpc.data_received(data[i:i + chunk_size])
+    elapsed, _ = common.timed(_feed)
+    assert rpc.count == expected, rpc.count
+    return elapsed
+
+
+def main():
+    count = 5000
+    data = _messages(count)
+    print("%d messages, %d bytes" % (count, len(data)))
+
+    for chunk_size in [len(data), 65536, 1460, 100, 7]:
+        elapsed = _run(data, chunk_size, count)
+        print("chunk %8d bytes: %8.3f s %10.0f msg/s %8.2f MB/s" % (
+            chunk_size, elapsed, count / elapsed, len(data) / elapsed / 1e6))
+
+
+if __name__ == "__main__":
+    main()
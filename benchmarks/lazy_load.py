@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Boot time and resident model memory with eager and lazy loading
+
+Builds a network of 2,000 devices with on/off, temperature, humidity
+and diagnostics values in the JSON directory tree store, and restores it
+with Network._load fully and in lazy mode. The memory is what the
+restored network holds, measured with tracemalloc.
+
+Run from the repository root::
+
+    python -m benchmarks.lazy_load
+
+"""
+import asyncio
+import gc
+import tempfile
+import tracemalloc
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+
+DEVICES = 2000
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class App():
+    _gateway = None
+
+
+def _network(rootdir, lazy):
+    net = network.Network(App(), "bench")
+    net._rootdir = rootdir
+    net._lazy = lazy
+    return net
+
+
+def _load(rootdir, lazy):
+    gc.collect()
+    net = _network(rootdir, lazy)
+    elapsed, _ = common.timed(common.run, net._load())
+    data, _ = common.timed(net.get_data)
+    net._close()
+    del net
+
+    gc.collect()
+    tracemalloc.start()
+    net = _network(rootdir, lazy)
+    asyncio.get_event_loop().run_until_complete(net._load())
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    net._close()
+    return elapsed, data, size
+
+
+def main():
+    with tempfile.TemporaryDirectory() as rootdir:
+        rootdir += "/"
+
+        net = _network(rootdir, False)
+        for i in range(DEVICES):
+            dev = device.Device(net)
+            net._add_child(dev)
+            for cluster in CLUSTERS:
+                dev.add_value(1, cluster)
+        net._save()
+        net._close()
+        models = len(net._index) + 1
+        del net, dev
+
+        results = [("eager", _load(rootdir, False)), ("lazy", _load(rootdir, True))]
+
+    print("%d devices, %d models" % (DEVICES, models))
+    for name, (elapsed, data, size) in results:
+        print("%-6s load %6.0f ms, get_data %6.0f ms, %6.1f MB" % (name, elapsed * 1000, data * 1000, size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
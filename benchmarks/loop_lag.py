@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Event loop lag while the store is written
+
+Builds a network of 500 devices with on/off, temperature, humidity and
+diagnostics values in a temporary store, marks every state changed and
+flushes the store every 100 ms for 2 seconds, while a LoopLag monitor
+samples the loop every 5 ms. Writing on the event loop, as the flusher
+did before, is compared with writing on the persistence thread.
+
+Run from the repository root::
+
+    python -m benchmarks.loop_lag
+
+"""
+import asyncio
+import tempfile
+
+import qzig.device as device
+import qzig.network as network
+import qzig.util as util
+
+DEVICES = 500
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+FLUSHES = 20
+
+
+class App():
+    _gateway = None
+
+
+def _network(rootdir):
+    net = network.Network(App(), "bench")
+    net._rootdir = rootdir
+    for i in range(DEVICES):
+        dev = device.Device(net)
+        net._add_child(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    net._save()
+    net._flush()
+    return net
+
+
+@asyncio.coroutine
+def _run(net, flush):
+    states = [s for d in net._children for v in d._children for s in v._children]
+    lag = util.LoopLag(.005)
+    task = asyncio.ensure_future(lag.run())
+    for i in range(FLUSHES):
+        for s in states:
+            s._save()
+        yield from flush()
+        yield from asyncio.sleep(.1)
+    task.cancel()
+    return lag, len(states)
+
+
+@asyncio.coroutine
+def _inline(net):
+    net._flush()
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory() as rootdir:
+        net = _network(rootdir + "/")
+        inline, count = loop.run_until_complete(_run(net, lambda: _inline(net)))
+        thread, count = loop.run_until_complete(_run(net, net._flush_async))
+        net._close()
+
+    print("%d states written %d times" % (count, FLUSHES))
+    print("%-20s %9s %9s" % ("", "max lag", "mean lag"))
+    print("%-20s %6.1f ms %6.1f ms" % ("on the event loop", inline.max * 1000, inline.mean * 1000))
+    print("%-20s %6.1f ms %6.1f ms" % ("persistence thread", thread.max * 1000, thread.mean * 1000))
+
+
+if __name__ == "__main__":
+    main()
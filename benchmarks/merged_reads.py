@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Attribute reads sent while interviewing devices
+
+Interviews 50 new devices with a basic, an on/off and a poll control
+cluster through Application._load_devices, one device at a time. Every
+radio request takes 20 ms. The reads of the values of a cluster are
+sent one attribute at a time and merged per cluster.
+
+Run from the repository root::
+
+    python -m benchmarks.merged_reads
+
+"""
+import asyncio
+import logging
+import tempfile
+
+from benchmarks import common
+import qzig.application as application
+import qzig.value as value
+
+DEVICES = 50
+LATENCY = .02
+
+requests = []
+
+
+class Cluster():
+    def __init__(self, cluster_id):
+        self.cluster_id = cluster_id
+
+    @asyncio.coroutine
+    def read_attributes(self, attributes, **kwargs):
+        requests.append((self.cluster_id, attributes))
+        yield from asyncio.sleep(LATENCY)
+        if self.cluster_id == 0:
+            return [{a: b"bench" if a in (4, 5, 10) else 1 for a in attributes}, {}]
+        return [{a: 0 for a in attributes}, {}]
+
+    @asyncio.coroutine
+    def bind(self, *args):
+        yield from asyncio.sleep(LATENCY)
+
+    def add_listener(self, listener):
+        pass
+
+
+class Endpoint():
+    def __init__(self):
+        self.in_clusters = {0: Cluster(0), 6: Cluster(6), 0x20: Cluster(0x20)}
+        self.out_clusters = {}
+
+
+class Device():
+    def __init__(self, i):
+        self.ieee = "00:00:00:00:00:00:%02x:%02x" % (i // 256, i % 256)
+        self.endpoints = {0: None, 1: Endpoint()}
+        self.zdo = Cluster(-1)
+
+
+class ZigBee():
+    def __init__(self):
+        self._devices = [(d.ieee, d) for d in map(Device, range(DEVICES))]
+
+    def devices(self):
+        return self._devices
+
+
+def _single_read(self, attribute, manufacturer=None):
+    """Reads every attribute with its own request"""
+    async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+    return async_fun(self._cluster.read_attributes([attribute], allow_cache=False,
+                                                   manufacturer=manufacturer))
+
+
+def _interview(read):
+    del requests[:]
+    merged_read = value.ClusterReader.read
+    value.ClusterReader.read = read
+    with tempfile.TemporaryDirectory() as rootdir:
+        app = application.Application("/dev/null", "bench", rootdir=rootdir + "/", snapshot=False,
+                                      interview_concurrency=1)
+        app._zb = ZigBee()
+        elapsed, _ = common.timed(common.run, app._load_devices())
+        app._network._close()
+    value.ClusterReader.read = merged_read
+    reads = len([r for r in requests if r[0] != 0])
+    return elapsed, reads
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for name, read in [("single", _single_read), ("merged", value.ClusterReader.read)]:
+        elapsed, reads = _interview(read)
+        print("%s: %6.2f s, %4d value reads (%.1f per device)" % (name, elapsed, reads, reads / DEVICES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Memory held by the model tree per device
+
+Builds a network of 2,000 devices with on/off, temperature, humidity
+and diagnostics values and reports the bytes per device, measured with
+tracemalloc.
+
+Run from the repository root::
+
+    python -m benchmarks.model_memory
+
+"""
+import gc
+import tracemalloc
+
+import qzig.device as device
+import qzig.network as network
+
+DEVICES = 2000
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class App():
+    _gateway = None
+
+
+def main():
+    net = network.Network(App(), "bench")
+    gc.collect()
+    tracemalloc.start()
+    for i in range(DEVICES):
+        dev = device.Device(net)
+        net._add_child(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    net.get_data()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("%d devices, %d models" % (DEVICES, len(net._index)))
+    print("%d bytes per device" % (size / DEVICES))
+
+
+if __name__ == "__main__":
+    main()
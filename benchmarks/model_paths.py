@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Path and RPC URL construction for a state report
+
+Builds a network with one device, value and state and times the store
+path, the name and the RPC URL of the state the way a report uses them.
+
+Run from the repository root::
+
+    python -m benchmarks.model_paths
+
+"""
+import timeit
+
+import qzig.device as device
+import qzig.network as network
+
+NUMBER = 200000
+
+
+class App():
+    _gateway = None
+
+    def _send_put(self, url, data):
+        pass
+
+
+def main():
+    net = network.Network(App(), "bench")
+    dev = device.Device(net)
+    net._add_child(dev)
+    s = dev.add_value(1, 0x0006)[0]._children[0]
+
+    for name, stmt in [("path", lambda: s._path), ("name", lambda: s.name),
+                       ("send_put", lambda: s._send_put("", None))]:
+        elapsed = min(timeit.repeat(stmt, number=NUMBER, repeat=5))
+        print("%-10s %8.0f ns" % (name, elapsed / NUMBER * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Reconciliation of the local devices with the controller and the server
+
+Builds networks of 100 to 10,000 devices. The controller table misses
+every tenth device and the server lists every device plus 10% unknown
+ids. Times finding the devices to remove from the network and the ids
+to delete on the server. The nested loop and the per id lookup used
+before are kept here for comparison.
+
+Run from the repository root::
+
+    python -m benchmarks.reconcile
+
+"""
+import uuid
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+
+SIZES = [100, 1000, 10000]
+
+
+class App():
+    _gateway = None
+
+
+def _network(devices):
+    net = network.Network(App(), "bench")
+    for i in range(devices):
+        dev = device.Device(net)
+        dev.attr["ieee"] = "00:00:00:00:00:00:%02x:%02x" % (i // 256, i % 256)
+        net._add_child(dev)
+    return net
+
+
+def _old_unknown(net, ieees):
+    remove = []
+    for dev in net._children:
+        found = False
+        for ie in ieees:
+            if str(dev.ieee) == str(ie):
+                found = True
+                break
+        if not found:
+            remove.append(dev)
+    return remove
+
+
+def _new_unknown(net, ieees):
+    known = set(str(ieee) for ieee in ieees)
+    return [dev for dev in net._children if str(dev.ieee) not in known]
+
+
+def _old_server(net, ids):
+    return [id for id in ids if net._get_device("", id) is None]
+
+
+def _new_server(net, ids):
+    known = set(dev.id for dev in net._children)
+    return [id for id in ids if id not in known]
+
+
+def _time(fn, *args):
+    elapsed, res = common.timed(fn, *args)
+    return elapsed, len(res)
+
+
+def main():
+    print("%8s %22s %22s" % ("devices", "controller old/new", "server old/new"))
+    for size in SIZES:
+        net = _network(size)
+        ieees = [d.ieee for i, d in enumerate(net._children) if i % 10]
+        ids = [d.id for d in net._children] + [str(uuid.uuid4()) for i in range(size // 10)]
+
+        old, removed = _time(_old_unknown, net, ieees)
+        new, count = _time(_new_unknown, net, ieees)
+        assert count == removed
+        old_server, deleted = _time(_old_server, net, ids)
+        new_server, count = _time(_new_server, net, ids)
+        assert count == deleted
+        print("%8d %9.1f ms %7.2f ms %9.2f ms %7.2f ms" % (
+            size, old * 1000, new * 1000, old_server * 1000, new_server * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Attribute reports per second with persistence on
+
+Builds a network of 100 devices with an on/off value each in a
+temporary store and feeds 20,000 attribute reports through
+State.attribute_updated. Writing the state to the store inline on every
+report, as Model._save did before, is compared with marking the state
+dirty and flushing the changed objects once per 1,000 reports, which is
+what the application flusher does on its interval.
+
+Run from the repository root::
+
+    python -m benchmarks.report_persistence
+
+"""
+import tempfile
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+import qzig.state as state
+import qzig.util  # noqa: F401
+
+DEVICES = 100
+REPORTS = 20000
+FLUSH_EVERY = 1000
+
+
+class App():
+    _gateway = None
+
+    def _send_put(self, url, data):
+        pass
+
+
+def _network(rootdir):
+    net = network.Network(App(), "bench")
+    net._rootdir = rootdir
+    for i in range(DEVICES):
+        dev = device.Device(net)
+        net._add_child(dev)
+        dev.add_value(1, 0x0006)
+    net._flush()
+    return net
+
+
+def _report_states(net):
+    return [d._children[0]._get_state(state.StateType.REPORT) for d in net._children]
+
+
+def _inline(net):
+    states = _report_states(net)
+
+    def _report():
+        for i in range(REPORTS):
+            s = states[i % len(states)]
+            s.attribute_updated(0, i & 1)
+            net._flush()
+    return REPORTS / common.timed(_report)[0]
+
+
+def _write_behind(net):
+    states = _report_states(net)
+
+    def _report():
+        for i in range(REPORTS):
+            states[i % len(states)].attribute_updated(0, i & 1)
+            if i % FLUSH_EVERY == FLUSH_EVERY - 1:
+                net._flush()
+        net._flush()
+    return REPORTS / common.timed(_report)[0]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as rootdir:
+        net = _network(rootdir + "/")
+        inline = _inline(net)
+        behind = _write_behind(net)
+
+    print("%d reports on %d states" % (REPORTS, DEVICES))
+    print("inline write: %9.0f reports/s" % inline)
+    print("write-behind: %9.0f reports/s" % behind)
+
+
+if __name__ == "__main__":
+    main()
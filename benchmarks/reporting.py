@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Attribute reports sent by a device in a day
+
+Simulates one day of a slowly drifting, noisy temperature and humidity
+sensor, sampled every second, and counts the reports it sends with the
+reporting profiles of the qzig values. The device default is taken to be
+a report on every change, at most once a second and at least every five
+minutes.
+
+Run from the repository root::
+
+    python -m benchmarks.reporting
+
+"""
+import math
+import random
+
+import qzig.reporting as reporting
+from qzig.values import humidity, temperature
+
+DAY = 24 * 3600
+DEFAULT = reporting.Profile(1, 300, 1)
+
+
+def _reports(profile, samples):
+    """Counts the reports the ZCL reporting rules give for the samples"""
+    count = 0
+    last_time, last_value = -profile.max_interval, None
+    for now, v in enumerate(samples):
+        since = now - last_time
+        if since < profile.min_interval:
+            continue
+        changed = last_value is None or abs(v - last_value) >= profile.reportable_change
+        if changed or since >= profile.max_interval:
+            count += 1
+            last_time, last_value = now, v
+    return count
+
+
+def _samples(mean, swing, noise, seed):
+    rnd = random.Random(seed)
+    return [int(mean + swing * math.sin(2 * math.pi * t / DAY) + rnd.gauss(0, noise)) for t in range(DAY)]
+
+
+def main():
+    sensors = [
+        ("temperature", temperature.Temperature._reporting, _samples(2100, 300, 5, 1)),
+        ("humidity", humidity.Humidity._reporting, _samples(4500, 1000, 20, 2)),
+    ]
+    for name, profile, samples in sensors:
+        print("%-11s: default %6d reports, profile %4d reports" % (
+            name, _reports(DEFAULT, samples), _reports(profile, samples)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Cold boot model restore from the store tree and from a snapshot
+
+Builds a network of 2,000 devices with on/off, temperature, humidity
+and diagnostics values, writes it to the JSON directory tree store and
+to a snapshot, and restores it with Network._load from each.
+
+Run from the repository root::
+
+    python -m benchmarks.snapshot_load
+
+"""
+import gc
+import os
+import tempfile
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+import qzig.store as store
+
+DEVICES = 2000
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class App():
+    _gateway = None
+
+
+def _network(rootdir, snapshot):
+    net = network.Network(App(), "bench")
+    net._rootdir = rootdir
+    if snapshot:
+        net._snapshot = store.Snapshot(rootdir + "snapshot.json")
+    return net
+
+
+def _load(net):
+    gc.collect()
+    elapsed, _ = common.timed(common.run, net._load())
+    net._close()
+    return elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as rootdir:
+        rootdir += "/"
+
+        net = _network(rootdir, True)
+        for i in range(DEVICES):
+            dev = device.Device(net)
+            net._add_child(dev)
+            for cluster in CLUSTERS:
+                dev.add_value(1, cluster)
+        net._save()
+        net._close()
+        models = len(net._index) + 1
+        del net, dev
+
+        tree = _load(_network(rootdir, False))
+        snapshot = _load(_network(rootdir, True))
+        size = os.path.getsize(rootdir + "snapshot.json")
+
+    print("%d devices, %d models, snapshot %d kB" % (DEVICES, models, size / 1024))
+    print("store tree: %7.0f ms" % (tree * 1000))
+    print("snapshot:   %7.0f ms" % (snapshot * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Startup load and full write time of the model stores
+
+Builds a network of 1,000 devices with on/off, temperature, humidity
+and diagnostics values, writes it with the JSON directory tree store,
+migrates it into the SQLite store and loads it back with both.
+
+Run from the repository root::
+
+    python -m benchmarks.store_load
+
+"""
+import tempfile
+
+from benchmarks import common
+import qzig.device as device
+import qzig.network as network
+import qzig.store as store
+
+DEVICES = 1000
+CLUSTERS = [0x0006, 0x0402, 0x0405, 0x0B05]
+
+
+class App():
+    _gateway = None
+
+
+def _network(rootdir, model_store):
+    net = network.Network(App(), "bench")
+    net._rootdir = rootdir
+    net._store = model_store
+    return net
+
+
+def _write(net):
+    for i in range(DEVICES):
+        dev = device.Device(net)
+        net._add_child(dev)
+        for cluster in CLUSTERS:
+            dev.add_value(1, cluster)
+    net._save()
+    elapsed, count = common.timed(net._flush)
+    return count, elapsed
+
+
+def _load(net):
+    return common.timed(common.run, net._load())[0]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as rootdir:
+        rootdir += "/"
+        root = rootdir + "store/"
+
+        count, file_write = _write(_network(rootdir, store.FileStore()))
+        file_load = _load(_network(rootdir, store.FileStore()))
+
+        sqlite = store.SqliteStore(rootdir + "store.db", root)
+        sqlite_load = _load(_network(rootdir, sqlite))
+        sqlite.close()
+
+        sqlite = store.SqliteStore(rootdir + "write.db", root + "none/")
+        count, sqlite_write = _write(_network(rootdir, sqlite))
+        sqlite.close()
+
+    print("%d devices, %d models" % (DEVICES, count))
+    print("%-8s %10s %10s" % ("store", "write", "load"))
+    print("%-8s %7.0f ms %7.0f ms" % ("file", file_write * 1000, file_load * 1000))
+    print("%-8s %7.0f ms %7.0f ms" % ("sqlite", sqlite_write * 1000, sqlite_load * 1000))
+
+
+if __name__ == "__main__":
+    main()
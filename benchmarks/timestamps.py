@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Timestamp cost on the state report path
+
+Times taking a timestamp the way Model._get_timestamp did before, with
+the shared timestamp provider, and a complete State.attribute_updated
+with the RPC send stubbed out.
+
+Run from the repository root::
+
+    python -m benchmarks.timestamps
+
+"""
+import datetime
+import timeit
+
+import qzig.device as device
+import qzig.network as network
+import qzig.state as state
+import qzig.timestamp as timestamp
+
+NUMBER = 100000
+
+
+class App():
+    _gateway = None
+
+    def _send_put(self, url, data):
+        pass
+
+
+def _formatted():
+    t = str(datetime.datetime.utcnow()).split('.')[0]
+    return t.replace(" ", "T") + 'Z'
+
+
+def main():
+    net = network.Network(App(), "bench")
+    dev = device.Device(net)
+    net._add_child(dev)
+    s = dev.add_value(1, 0x0006)[0]._get_state(state.StateType.REPORT)
+
+    for name, stmt in [("formatted", _formatted), ("provider", timestamp.now),
+                       ("report", lambda: s.attribute_updated(0, 1))]:
+        elapsed = min(timeit.repeat(stmt, number=NUMBER, repeat=5))
+        print("%-10s %8.0f ns" % (name, elapsed / NUMBER * 1e9))
+
+
+if __name__ == "__main__":
+    main()
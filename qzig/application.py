@@ -9,6 +9,9 @@ import qzig.zigbee as zigbee
 import qzig.json_rpc as json_rpc
 import qzig.network as network
 import qzig.gateway as gateway
+import qzig.store as store
+import qzig.util
+import qzig.value
 
 LOGGER = logging.getLogger(__name__)
 
@@ -20,6 +23,8 @@ class Application():
 
         :param device: The serial device to connect the ZigBee to
         :param network_id: The network id to use
+        :param spool: Directory below rootdir where requests are stored on
+            disk while the server is unreachable, off if not set
 
         """
         self._dev = device
@@ -35,12 +40,35 @@ class Application():
         self._database = options.get("database") or "qzig.db"
         self._gateway = options.get("gateway") or gateway.Gateway
         self._transport = options.get("transport") or json_rpc
+        self.rpc_options = dict(options.get("rpc_options") or {})
         self._loop = options.get("loop") or asyncio.get_event_loop()
+        self._flush_interval = options.get("flush_interval") or 1
+        self._flush_task = None
+        self.loop_lag = qzig.util.LoopLag(options.get("lag_interval") or 1)
+        self._lag_task = None
 
         rootdir = options.get("rootdir")
         if rootdir:
             self._database = rootdir + self._database
             self._network._rootdir = rootdir
+        if options.get("spool"):
+            self.rpc_options.setdefault("spool", (rootdir or "") + options["spool"])
+            # The spool is written on the persistence thread
+            self.rpc_options.setdefault("run_io", self._network._run_io)
+
+        if options.get("store") == "sqlite":
+            self._network._store = store.SqliteStore((rootdir or "") + "store.db", self._network._path)
+        self._network._lazy = bool(options.get("lazy"))
+        if options.get("snapshot", True) and not self._network._lazy:
+            self._network._snapshot = store.Snapshot((rootdir or "") + "snapshot.json")
+        self._snapshot_interval = options.get("snapshot_interval") or 600
+        self._interview_concurrency = options.get("interview_concurrency") or 8
+        self._interview_timeout = options.get("interview_timeout") or 60
+        self.interview = {"total": 0, "done": 0, "failed": 0}
+        self._retry_interview = set()
+        self._interview_sem = None
+        # Hits and misses of the attribute cache, to tune the TTLs
+        self.attribute_cache = qzig.value.ClusterReader.stats
 
     def run(self):  # pragma: no cover
         """Main event loop"""
@@ -65,6 +93,10 @@ class Application():
         yield from self._connect()
         yield from self._load()
         self._send_full_network()
+        yield from self._network._flush_async()
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        self._flush_task = async_fun(self._flush_changes())
+        self._lag_task = async_fun(self.loop_lag.run())
         yield from self._clean_server_devices()
 
     @asyncio.coroutine
@@ -77,42 +109,107 @@ class Application():
     def close(self):
         """Closes the connection to zigbee and server"""
         try:
-            if hasattr(self, "_zb"):
-                self._zb.close()
+            for task in (self._flush_task, self._lag_task):
+                if task is not None:
+                    task.cancel()
+            self._flush_task = self._lag_task = None
             if hasattr(self, "_rpc"):
+                # Closes the spool before the persistence thread is stopped
                 self._rpc.close()
+            self._network._close()
+            if hasattr(self, "_zb"):
+                self._zb.close()
         except Exception:  # pragma: no cover
             e = sys.exc_info()[0]
             LOGGER.exception(e)
 
+    @asyncio.coroutine
+    def _flush_changes(self):
+        snapshot = self._loop.time() + self._snapshot_interval
+        while True:
+            yield from asyncio.sleep(self._flush_interval)
+            yield from self._network._flush_async()
+            if self._loop.time() >= snapshot:
+                snapshot = self._loop.time() + self._snapshot_interval
+                yield from self._network._save_snapshot()
+
     def _load(self):
-        self._network._load()
+        yield from self._network._load()
+        yield from self._load_devices()
+        yield from self._remove_unknown_devices()
 
-        while True:
-            try:
-                yield from self._load_devices()
-                break
-            except RuntimeError as e:  # pragma: no cover
-                # Handle the error that the list of devices changes while looping it.
-                LOGGER.warning(e)
-
-        remove = []
-        for dev in self._network._children:
-            found = False
-            if dev.ieee != "gateway":
-                for ie in self._zb.ieees():
-                    if str(dev.ieee) == str(ie):
-                        found = True
-                        break
-                if not found:
-                    remove.append(dev)
-
-        for dev in remove:
-            self._network.remove_device(dev)
+    @asyncio.coroutine
+    def _remove_unknown_devices(self):
+        """Removes the devices that are no longer known by the ZigBee controller"""
+        ieees = set(str(ieee) for ieee in self._zb.ieees())
+        ieees.add("gateway")
+        remove = [dev for dev in self._network._children if str(dev.ieee) not in ieees]
+        if remove:
+            yield from self._network.remove_devices(remove)
 
+    @asyncio.coroutine
     def _load_devices(self):
-        for ieee, dev in self._zb.devices():
-            yield from self._network.add_device(dev)
+        """Interviews the known ZigBee devices concurrently
+
+        At most interview_concurrency devices are interviewed at the same
+        time, and each interview is given interview_timeout seconds. A
+        device that fails or times out is logged and does not stop the
+        others.
+
+        """
+        devices = [dev for ieee, dev in self._zb.devices()]
+        self.interview = {"total": len(devices), "done": 0, "failed": 0}
+        self._interview_sem = asyncio.Semaphore(self._interview_concurrency)
+        yield from asyncio.gather(*[self._interview_device(dev) for dev in devices])
+
+    @asyncio.coroutine
+    def _interview_device(self, dev, retry=False):
+        """Interviews a device, at most interview_concurrency at a time
+
+        :param dev: The ZigBee device to interview
+        :param retry: The device is interviewed again after a timeout
+
+        """
+        with (yield from self._interview_sem):
+            interviewed = yield from self._interview(dev)
+        if retry:
+            # The device was counted as failed by its first interview
+            if interviewed:
+                self.interview["failed"] -= 1
+            return
+
+        if not interviewed:
+            self.interview["failed"] += 1
+
+        self.interview["done"] += 1
+        LOGGER.info("Interviewed %d of %d devices (%d failed)",
+                    self.interview["done"], self.interview["total"], self.interview["failed"])
+
+    @asyncio.coroutine
+    def _interview(self, dev):
+        """Interviews a device within interview_timeout seconds
+
+        Only the reads and binds are given interview_timeout seconds. A
+        device that times out keeps its values without the data that was
+        not read, and is interviewed again when it joins the network again.
+
+        :param dev: The ZigBee device to interview
+        :returns: True if the device was interviewed
+        :rtype: Boolean
+
+        """
+        try:
+            yield from self._network.add_device(dev, timeout=self._interview_timeout)
+        except asyncio.TimeoutError:
+            LOGGER.warning("Interview of device %s timed out, retrying when it joins", dev.ieee)
+            self._retry_interview.add(str(dev.ieee))
+            return False
+        except Exception:
+            LOGGER.exception("Interview of device %s failed", dev.ieee)
+            return False
+
+        self._retry_interview.discard(str(dev.ieee))
+        return True
 
     def _send_put(self, url, data):
         """Sends a RPC PUT request
@@ -140,9 +237,16 @@ class Application():
         """
         self._rpc.delete(url)
 
+    def _send_delete_many(self, urls):
+        """Sends RPC DELETE requests for many urls
+
+        :param urls: The URLs for the rpc calls
+
+        """
+        self._rpc.delete_many(urls)
+
     def _send_full_network(self):
         self._rpc.post("/network", self._network.get_data())
-        self._network._save()
 
     @asyncio.coroutine
     def _permit(self, timeout):
@@ -175,10 +279,9 @@ class Application():
         if isinstance(devices["id"], str):
             devices["id"] = [devices["id"]]  # pragma: nocover
 
-        for id in devices["id"]:
-            dev = self._network._get_device("", id)
-            if dev is None:
-                self._rpc.delete("/network/" + self._network.id + "/device/" + id)
+        known = set(dev.id for dev in self._network._children)
+        url = "/network/" + self._network.id + "/device/"
+        self._rpc.delete_many([url + id for id in devices["id"] if id not in known])
 
     def _split_url(self, url):
         path = url.split("/")
@@ -211,6 +314,7 @@ class Application():
 
         """
         LOGGER.debug("Device removed %s", str(device.ieee))
+        self._retry_interview.discard(str(device.ieee))
         self._network.remove_device(device)
 
     def device_joined(self, device):
@@ -221,6 +325,9 @@ class Application():
         """
         if self._installcode is None:
             LOGGER.debug("Device joined %s", str(device.ieee))
+            if str(device.ieee) in self._retry_interview:
+                async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+                async_fun(self._interview_device(device, retry=True))
             gw = self._network._get_device("gateway")
             val = gw.get_value(-1, -1)
             if hasattr(val, "_report_fut"):
@@ -262,7 +369,39 @@ class Application():
         """
         LOGGER.debug("Attributes updated %d %d %d", cluster, attrid, value)
 
+    def rpc_reconnected(self):
+        """Callback when the connection to the server has been reestablished
+
+        The server is updated with the full network, as changes could have
+        been lost together with the old connection.
+
+        """
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        async_fun(self._resync())
+
+    @asyncio.coroutine
+    def _resync(self):
+        self._send_full_network()
+        yield from self._clean_server_devices()
+
     # RPC calls
+    def request_key(self, url):
+        """Gets the key used to order requests to the same device
+
+        :param url: The url of the request
+        :returns: The id of the device the url points to, or the url
+        :rtype: String
+
+        """
+        service, id = self._split_url(url)
+        obj = self._network._find_child(id)
+        while obj is not None and obj is not self._network:
+            if obj.name == "device":
+                return obj.id
+            obj = obj._parent
+
+        return url
+
     @asyncio.coroutine
     def put(self, url, data):
         """PUT request handler
@@ -310,7 +449,8 @@ class Application():
     def get(self, url, data=None):
         """Get request handler
 
-        Only GET on device and state is supported
+        Only GET on device and state is supported. The attributes are
+        read from the device, not from the attribute cache.
 
         :param url: The url the post was send on
         :param data: None
@@ -328,7 +468,7 @@ class Application():
             if s.name != "state" and s.name != "device":
                 return "ID is not a device or state"
 
-            res = yield from s._handle_get()
+            res = yield from s._handle_get(force=True)
             return res
         else:
             return "Invalid service (%s) in url" % service
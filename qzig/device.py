@@ -5,7 +5,11 @@ import enum
 import bellows.zigbee.zcl.clusters.general as general_clusters
 import bellows.zigbee.exceptions as zigbee_exp
 import qzig.model as model
+import qzig.reporting as reporting
+import qzig.state as state
 import qzig.status as status
+import qzig.store as store
+import qzig.value as value
 import qzig.values as values
 
 LOGGER = logging.getLogger(__name__)
@@ -29,11 +33,133 @@ class PowerSource(enum.Enum):
     EMERGENCY_MAINS_AND_TRANSFER_SWITCH_BATTERY_BACKED = 0x86
 
 
+class _LazyCluster():
+    """Listens on a cluster of a device whose values are not loaded yet
+
+    The first event loads the values of the device. The events are then
+    forwarded to the report states of the values on the cluster.
+
+    """
+
+    def __init__(self, device, cluster):
+        self._device = device
+        self._cluster = cluster
+        self._handler = getattr(cluster, "handle_cluster_request", None)
+
+    def _forward(self, method, *args):
+        for v in self._device._children:
+            if getattr(v, "_cluster", None) is not self._cluster:
+                continue
+            rep = v._get_state(state.StateType.REPORT)
+            if rep is None:
+                continue
+            try:
+                getattr(rep, method)(*args)
+            except Exception as e:
+                LOGGER.warning("Error calling listener.%s: %s", method, e)
+
+    def attribute_updated(self, *args):
+        value.ClusterReader.get(self._cluster).attribute_updated(*args)
+        self._forward("attribute_updated", *args)
+
+    def cluster_command(self, *args):
+        self._forward("cluster_command", *args)
+
+    def handle_cluster_request(self, *args):
+        self._device._load_subtree()
+        handler = self._cluster.handle_cluster_request
+        if handler == self.handle_cluster_request:
+            handler = self._handler
+        if handler is not None:
+            return handler(*args)
+
+
 class Device(model.Model):
     """Class to map a zigbee device to a QZig device"""
 
     _child_name = "value"
     _name = "device"
+    _lazy_load = True
+    # The time in seconds the basic cluster attributes are used
+    _info_ttl = 3600
+    _subtree = None
+
+    def __init__(self, parent, load=None):
+        self._values = {}
+        self._deferred = []
+        super().__init__(parent, load)
+
+    @property
+    def _children(self):
+        if self._subtree is not None:
+            self._load_subtree()
+        return self._loaded
+
+    @_children.setter
+    def _children(self, children):
+        self._loaded = children
+
+    @property
+    def _loaded_children(self):
+        return self._loaded
+
+    def _load_children(self, loader=None):
+        """Loads the values and states of the device
+
+        In lazy mode only the saved data is captured, the values and states
+        are created by _load_subtree when they are needed.
+
+        :param loader: The store to load from
+
+        """
+        if not self._parent._lazy or not self._lazy_load:
+            return super()._load_children(loader)
+
+        if loader is None:  # pragma: nocover
+            loader = self._get_store()
+        self._subtree = store.Subtree.capture(loader, self, [value.Value._child_name])
+        self._parent._lazy_add(self)
+
+    def _load_subtree(self):
+        """Creates the values and states of a lazy device"""
+        if self._subtree is None:
+            return
+
+        self._parent._lazy_remove(self)
+        subtree, self._subtree = self._subtree, None
+        model.Model._load_children(self, subtree.read())
+
+        deferred, self._deferred = self._deferred, []
+        for endpoint, e_id, c_id, cluster in deferred:
+            for v in self.add_value(e_id, c_id):
+                v._attach_cluster(endpoint, cluster, listen=False)
+
+    def _subtree_values(self):
+        # Detached values, so the data of a lazy device can be read without
+        # loading it
+        loader = self._subtree.read()
+        vals = []
+        for raw in loader.load_children(self):
+            for v in self._create_child(load=raw):
+                v._children = [v._create_child(load=s) for s in loader.load_children(v)]
+                vals.append(v)
+        return vals
+
+    def _is_saved(self, endpoint_id, cluster_id):
+        cls = values._get_value_class(cluster_id, self._get_manufacturer())
+        if cls is None:
+            return True
+        if not isinstance(cls, list):
+            cls = [cls]
+
+        saved = set(
+            self._value_key(a["endpoint_id"], a["cluster_id"], a.get("index", 0)) for a in self._subtree.attrs)
+        for index, c in enumerate(cls):
+            if c._singleton and endpoint_id != 1:
+                continue
+            if self._value_key(endpoint_id, cluster_id, index) not in saved:
+                return False
+        return True
 
     def _init(self):
         self.data = {
@@ -90,6 +216,14 @@ class Device(model.Model):
 
         return vals
 
+    def _add_child(self, child):
+        self._values[self._value_key(child.endpoint_id, child.cluster_id, child.index)] = child
+        super()._add_child(child)
+
+    @staticmethod
+    def _value_key(endpoint, cluster, index):
+        return (int(endpoint), int(cluster), int(index))
+
     def _rebind(self):
         for v in self._children:
             v._rebind()
@@ -99,11 +233,26 @@ class Device(model.Model):
         return self.attr["ieee"]
 
     @asyncio.coroutine
-    def parse_device(self, dev, post=False):
+    def parse_device(self, dev, post=False, timeout=None):
+        """Interviews the device and creates its values
+
+        When the reads and binds do not finish within timeout, the values
+        are still created and saved, and asyncio.TimeoutError is raised at
+        the end.
+
+        :param dev: The ZigBee device
+        :param post: Should the device and new values be posted to the server
+        :param timeout: Seconds the reads and binds of the interview may take
+
+        """
+        deadline = None if timeout is None else asyncio.get_event_loop().time() + timeout
+        stored = self._stored_data()
+        listen = getattr(self, "_dev", None) is not dev
         self._dev = dev
         self.attr["ieee"] = str(dev.ieee)
+        done = True
         if self.data["version"] == "N/A":
-            yield from self.read_device_info()
+            done = yield from self._until(deadline, self.read_device_info(force=True))
 
         if post:
             self._send_post("", self.get_data())
@@ -115,25 +264,87 @@ class Device(model.Model):
 
             for c_id in endpoint.in_clusters:
                 cluster = endpoint.in_clusters[c_id]
-                yield from self._handle_cluster(endpoint, e_id, c_id, cluster, post)
+                done = (yield from self._handle_cluster(endpoint, e_id, c_id, cluster, post, deadline)) and done
 
             for c_id in endpoint.out_clusters:
                 if c_id in endpoint.in_clusters:
                     continue
                 cluster = endpoint.out_clusters[c_id]
-                yield from self._handle_cluster(endpoint, e_id, c_id, cluster, post)
+                done = (yield from self._handle_cluster(endpoint, e_id, c_id, cluster, post, deadline)) and done
 
-        dev.zdo.add_listener(self)
+        if listen:
+            dev.zdo.add_listener(self)
 
-        self._save()
+        # An unchanged device is not written again, so the snapshot of the
+        # network stays valid when known devices are interviewed at boot
+        if self._stored_data() != stored:
+            self._save()
 
+        if not done:
+            raise asyncio.TimeoutError()
+
+    @staticmethod
     @asyncio.coroutine
-    def _handle_cluster(self, endpoint, e_id, c_id, cluster, post=False):
+    def _until(deadline, coro):
+        """Runs the reads or binds of an interview until the deadline
+
+        :param deadline: The loop time of the deadline, or None to wait
+        :param coro: The coroutine to run
+        :returns: False if the deadline passed before it finished
+        :rtype: Boolean
+
+        """
+        if deadline is None:
+            yield from coro
+            return True
+
+        timeout = deadline - asyncio.get_event_loop().time()
+        if timeout <= 0:
+            coro.close()
+            return False
+        try:
+            yield from asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _stored_data(self):
+        objs = [self]
+        for v in self._loaded_children:
+            objs.append(v)
+            objs.extend(v._loaded_children)
+        return [store._dump(o) for o in objs]
+
+    @asyncio.coroutine
+    def _handle_cluster(self, endpoint, e_id, c_id, cluster, post=False, deadline=None):
+        if self._subtree is not None and not post and self._is_saved(e_id, c_id):
+            # The values are saved and need no binding, wait with loading
+            # them until the cluster is used
+            self._deferred.append((endpoint, e_id, c_id, cluster))
+            listener = _LazyCluster(self, cluster)
+            cluster.add_listener(listener)
+            cluster.handle_cluster_request = listener.handle_cluster_request
+            return True
+
         val = self.add_value(e_id, c_id, post)
         for v in val:
-            yield from v.parse_cluster(endpoint, cluster)
+            v._attach_cluster(endpoint, cluster)
             LOGGER.debug("Adding %s value", v.data["name"])
 
+        val = [v for v in val if v._should_bind]
+        done = yield from self._until(deadline, self._setup_cluster(e_id, c_id, cluster, val))
+        return done
+
+    @asyncio.coroutine
+    def _setup_cluster(self, e_id, c_id, cluster, val):
+        # Bind the cluster once and read the values together, so their
+        # attributes are merged into one read
+        if any(v._bind for v in val):
+            LOGGER.debug("Binding to cluster %s on endpoint %s", c_id, e_id)
+            yield from self._do_bind(e_id, c_id)
+            yield from reporting.configure(cluster, val)
+        yield from asyncio.gather(*[v._handle_get(force=True) for v in val])
+
     def add_value(self, endpoint_id, cluster_id, post=False):
         values = []
         real = self._create_child(endpoint_id=endpoint_id, cluster_id=cluster_id)
@@ -144,8 +355,8 @@ class Device(model.Model):
                     LOGGER.debug("Dropping %s because it is a singleton value", r.data["name"])
                     continue
                 val = r
-                self._children.append(val)
-            val._parent = self
+                self._add_child(val)
+            val._reparent(self)
             values.append(val)
             if post:
                 val._send_post("", val.get_data())
@@ -153,15 +364,19 @@ class Device(model.Model):
         return values
 
     def get_value(self, endpoint, cluster, index=0):
-        try:
-            val = next(v for v in self._children
-                       if str(v.endpoint_id) == str(endpoint) and str(v.cluster_id) == str(cluster) and str(v.index) == str(index))
-        except StopIteration:
-            return None
-        return val
+        if self._subtree is not None:
+            self._load_subtree()
+        return self._values.get(self._value_key(endpoint, cluster, index))
 
     @asyncio.coroutine
-    def read_device_info(self):
+    def read_device_info(self, force=False):
+        """Reads the basic cluster attributes of the device
+
+        Attributes read within _info_ttl seconds are taken from the cache.
+
+        :param force: Read the attributes from the device
+
+        """
         for e_id in self._dev.endpoints:
             if e_id is 0:
                 continue
@@ -172,11 +387,12 @@ class Device(model.Model):
                             str(self._dev.ieee), e_id)
                 continue
             cluster = endp.in_clusters[general_clusters.Basic.cluster_id]
+            reader = value.ClusterReader.get(cluster)
 
             LOGGER.debug("Reading attributes from device %s", str(self._dev.ieee))
             for attr in [[0, 1, 2, 3, 4], [5, 7, 10]]:
                 try:
-                    v = yield from cluster.read_attributes(attr)
+                    v = yield from reader.read_attributes(attr, ttl=self._info_ttl, force=force)
                 except zigbee_exp.DeliveryError:  # pragma: no cover
                     LOGGER.error("Failed to read attributes from device %s", str(self._dev.ieee))
                     return
@@ -184,7 +400,7 @@ class Device(model.Model):
 
             if self.data["manufacturer"] == "Kaercher":
                 try:
-                    v = yield from cluster.read_attributes([0, 1, 2, 3, 4], manufacturer=0x122C)
+                    v = yield from reader.read_attributes([0, 1, 2, 3, 4], 0x122C, self._info_ttl, force)
                 except zigbee_exp.DeliveryError:  # pragma: no cover
                     LOGGER.error("Failed to read attributes from device %s", str(self._dev.ieee))
                     return
@@ -247,7 +463,8 @@ class Device(model.Model):
 
     def get_data(self):
         tmp = self._get_raw_data()
-        for v in self._children:
+        vals = self._children if self._subtree is None else self._subtree_values()
+        for v in vals:
             d = v.get_data()
             if d is not None:
                 tmp["value"].append(d)
@@ -256,10 +473,30 @@ class Device(model.Model):
 
     def device_announce(self, dev):
         LOGGER.debug("Device came online")
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        async_fun(self._check_reporting())
+
+    @asyncio.coroutine
+    def _check_reporting(self):
+        """Configures the reporting again where the device lost it
+
+        A device that rejoins can have lost its reporting configuration, so
+        it is read back and the attributes that differ are configured again.
+        A lazy device is loaded, as a device that does not report would
+        never be loaded otherwise.
+
+        """
+        clusters = {}
+        for v in self._children:
+            if v._reporting is not None and getattr(v, "_cluster", None) is not None:
+                clusters.setdefault(v._cluster, []).append(v)
+
+        for cluster, vals in clusters.items():
+            yield from reporting.configure(cluster, vals, check=True)
 
     @asyncio.coroutine
     def delete(self):
-        self._remove_files()
+        yield from self._remove_files()
 
         v = yield from self._delete_device(self.ieee)
         LOGGER.debug(v)
@@ -274,8 +511,8 @@ class Device(model.Model):
             LOGGER.error("Failed to bind to device")
 
     @asyncio.coroutine
-    def _handle_get(self):
-        yield from self.read_device_info()
+    def _handle_get(self, force=False):
+        yield from self.read_device_info(force)
 
         self._send_post("", self.get_data())
 
@@ -10,6 +10,9 @@ LOGGER = logging.getLogger(__name__)
 class Gateway(device.Device):
     """Class to map a device to genric ZigBee commands"""
 
+    # The gateway adds its values while loading
+    _lazy_load = False
+
     def _init(self):
         self.data = {
             ":type": "urn:seluxit:xml:bastard:device-1.1",
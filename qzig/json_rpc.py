@@ -1,32 +1,206 @@
 import asyncio
+import codecs
+import concurrent.futures
 import logging
 import json
-import traceback
+import random
+import re
 
 import qzig.util
+import qzig.outbox as outbox
 
 LOGGER = logging.getLogger(__name__)
 
 
+class JsonStream():
+    """Splits a byte stream into complete JSON documents
+
+    Complete documents are decoded directly from the buffer. When the buffer
+    ends with a partial document, the nesting depth and string state of the
+    tail are tracked between calls, so only new data is scanned and the
+    document is decoded once, when it is complete.
+
+    """
+    _tokens = re.compile(r'[{}\[\]"\\]')
+    _space = re.compile(r'\s*')
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")("replace")
+        self._buffer = ""
+        self._pos = None
+        self._depth = 0
+        self._string = False
+        self._escape = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """Adds data to the stream
+
+        :param data: The received bytes
+        :returns: The complete documents found in the stream
+        :rtype: List
+
+        """
+        buf = self._buffer + self._utf8.decode(data)
+        docs = []
+        start = 0
+
+        if self._pos is not None:
+            end = self._scan(buf, self._pos)
+            if end is None:
+                self._buffer = buf
+                return docs
+            self._decode(buf, 0, end, docs)
+            start = end
+
+        while True:
+            start = self._space.match(buf, start).end()
+            if start == len(buf):
+                break
+
+            try:
+                doc, start = self._decoder.raw_decode(buf, start)
+                docs.append(doc)
+            except ValueError:
+                self._depth = 0
+                self._string = False
+                self._escape = False
+                end = self._scan(buf, start)
+                if end is None:
+                    self._pos -= start
+                    break
+                self._decode(buf, start, end, docs)
+                start = end
+
+        self._buffer = buf[start:]
+        return docs
+
+    def _decode(self, buf, start, end, docs):
+        try:
+            docs.append(self._decoder.decode(buf[start:end]))
+        except ValueError:
+            LOGGER.error("Invalid JSON received: %s", buf[start:end])
+
+    def _scan(self, buf, pos):
+        """Scans buf from pos until the current document is closed
+
+        :returns: The end of the document or None if it is incomplete
+        :rtype: Interger
+
+        """
+        if self._escape:
+            if pos == len(buf):
+                return None
+            self._escape = False
+            pos += 1
+
+        while True:
+            match = self._tokens.search(buf, pos)
+            if match is None:
+                self._pos = len(buf)
+                return None
+
+            pos = match.end()
+            c = match.group()
+
+            if self._string:
+                if c == "\\":
+                    if pos == len(buf):
+                        self._escape = True
+                        self._pos = pos
+                        return None
+                    pos += 1
+                elif c == '"':
+                    self._string = False
+            elif c == '"':
+                self._string = True
+            elif c == "{" or c == "[":
+                self._depth += 1
+            elif c == "}" or c == "]":
+                self._depth -= 1
+                if self._depth <= 0:
+                    self._depth = 0
+                    self._pos = None
+                    return pos
+
+
 class JsonRPC(asyncio.Protocol):
+    _delete_batch = 100
 
     class Terminator:
         """Class used to signal when the connection shoud be closed"""
         pass
 
-    def __init__(self, app, connected_future=None):
+    def __init__(self, app, connected_future=None, **options):
         """Creates a new JsonRPC
 
         :param app: The application that should be linked into the connection
         :param connected_future: Future that should be called when there is a connection
+        :param window: Max number of requests waiting for a result
+        :param timeout: Seconds to wait for the result of a request
+        :param retries: Number of times a timed out GET is resent
+        :param deadline: Max seconds a GET may take with all its retries
+        :param backoff: Delay before the first retry, doubled for each retry
+        :param max_backoff: The max delay between retries
+        :param batch_size: Max number of requests sent in one batch, batching is disabled when not set
+        :param batch_delay: Seconds to collect requests for a batch
+        :param coalesce: Only send the newest queued report for each state
+        :param reconnect_delay: Delay before the first reconnect, doubled for each failed try
+        :param max_reconnect_delay: The max delay between reconnects
+        :param spool: Directory where requests are stored while there is no connection
+        :param spool_size: Max number of bytes stored in the spool
+        :param segment_size: Number of bytes in each spool file
+        :param run_io: Function that runs a blocking call on a thread and returns a future, used for the spool
+        :param concurrency: Max number of server requests handled at the same time
 
         """
         self._connected_future = connected_future
-        self._sendq = asyncio.Queue()
-        self._reqq = asyncio.Queue()
+        self._sendq = outbox.Outbox()
+        self._lanes = {}
+        self._dispatching = set()
+        self._dispatch_limit = asyncio.Semaphore(options.get("concurrency") or 10)
         self._app = app
         self._id = 1
-        self._pending = (-1, None)
+        self._pending = {}
+        self._window = asyncio.Semaphore(options.get("window") or 8)
+        self._timeout = options.get("timeout") or 10
+        self._retries = options.get("retries", 3)
+        self._deadline = options.get("deadline") or 30
+        self._backoff = options.get("backoff", 1)
+        self._max_backoff = options.get("max_backoff") or 30
+        self._batch_size = options.get("batch_size") or 1
+        self._batch_delay = options.get("batch_delay", 0.05)
+        self._coalesce = options.get("coalesce", False)
+        self._reconnect_delay = options.get("reconnect_delay") or 1
+        self._max_reconnect_delay = options.get("max_reconnect_delay") or 60
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._transport = None
+        self._spool = None
+        self._acks = {}
+        self._unacked = {}
+        # Set when everything in the spool has been replayed on this connection
+        self._drained = asyncio.Event()
+        self._appended = 0
+        self._executor = None
+        self._io = options.get("run_io") or self._run_io
+        if options.get("spool"):
+            self._spool = outbox.Spool(options["spool"], options.get("spool_size"), options.get("segment_size"))
+        self.stats = {
+            "timeouts": 0,
+            "retries": 0,
+            "failures": 0,
+            "batches": 0,
+            "batched": 0,
+            "folded": 0,
+            "reconnects": 0,
+            "spooled": 0,
+            "replayed": 0
+        }
+        self._stream = JsonStream()
 
     def connection_made(self, transport):
         """Callback when the socket is connected
@@ -35,11 +209,22 @@ class JsonRPC(asyncio.Protocol):
 
         """
         self._transport = transport
+        self._stream = JsonStream()
+        self._connected.set()
+
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        if self._spool is not None:
+            self._task_replay = async_fun(self._replay())
+
+        if hasattr(self, "_task_send"):
+            LOGGER.info("Reconnected to server")
+            self.stats["reconnects"] += 1
+            self._app.rpc_reconnected()
+            return
+
         if self._connected_future is not None:
             self._connected_future.set_result(True)
-        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
         self._task_send = async_fun(self._send_task())
-        self._task_request = async_fun(self._request_task())
 
     def data_received(self, data):
         """Callback when there is data received from the socket
@@ -47,10 +232,16 @@ class JsonRPC(asyncio.Protocol):
         :param data: The received data from the server
 
         """
-        data = data.decode()
-        rpc = json.loads(data)
+        for rpc in self._stream.feed(data):
+            if isinstance(rpc, list):
+                for r in rpc:
+                    self._handle_rpc(r)
+            else:
+                self._handle_rpc(rpc)
+
+    def _handle_rpc(self, rpc):
         if "method" in rpc:
-            LOGGER.debug("recv: %s", data)
+            LOGGER.debug("recv: %s", rpc)
             self._handle_request(rpc)
         else:
             self._handle_result(rpc)
@@ -58,45 +249,265 @@ class JsonRPC(asyncio.Protocol):
     def connection_lost(self, exc):
         """Callback when the connection to the server is lost
 
+        Requests waiting for a result are failed, queued messages are kept
+        until the connection has been reestablished.
+
         :param exc: The error that caused the connection to close
 
         """
         LOGGER.debug("Connection lost")
+        self._transport = None
+        self._connected.clear()
+        self._drained.clear()
+
+        for fut in list(self._pending.values()):
+            if not fut.done():
+                fut.set_exception(ConnectionError("Connection lost"))
+
+        if self._spool is not None:
+            if hasattr(self, "_task_replay"):
+                self._task_replay.cancel()
+            # Unacknowledged segments are replayed on the next connection
+            self._io(self._spool.rewind)
+            self._acks.clear()
+            self._unacked.clear()
+
+        if not self._closing:
+            async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+            self._task_reconnect = async_fun(self._reconnect())
 
     def close(self):
         """Close the server connection and queues"""
+        self._closing = True
         self._sendq.put_nowait(self.Terminator)
-        self._task_send.cancel()
-        self._reqq.put_nowait(self.Terminator)
-        self._task_request.cancel()
-        self._transport.close()
+        if hasattr(self, "_task_send"):
+            self._task_send.cancel()
+        for task in list(self._dispatching):
+            task.cancel()
+        if hasattr(self, "_task_reconnect"):
+            self._task_reconnect.cancel()
+        if hasattr(self, "_task_replay"):
+            self._task_replay.cancel()
+        if self._spool is not None:
+            self._io(self._spool.close)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._transport is not None:
+            self._transport.close()
         self._app = None
 
+    def _run_io(self, fn, *args):
+        """Runs a blocking spool call on the spool thread
+
+        Used when no run_io function is given. The calls run one at a time
+        in the order they are submitted.
+
+        :param fn: The function to call
+        :param args: The arguments for the function
+        :returns: Future with the result of the call
+        :rtype: Asyncio.Future
+
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return asyncio.wrap_future(self._executor.submit(fn, *args))
+
+    @property
+    def _spooling(self):
+        """True when new requests must be spooled to keep their order"""
+        return self._spool is not None and (self._transport is None or not self._drained.is_set())
+
+    @asyncio.coroutine
+    def _open(self):
+        """Opens a connection to the server of the application"""
+        loop = asyncio.get_event_loop()
+        yield from loop.create_connection(
+            lambda: self,
+            ssl=self._app.ssl,
+            server_hostname=self._app.host if self._app.ssl else None,
+            host=self._app.host,
+            port=self._app.port
+        )
+
+    @asyncio.coroutine
+    def _reconnect(self):
+        """Reconnects to the server with a jittered exponential backoff"""
+        delay = self._reconnect_delay
+        while not self._closing:
+            wait = delay / 2 + random.uniform(0, delay / 2)
+            LOGGER.info("Reconnecting to server in %.1f seconds", wait)
+            yield from asyncio.sleep(wait)
+
+            try:
+                yield from self._open()
+                return
+            except OSError as e:
+                LOGGER.warning("Failed to connect to server: %s", e)
+
+            delay = min(delay * 2, self._max_reconnect_delay)
+
+    @asyncio.coroutine
+    def _replay(self):
+        """Sends the spooled requests, oldest first
+
+        The send queue is held until the spool is drained, so the spooled
+        requests are sent before the requests queued after them.
+
+        """
+        while self._transport is not None:
+            appended = self._appended
+            segment, frames = yield from self._io(self._spool.pop)
+            if segment is None:
+                if appended == self._appended:
+                    self._drained.set()
+                    break
+                # Requests were spooled while the last segment was read
+                continue
+
+            data = []
+            for frame in frames:
+                try:
+                    rpc = json.loads(frame)
+                except ValueError:
+                    LOGGER.error("Dropping invalid spooled request: %s", frame)
+                    continue
+
+                # Ids are reassigned, as they could be from an earlier run
+                id, self._id = self._id, self._id + 1
+                rpc["id"] = id
+                self._unacked[id] = segment
+                data.append(json.dumps(rpc))
+
+            if len(data):
+                self._acks[segment] = len(data)
+                self.stats["replayed"] += len(data)
+                self._transport.write("".join(data).encode())
+            else:
+                self._io(self._spool.remove, segment)
+
+    @asyncio.coroutine
+    def _wait_ready(self):
+        """Waits for a connection where the spool has been replayed"""
+        yield from self._connected.wait()
+        if self._spool is not None:
+            yield from self._drained.wait()
+
+    def _handle_ack(self, id):
+        segment = self._unacked.pop(id, None)
+        if segment is None:
+            return
+
+        self._acks[segment] -= 1
+        if self._acks[segment] == 0:
+            del self._acks[segment]
+            self._io(self._spool.remove, segment)
+
     @asyncio.coroutine
     def _send_task(self):
         """Send queue handler"""
+        item = None
         while True:
-            item = yield from self._sendq.get()
+            if item is None:
+                item = yield from self._sendq.get()
             if item is self.Terminator:
                 break  # pragma: no cover
-            data, id, fut = item
-            if id is -1:
-                self._transport.write(data.encode())
+
+            if self._batch_size > 1 and item[1] != -1:
+                item = yield from self._send_batch(item)
             else:
-                self._pending = (id, fut)
-                self._transport.write(data.encode())
-                if self._pending[1] is not None:
-                    yield from self._pending[1]
+                data = yield from self._prepare(item)
+                if data is not None:
+                    yield from self._wait_ready()
+                    self._transport.write(data.encode())
+                item = None
+
+    @asyncio.coroutine
+    def _prepare(self, item):
+        """Waits for room in the request window
+
+        :param item: The queued item
+        :returns: The data to send or None if the request is no longer needed
+        :rtype: String
+
+        """
+        data, id, fut = item
+        if fut is not None:
+            if fut.done():
+                return None
+            yield from self._window.acquire()
+            if fut.done():
+                self._window.release()
+                return None
+            self._pending[id] = fut
+            fut.add_done_callback(lambda f, id=id: self._request_done(id))
+        return data
+
+    @asyncio.coroutine
+    def _send_batch(self, item):
+        """Collects requests from the send queue and sends them as a batch
+
+        :param item: The first request of the batch
+        :returns: The next queued item that could not be added to the batch
+        :rtype: Tuple
+
+        """
+        batch = []
+        first = True
+        while True:
+            if item[2] is not None and batch and self._window.locked():
+                # Results can't arrive for requests that are not sent yet
+                yield from self._wait_ready()
+                self._write_batch(batch)
+                batch = []
+
+            data = yield from self._prepare(item)
+            if data is not None:
+                batch.append(data)
+
+            if first:
+                first = False
+                yield from asyncio.sleep(self._batch_delay)
+
+            if len(batch) >= self._batch_size or self._sendq.empty():
+                break
+
+            item = self._sendq.get_nowait()
+            if item is self.Terminator or item[1] == -1:
+                yield from self._wait_ready()
+                self._write_batch(batch)
+                return item
+
+        yield from self._wait_ready()
+        self._write_batch(batch)
+        return None
+
+    def _write_batch(self, batch):
+        if len(batch) == 0:
+            return
+        elif len(batch) == 1:
+            self._transport.write(batch[0].encode())
+        else:
+            self.stats["batches"] += 1
+            self.stats["batched"] += len(batch)
+            self._transport.write(("[" + ",".join(batch) + "]").encode())
+
+    def _request_done(self, id):
+        self._pending.pop(id, None)
+        self._window.release()
 
     def _handle_result(self, rpc):
-        pending, self._pending = self._pending, (-1, None)
+        if self._unacked:
+            self._handle_ack(rpc.get("id"))
+
         if "error" in rpc:
             LOGGER.error(rpc["error"])
             res = rpc["error"]
         else:
             res = rpc["result"]
 
-        if pending[1] is None:
+        fut = self._pending.get(rpc.get("id"))
+        if fut is None or fut.done():
             return
 
         # parse string to json
@@ -106,36 +517,60 @@ class JsonRPC(asyncio.Protocol):
             except json.decoder.JSONDecodeError as e:  # pragma: nocover
                 pass
 
-        pending[1].set_result(res)
+        fut.set_result(res)
 
     def _handle_request(self, rpc):
-        self._reqq.put_nowait(rpc)
+        """Starts a task for a server request
+
+        Requests for the same device are handled in the order they were
+        received, other requests are handled concurrently.
+
+        """
+        key = self._request_key(rpc)
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        task = async_fun(self._dispatch(rpc, self._lanes.get(key)))
+        self._lanes[key] = task
+        self._dispatching.add(task)
+        task.add_done_callback(lambda t, key=key: self._dispatch_done(key, t))
+
+    def _request_key(self, item):
+        url = item.get("params", {}).get("url")
+        request_key = getattr(self._app, "request_key", None)
+        if request_key is None:
+            return url
+        return request_key(url)
+
+    def _dispatch_done(self, key, task):
+        self._dispatching.discard(task)
+        if self._lanes.get(key) is task:
+            del self._lanes[key]
 
     @asyncio.coroutine
-    def _request_task(self):
-        while True:
-            item = yield from self._reqq.get()
-            if item is self.Terminator:
-                break  # pragma: no cover
-            LOGGER.debug(item)
-            method = item["method"].lower()
-            params = item["params"]
+    def _dispatch(self, item, previous=None):
+        """Handles a server request
 
+        :param item: The request
+        :param previous: The task handling the previous request to the same device
+
+        """
+        if previous is not None:
+            yield from asyncio.wait([previous])
+
+        with (yield from self._dispatch_limit):
+            LOGGER.debug(item)
             try:
-                result = yield from getattr(self._app, method)(**params)
-            except AssertionError as e:  # pragma: nocover
-                LOGGER.error("Assertion error", exc_info=True)
-                raise e
-            except Exception as e:  # pragma: nocover
-                LOGGER.error("Exception: %s (%s)", e, type(e))
-                print(traceback.print_exc())
-                result = str(e)
-
-            if result is True:
-                self._send_result(item["id"], result)
-            else:
-                LOGGER.error(result)
-                self._send_error(item["id"], str(result))
+                method = item["method"].lower()
+                result = yield from getattr(self._app, method)(**item["params"])
+            except Exception as e:
+                # Every request gets a response, also when handling it failed
+                LOGGER.exception("Failed to handle request %s", item.get("method"))
+                result = str(e) or type(e).__name__
+
+        if result is True:
+            self._send_result(item["id"], result)
+        else:
+            LOGGER.error(result)
+            self._send_error(item["id"], str(result))
 
     def _print(self, data):  # pragma: nocover
         LOGGER.debug(json.dumps(data,
@@ -144,10 +579,18 @@ class JsonRPC(asyncio.Protocol):
                                 indent=4,
                                 separators=(',', ': ')))
 
-    def _send(self, rpc, id, fut=None):
+    def _send(self, rpc, id, fut=None, key=None):
         # self._print(rpc)
         rpc = json.dumps(rpc, cls=qzig.util.QZigEncoder)
-        self._sendq.put_nowait((rpc, id, fut))
+        if fut is None and id != -1 and self._spooling:
+            # Keep the order of the requests that are already spooled
+            self._appended += 1
+            self._io(self._spool.append, rpc)
+            self.stats["spooled"] += 1
+            return fut
+
+        if self._sendq.put_nowait((rpc, id, fut), key):
+            self.stats["folded"] += 1
         return fut
 
     def _send_result(self, id, result):
@@ -169,7 +612,7 @@ class JsonRPC(asyncio.Protocol):
         }
         self._send(rpc, -1)
 
-    def _rpc(self, method, url, data=None, fut=None):
+    def _rpc(self, method, url, data=None, fut=None, key=None):
         id, self._id = self._id, self._id + 1
         rpc = {
             "jsonrpc": "2.0",
@@ -182,20 +625,50 @@ class JsonRPC(asyncio.Protocol):
         if data is not None:
             rpc["params"]["data"] = data
 
-        return self._send(rpc, id, fut)
+        return self._send(rpc, id, fut, key)
 
     @asyncio.coroutine
-    def get(self, url):
+    def get(self, url, timeout=None):
         """Sends a RPC GET request
 
+        The request is resent with an exponential backoff when there is no
+        result within the timeout. When all retries have failed, or the
+        deadline of the connection has passed, an error result is returned.
+
         :param url: The url of the rpc request
+        :param timeout: Seconds to wait for each try, defaults to the connection timeout
         :returns: The result of the GET request
         :rtype: String
 
         """
-        fut = asyncio.Future()
-        data = yield from self._rpc("GET", url, fut=fut)
-        return data
+        timeout = timeout or self._timeout
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self._deadline
+
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                delay = min(self._backoff * 2 ** (attempt - 1), self._max_backoff)
+                if loop.time() + delay >= deadline:
+                    break
+                self.stats["retries"] += 1
+                yield from asyncio.sleep(delay)
+
+            fut = asyncio.Future()
+            self._rpc("GET", url, fut=fut)
+            try:
+                data = yield from asyncio.wait_for(fut, min(timeout, deadline - loop.time()))
+                return data
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                LOGGER.warning("GET %s timed out after %s seconds", url, timeout)
+            except ConnectionError:
+                LOGGER.warning("Connection lost while waiting for GET %s", url)
+
+        self.stats["failures"] += 1
+        return {
+            "code": -32000,
+            "message": "No result for GET %s" % url
+        }
 
     def post(self, url, data):
         """Sends a RPC POST request
@@ -209,11 +682,20 @@ class JsonRPC(asyncio.Protocol):
     def put(self, url, data):
         """Sends a RPC PUT request
 
+        Reports to a state that is still waiting in the send queue are
+        replaced by the new report when coalescing is enabled.
+
         :param url: The url of the rpc request
         :param data: The data of the rpc request
 
         """
-        self._rpc("PUT", url, data)
+        key = None
+        if self._coalesce:
+            path = url.rsplit("/", 2)
+            if len(path) == 3 and path[1] == "state":
+                key = path[2]
+
+        self._rpc("PUT", url, data, key=key)
 
     def delete(self, url):
         """Sends a RPC DELETE request
@@ -223,28 +705,59 @@ class JsonRPC(asyncio.Protocol):
         """
         self._rpc("DELETE", url)
 
+    def delete_many(self, urls):
+        """Sends RPC DELETE requests for many urls
+
+        The requests are written as JSON-RPC batches of up to 100 requests.
+        When the requests have to be spooled, or the send queue batches
+        requests itself, they are queued one by one instead.
+
+        :param urls: The urls of the rpc requests
+
+        """
+        if len(urls) < 2 or self._batch_size > 1 or self._spooling:
+            for url in urls:
+                self.delete(url)
+            return
+
+        for i in range(0, len(urls), self._delete_batch):
+            batch = []
+            for url in urls[i:i + self._delete_batch]:
+                id, self._id = self._id, self._id + 1
+                batch.append(json.dumps({
+                    "jsonrpc": "2.0",
+                    "method": "DELETE",
+                    "id": id,
+                    "params": {
+                        "url": url
+                    }
+                }))
+            self.stats["batches"] += 1
+            self.stats["batched"] += len(batch)
+            self._sendq.put_nowait(("[" + ",".join(batch) + "]", id, None), None)
+
 
 @asyncio.coroutine
-def connect(model):  # pragma: no cover
+def connect(model):
     """This is used to connect the rpc to the server
 
+    When the server can't be reached, it keeps trying to connect with a
+    backoff until there is a connection.
+
     :param model: The class it should use to connect with
     :returns: The socket that is connected to the server
     :rtype: Socket
 
     """
-    loop = asyncio.get_event_loop()
-
     connection_future = asyncio.Future()
-    protocol = JsonRPC(model, connection_future)
-
-    yield from loop.create_connection(
-        lambda: protocol,
-        ssl=model.ssl,
-        server_hostname=model.host,
-        host=model.host,
-        port=model.port
-    )
+    protocol = JsonRPC(model, connection_future, **model.rpc_options)
+
+    try:
+        yield from protocol._open()
+    except OSError as e:
+        LOGGER.warning("Failed to connect to server: %s", e)
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+        protocol._task_reconnect = async_fun(protocol._reconnect())
 
     yield from connection_future
 
@@ -1,17 +1,20 @@
 import asyncio
 import logging
-import json
-import os
 import uuid
-import shutil
-import datetime
 
-import qzig
+import qzig.timestamp as timestamp
 
 LOGGER = logging.getLogger(__name__)
 
+_names = {}
+
 
 class Model():
+    # Subclasses that declare __slots__ themselves have no __dict__
+    __slots__ = ()
+    _cached_path = None
+    _cached_url = None
+
     def __init__(self, parent, load=None):
         self._parent = parent
         self._children = []
@@ -25,16 +28,55 @@ class Model():
 
     @property
     def _path(self):
-        try:
-            path = self._parent._path + self.name + "/" + self.id + "/"
-        except AttributeError:
-            path = self._rootdir + "store/"
+        path = self._cached_path
+        if path is None:
+            try:
+                path = self._parent._path + self.name + "/" + self.id + "/"
+            except AttributeError:
+                return self._rootdir + "store/"
+            self._cached_path = path
         return path
 
+    def _get_url(self):
+        """Gets the object that sends the RPC requests and the URL of the model
+
+        The URL is built once and cached until the model is reparented.
+
+        :returns: The sender and the URL
+        :rtype: Tuple
+
+        """
+        url = self._cached_url
+        if url is None:
+            sender, parent_url = self._parent._get_url()
+            url = self._cached_url = (sender, parent_url + "/" + self.name + "/" + self.id)
+        return url
+
+    def _reparent(self, parent):
+        """Moves the model to a new parent
+
+        :param parent: The new parent
+
+        """
+        if parent is not self._parent:
+            self._parent = parent
+            self._clear_cached()
+
+    def _clear_cached(self):
+        self._cached_path = None
+        self._cached_url = None
+        for c in self._loaded_children:
+            c._clear_cached()
+
     @property
     def _child_path(self):
         return self._path + self._get_child_name()
 
+    @property
+    def _loaded_children(self):
+        """The children that are loaded, without loading lazy children"""
+        return self._children
+
     @property
     def id(self):
         """Returns the id of the model
@@ -58,10 +100,12 @@ class Model():
         :rtype: String
 
         """
-        if hasattr(self, "_name"):
-            return self._name
-        else:
-            return str(type(self).__name__).lower()
+        cls = type(self)
+        try:
+            return _names[cls]
+        except KeyError:
+            name = _names[cls] = getattr(cls, "_name", None) or cls.__name__.lower()
+            return name
 
     def _get_manufacturer(self):
         return self._parent._get_manufacturer()
@@ -80,22 +124,24 @@ class Model():
         return "<%s attr: %s>" % (self.name, self.attr)
 
     def _save(self):
-        if not os.path.exists(self._path):
-            os.makedirs(self._path)
-
-        with open(self._path + self.name + ".json", 'w') as f:
-            json.dump(
-                {
-                    "data": self._get_raw_data(),
-                    "attr": self.attr
-                },
-                f,
-                cls=qzig.util.QZigEncoder
-            )
-
-        if hasattr(self, "_children"):
-            for c in self._children:
-                c._save()
+        """Marks the model and its children as changed
+
+        The changes are written to the store by the network flusher.
+
+        """
+        self._mark_dirty(self)
+
+    def _get_store(self):
+        return self._parent._get_store()
+
+    def _run_io(self, fn, *args):
+        return self._parent._run_io(fn, *args)
+
+    def _mark_dirty(self, obj):
+        self._parent._mark_dirty(obj)
+
+    def _remove_stored(self, obj):
+        return self._parent._remove_stored(obj)
 
     def _parse(self):  # pragma: no cover
         pass
@@ -105,49 +151,54 @@ class Model():
         self.attr = load["attr"]
         self._parse()
 
-    def _load_children(self):
-        for (root, dirs, files) in os.walk(self._child_path):
-            dirs = [os.path.join(root, d) for d in dirs]
-
-            child_name = self._get_child_name()
-            for dir in dirs:
-                if not os.path.exists(dir + "/" + child_name + ".json"):
-                    continue
-
-                with open(dir + "/" + child_name + ".json", 'r') as f:
-                    try:
-                        load = json.load(f)
-                    except ValueError:
-                        LOGGER.debug("Invalid JSON in " + dir + "/" + child_name + ".json")
-                        continue
-
-                    c = self._create_child(load=load)
-                    if isinstance(c, list):
-                        for ch in c:
-                            self._children.append(ch)
-                            ch._load_children()
-                    else:
-                        self._children.append(c)
-                        c._load_children()
+    def _load_children(self, loader=None):
+        if loader is None:
+            loader = self._get_store()
+
+        for load in loader.load_children(self):
+            c = self._create_child(load=load)
+            if isinstance(c, list):
+                for ch in c:
+                    self._add_child(ch)
+                    ch._load_children(loader)
+            else:
+                self._add_child(c)
+                c._load_children(loader)
         self._children_loaded()
 
     def _children_loaded(self):
         pass
 
     def _send_put(self, url, data):
-        url = "/" + self.name + "/" + self.id + url
-        self._parent._send_put(url, data)
+        sender, prefix = self._get_url()
+        sender._send_put(prefix + url, data)
 
     def _send_post(self, url, data):
         if url == "":
-            url = "/" + self.name
+            sender, prefix = self._parent._get_url()
+            sender._send_post(prefix + "/" + self.name, data)
         else:
-            url = "/" + self.name + "/" + self.id + url
-        self._parent._send_post(url, data)
+            sender, prefix = self._get_url()
+            sender._send_post(prefix + url, data)
 
     def _send_delete(self, url=""):
-        url = "/" + self.name + "/" + self.id + url
-        self._parent._send_delete(url)
+        sender, prefix = self._get_url()
+        sender._send_delete(prefix + url)
+
+    def _add_child(self, child):
+        """Adds a child and registers it in the id index of the network
+
+        :param child: The child that should be added
+
+        """
+        self._children.append(child)
+        self._index_add(child)
+
+    def _index_add(self, obj):
+        self._parent._index_add(obj)
+
+    def _index_remove(self, obj):
+        self._parent._index_remove(obj)
 
     def _find_child(self, id):
         for c in self._children:
@@ -162,10 +213,13 @@ class Model():
         return None
 
     def _remove_files(self):
-        try:
-            shutil.rmtree(self._path)
-        except FileNotFoundError:  # pragma: nocover
-            pass
+        """Removes the model and its children from the store
+
+        :returns: Future that is done when the files are removed
+        :rtype: Asyncio.Future
+
+        """
+        return self._remove_stored(self)
 
     @asyncio.coroutine
     def _do_bind(self, endpoint_id, cluster_id):
@@ -187,18 +241,17 @@ class Model():
         return v
 
     def _get_timestamp(self):
-        """Convert current time to timestamp
+        """Gets the current time as timestamp
 
         :returns: Current time as timestamp
-        :rtype: String
+        :rtype: Timestamp
 
         """
-        t = str(datetime.datetime.utcnow()).split('.')[0]
-        return t.replace(" ", "T") + 'Z'
+        return timestamp.now()
 
     @asyncio.coroutine
-    def _handle_get(self):
-        res = yield from self._parent._handle_get()
+    def _handle_get(self, force=False):
+        res = yield from self._parent._handle_get(force)
         return res
 
     def get_data(self):
@@ -1,10 +1,11 @@
 import asyncio
+import concurrent.futures
+import gc
 import logging
-import json
-import os
 
 import qzig.model as model
 import qzig.device as device
+import qzig.store as store
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,7 +29,19 @@ class Network(model.Model):
 
         self.attr = {}
         self._children = []
+        self._index = {}
+        self._ieees = {}
+        self._dirty = set()
+        self._store = store.FileStore()
+        self._executor = None
+        self._snapshot = None
+        self._snapshot_saved = False
         self._rootdir = ""
+        self._lazy = False
+        self._lazy_ids = {}
+
+    def _get_url(self):
+        return self._parent, "/" + self.name + "/" + self.id
 
     def _create_child(self, **args):
         if self._parent._gateway is not None:
@@ -41,11 +54,12 @@ class Network(model.Model):
         return device.Device(self, **args)
 
     @asyncio.coroutine
-    def add_device(self, dev, post=False):
+    def add_device(self, dev, post=False, timeout=None):
         """Adds a device
 
         :param dev: The device that should be added
         :param post: Should this device be posted to the server
+        :param timeout: Seconds the reads and binds of the interview may take
         :returns: The correct refernce to the device
         :rtype: device
 
@@ -53,11 +67,12 @@ class Network(model.Model):
         d = self._get_device(str(dev.ieee))
         if d is None:
             d = self._create_child()
-            self._children.append(d)
+            self._add_child(d)
+            self._ieees[str(dev.ieee)] = d
         else:
-            d._parent = self
+            d._reparent(self)
 
-        yield from d.parse_device(dev, post)
+        yield from d.parse_device(dev, post, timeout)
 
         if post:
             d._send_post("", d.get_data())
@@ -74,13 +89,15 @@ class Network(model.Model):
 
         new_gw = self._parent._gateway(self)
 
-        self._children.append(new_gw)
+        self._add_child(new_gw)
         return new_gw
 
     def remove_device(self, dev):
         """Removes a device
 
         :param dev: The device that should be removed
+        :returns: Future that is done when the device is removed from the store
+        :rtype: Asyncio.Future
 
         """
         d = self._get_device(str(dev.ieee))
@@ -88,37 +105,245 @@ class Network(model.Model):
             LOGGER.error("Failed to find device to remove")
             return
 
-        for d in self._children:
-            if str(d.ieee) == str(dev.ieee):
-                try:
-                    self._children.remove(d)
-                except ValueError:  # pragma: nocover
-                    LOGGER.error("Failed to remove device from children")
-                break
+        return self.remove_devices([d])
+
+    def remove_devices(self, devs):
+        """Removes many devices at once
+
+        The devices are removed from the store one by one on the persistence
+        thread, and deleted on the server in one batch.
+
+        :param devs: The devices that should be removed
+        :returns: Future that is done when the devices are removed from the store
+        :rtype: Asyncio.Future
+
+        """
+        removed = set(devs)
+        self._children = [d for d in self._children if d not in removed]
 
-        d._remove_files()
-        d._send_delete()
+        urls = []
+        futures = []
+        for d in devs:
+            self._index_remove(d)
+            self._ieees.pop(str(d.ieee), None)
+            futures.append(d._remove_files())
+            urls.append(d._get_url()[1])
 
+        self._parent._send_delete_many(urls)
+        return asyncio.gather(*futures)
+
+    @asyncio.coroutine
     def _load(self):
+        # Loading creates tens of thousands of long lived objects, the cyclic
+        # garbage collector would scan the growing heap again and again
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            yield from self._load_tree()
+        finally:
+            if enabled:
+                gc.enable()
+
+        self._add_gateway()
+
+    @asyncio.coroutine
+    def _load_tree(self):
+        # Opening the store can migrate it, so it is opened even when the
+        # network is loaded from the snapshot
+        yield from self._run_io(self._store.open)
+        loader = None
+        if self._snapshot is not None:
+            loaded = yield from self._run_io(self._snapshot.read)
+            if loaded:
+                loader = self._snapshot
+                self._snapshot_saved = True
+
+        if loader is None:
+            yield from self._run_io(self._store.preload, self._path)
+            loader = self._store
+
+        raw = None
         try:
-            if os.path.exists(self._path + "network.json"):
-                with open(self._path + "network.json", 'r') as f:
-                    raw = json.load(f)
-                    self.data = raw["data"]
-                    self.attr = raw["attr"]
+            raw = loader.load(self)
+            if raw is not None:
+                self.data = raw["data"]
+                self.attr = raw["attr"]
         except ValueError:
             LOGGER.exception("Failed to load network data")
+        if raw is None:
+            # Only a new network is written, a loaded one is unchanged
+            self._dirty.add(self)
 
-        self._load_children()
+        self._load_children(loader)
+        loader.clear()
 
-        self._add_gateway()
+    def _index_add(self, obj):
+        self._index[obj.id] = obj
+        if obj._parent is self and obj.ieee:
+            self._ieees[str(obj.ieee)] = obj
+        for c in obj._loaded_children:
+            self._index_add(c)
+
+    def _index_remove(self, obj):
+        if self._index.get(obj.id) is obj:
+            del self._index[obj.id]
+        if obj._parent is self:
+            self._lazy_remove(obj)
+        for c in obj._loaded_children:
+            self._index_remove(c)
+
+    def _lazy_add(self, dev):
+        """Registers the ids in the not yet loaded subtree of a device
+
+        :param dev: The device
+
+        """
+        for id in dev._subtree.ids:
+            self._lazy_ids[id] = dev
+
+    def _lazy_remove(self, dev):
+        if dev._subtree is not None:
+            for id in dev._subtree.ids:
+                if self._lazy_ids.get(id) is dev:
+                    del self._lazy_ids[id]
+
+    def _get_store(self):
+        return self._store
+
+    def _run_io(self, fn, *args):
+        """Runs a blocking persistence call on the persistence thread
+
+        There is a single persistence thread, so the calls run one at a
+        time in the order they are submitted.
+
+        :param fn: The function to call
+        :param args: The arguments for the function
+        :returns: Future with the result of the call
+        :rtype: Asyncio.Future
+
+        """
+        return asyncio.wrap_future(self._submit(fn, *args))
+
+    def _submit(self, fn, *args):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor.submit(fn, *args)
+
+    def _close(self):
+        """Writes all changes and a snapshot and stops the persistence thread"""
+        self._flush()
+        if self._snapshot is not None and not self._snapshot_saved and not self._dirty:
+            self._run_io(self._snapshot.write, self._snapshot.prepare(self))
+            self._snapshot_saved = True
+        self._submit(self._store.close)
+        self._executor.shutdown()
+        self._executor = None
+
+    def _mark_dirty(self, obj):
+        self._dirty.add(obj)
+        for c in obj._loaded_children:
+            self._mark_dirty(c)
+
+    def _remove_stored(self, obj):
+        self._mark_clean(obj)
+        self._invalidate_snapshot()
+        return self._run_io(self._store.remove, obj._path)
+
+    def _mark_clean(self, obj):
+        self._dirty.discard(obj)
+        for c in obj._loaded_children:
+            self._mark_clean(c)
+
+    def _take_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self._invalidate_snapshot()
+        return self._store.prepare(dirty)
+
+    def _invalidate_snapshot(self):
+        # The snapshot is removed before the store changes, so a snapshot on
+        # disk always matches the store
+        if self._snapshot is not None and self._snapshot_saved:
+            self._snapshot_saved = False
+            self._run_io(self._snapshot.remove)
+
+    @asyncio.coroutine
+    def _save_snapshot(self):
+        """Writes a snapshot of the network if the store changed since the last one
+
+        :returns: True if a snapshot was written
+        :rtype: Boolean
+
+        """
+        if self._snapshot is None or self._snapshot_saved:
+            return False
+
+        yield from self._flush_async()
+        if self._dirty:
+            return False
+
+        yield from self._run_io(self._snapshot.write, self._snapshot.prepare(self))
+        self._snapshot_saved = True
+        return True
+
+    def _flush(self):
+        """Writes all changed objects to the store and waits for it
+
+        Calls already queued on the persistence thread complete first.
+        Objects that fail to be written are kept and retried on the next
+        flush.
+
+        :returns: The number of objects written
+        :rtype: Integer
+
+        """
+        entries = self._take_dirty()
+        failed = self._submit(self._store.write, entries).result()
+        self._dirty.update(failed)
+        return len(entries) - len(failed)
+
+    @asyncio.coroutine
+    def _flush_async(self):
+        """Writes all changed objects to the store on the persistence thread
+
+        The objects are serialized on the event loop, so the thread never
+        touches the model.
+
+        :returns: The number of objects written
+        :rtype: Integer
+
+        """
+        if not self._dirty:
+            return 0
+
+        entries = self._take_dirty()
+        failed = yield from self._run_io(self._store.write, entries)
+        self._dirty.update(failed)
+        return len(entries) - len(failed)
+
+    def _find_child(self, id):
+        """Finds a device, value or state in the network by id
+
+        In lazy mode the device of a value or state that is not loaded yet
+        loads its values and states first.
+
+        :param id: The id of the object
+        :returns: The object or None if the id is unknown
+        :rtype: Model
+
+        """
+        obj = self._index.get(id)
+        if obj is None and id in self._lazy_ids:
+            self._lazy_ids[id]._load_subtree()
+            obj = self._index.get(id)
+        return obj
 
     def _get_device(self, ieee, id=None):
-        try:
-            dev = next(d for d in self._children
-                       if d.ieee == ieee or d.id == id)
-        except StopIteration:
-            dev = None
+        dev = self._ieees.get(str(ieee))
+        if dev is None and id is not None:
+            dev = self._index.get(id)
+            if dev is not None and dev._parent is not self:
+                dev = None
         return dev
 
     def _get_raw_data(self):
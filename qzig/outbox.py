@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Outbox(asyncio.Queue):
+    """Send queue where a new item replaces a queued item with the same key
+
+    Items without a key are kept in strict FIFO order. A keyed item keeps the
+    position of the first queued item with that key, until it is taken from
+    the queue.
+
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._keyed = {}
+
+    def put_nowait(self, item, key=None):
+        """Puts an item in the queue
+
+        :param item: The item to queue
+        :param key: Items with the same key are folded into one
+        :returns: True if the item replaced an already queued item
+        :rtype: Boolean
+
+        """
+        if key is not None:
+            entry = self._keyed.get(key)
+            if entry is not None:
+                entry[1] = item
+                return True
+
+            entry = [key, item]
+            self._keyed[key] = entry
+        else:
+            entry = [None, item]
+
+        super().put_nowait(entry)
+        return False
+
+    def _get(self):
+        key, item = self._queue.popleft()
+        if key is not None:
+            del self._keyed[key]
+        return item
+
+
+class Spool():
+    """Append-only message log on disk, split into segment files
+
+    Messages are appended as lines to the newest segment. Segments are
+    replayed oldest first and removed when all their messages have been
+    acknowledged. When the log grows beyond max_size, the oldest segments
+    are dropped.
+
+    """
+
+    def __init__(self, path, max_size=None, segment_size=None):
+        """Opens or creates a spool
+
+        :param path: The directory of the segment files
+        :param max_size: Max number of bytes in all segments
+        :param segment_size: Number of bytes before a new segment is started
+
+        """
+        self._path = path
+        self._max_size = max_size or 16 * 1024 * 1024
+        self._segment_size = segment_size or 256 * 1024
+        self._file = None
+        self._cursor = 0
+        self.evicted = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._sizes = {}
+        for name in os.listdir(path):
+            if name.endswith(".log"):
+                try:
+                    segment = int(name[:-4])
+                except ValueError:  # pragma: no cover
+                    continue
+                self._sizes[segment] = os.path.getsize(self._segment_path(segment))
+        self._segments = sorted(self._sizes)
+
+    def __len__(self):
+        """The number of segments that have not been replayed"""
+        return len(self._segments) - self._cursor
+
+    @property
+    def size(self):
+        """The number of bytes in the spool"""
+        return sum(self._sizes.values())
+
+    def _segment_path(self, segment):
+        return os.path.join(self._path, "%010d.log" % segment)
+
+    def _roll(self):
+        self.close()
+        segment = self._segments[-1] + 1 if self._segments else 1
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+        self._file = open(self._segment_path(segment), "a", encoding="utf-8")
+
+    def append(self, data):
+        """Appends a message to the newest segment
+
+        :param data: The encoded message, without newlines
+
+        """
+        if self._file is None or self._sizes[self._segments[-1]] >= self._segment_size:
+            self._roll()
+
+        line = data + "\n"
+        self._file.write(line)
+        self._file.flush()
+        self._sizes[self._segments[-1]] += len(line)
+
+        while len(self._segments) > 1 and self.size > self._max_size:
+            segment = self._segments[0]
+            LOGGER.warning("Outbox is full, dropping %d bytes", self._sizes[segment])
+            self.evicted += 1
+            self.remove(segment)
+
+    def pop(self):
+        """Gets the next segment to replay
+
+        :returns: The segment number and its messages or None if all segments has been replayed
+        :rtype: Tuple
+
+        """
+        if self._cursor >= len(self._segments):
+            return None, []
+
+        segment = self._segments[self._cursor]
+        self._cursor += 1
+        if segment == self._segments[-1]:
+            # New messages must go to a segment that has not been replayed
+            self.close()
+
+        with open(self._segment_path(segment), "r", encoding="utf-8") as f:
+            lines = [line for line in f.read().split("\n") if line]
+
+        return segment, lines
+
+    def rewind(self):
+        """Replays all remaining segments again"""
+        self._cursor = 0
+
+    def remove(self, segment):
+        """Removes a segment
+
+        :param segment: The segment number
+
+        """
+        if segment not in self._sizes:
+            return
+
+        index = self._segments.index(segment)
+        if index < self._cursor:
+            self._cursor -= 1
+        if segment == self._segments[-1]:
+            self.close()
+
+        del self._segments[index]
+        del self._sizes[segment]
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    def close(self):
+        """Closes the segment that is written to"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,217 @@
+import asyncio
+import collections
+import logging
+
+import bellows.types as t
+import bellows.zigbee.zcl.foundation as foundation
+import qzig.zigbee as zigbee
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Profile(collections.namedtuple("Profile", ["min_interval", "max_interval", "reportable_change"])):
+    """How often a device should report an attribute
+
+    :param min_interval: The minimum time in seconds between two reports
+    :param max_interval: The maximum time in seconds without a report
+    :param reportable_change: The change that causes a report
+
+    """
+    __slots__ = ()
+
+
+class ReportingConfigRecord():
+    """A record of the read reporting configuration response
+
+    Every record starts with a status, and only a successful record holds
+    the configuration. The reportable change is only sent for analog data
+    types and is None otherwise.
+
+    """
+    reportable_change = None
+
+    def serialize(self):
+        r = t.uint8_t(self.status).serialize() + t.uint8_t(self.direction).serialize()
+        r += t.uint16_t(self.attrid).serialize()
+        if self.status != foundation.Status.SUCCESS:
+            return r
+
+        if self.direction:
+            return r + t.uint16_t(self.timeout).serialize()
+
+        r += t.uint8_t(self.datatype).serialize()
+        r += t.uint16_t(self.min_interval).serialize() + t.uint16_t(self.max_interval).serialize()
+        datatype = foundation.DATA_TYPES.get(self.datatype)
+        if datatype and datatype[2] is foundation.Analog:
+            r += datatype[1](self.reportable_change).serialize()
+        return r
+
+    @classmethod
+    def deserialize(cls, data):
+        self = cls()
+        self.status, data = t.uint8_t.deserialize(data)
+        self.direction, data = t.uint8_t.deserialize(data)
+        self.attrid, data = t.uint16_t.deserialize(data)
+        if self.status != foundation.Status.SUCCESS:
+            return self, data
+
+        if self.direction:
+            self.timeout, data = t.uint16_t.deserialize(data)
+            return self, data
+
+        self.datatype, data = t.uint8_t.deserialize(data)
+        self.min_interval, data = t.uint16_t.deserialize(data)
+        self.max_interval, data = t.uint16_t.deserialize(data)
+        datatype = foundation.DATA_TYPES.get(self.datatype)
+        if datatype and datatype[2] is foundation.Analog:
+            self.reportable_change, data = datatype[1].deserialize(data)
+        return self, data
+
+
+_CONFIGURE_REPORTING = 0x06
+_READ_REPORTING_CONFIGURATION = 0x08
+_READ_REPORTING_CONFIGURATION_RESPONSE = 0x09
+
+# bellows parses the response with AttributeReportingConfig, which has no
+# status, so the records of every reply would be shifted by one byte
+foundation.COMMANDS[_READ_REPORTING_CONFIGURATION_RESPONSE] = (
+    foundation.COMMANDS[_READ_REPORTING_CONFIGURATION_RESPONSE][0], (t.List(ReportingConfigRecord), ), True)
+
+
+def _configure_reporting(cluster, attribute, profile, manufacturer=None):
+    """Sends configure reporting for an attribute, manufacturer specific if a code is given"""
+    if manufacturer is None:
+        return cluster.configure_reporting(attribute, profile.min_interval, profile.max_interval,
+                                           profile.reportable_change)
+
+    cfg = foundation.AttributeReportingConfig()
+    cfg.direction = 0
+    cfg.attrid = attribute
+    cfg.datatype = foundation.DATA_TYPE_IDX[cluster.attributes[attribute][1]]
+    cfg.min_interval = profile.min_interval
+    cfg.max_interval = profile.max_interval
+    cfg.reportable_change = profile.reportable_change
+    schema = foundation.COMMANDS[_CONFIGURE_REPORTING][1]
+    return zigbee.request(cluster, True, _CONFIGURE_REPORTING, schema, [cfg], manufacturer=manufacturer)
+
+
+def _wanted(values):
+    """Gets the reporting profiles of the values
+
+    :param values: The values on a cluster
+    :returns: The profiles by attribute id and manufacturer code
+    :rtype: Dict
+
+    """
+    wanted = {}
+    for v in values:
+        profile = getattr(v, "_reporting", None)
+        if profile is None or not hasattr(v, "_attribute"):
+            continue
+        wanted[(v._attribute, getattr(v, "_manufacturer", None))] = profile
+    return wanted
+
+
+@asyncio.coroutine
+def configure(cluster, values, check=False):
+    """Configures the reporting of the values on a cluster
+
+    Every attribute with a reporting profile is configured with
+    configure_reporting, and the configuration is read back to verify it.
+
+    :param cluster: The cluster of the values
+    :param values: The values on the cluster
+    :param check: Only configure the attributes that are not configured as wanted
+    :returns: The attributes that are not configured as wanted
+    :rtype: List
+
+    """
+    wanted = _wanted(values)
+    if not wanted:
+        return []
+
+    if check:
+        todo = yield from verify(cluster, wanted)
+    else:
+        todo = list(wanted)
+
+    for attribute, manufacturer in todo:
+        profile = wanted[(attribute, manufacturer)]
+        LOGGER.debug("Configuring reporting of attribute %s on cluster %s: %s",
+                     attribute, cluster.cluster_id, profile)
+        try:
+            yield from _configure_reporting(cluster, attribute, profile, manufacturer)
+        except Exception as e:
+            LOGGER.error("Failed to configure reporting of attribute %s: %s", attribute, e)
+
+    if not todo:
+        return []
+
+    failed = yield from verify(cluster, {k: wanted[k] for k in todo})
+    if failed:
+        LOGGER.warning("Reporting of %s on cluster %s is not configured as wanted", failed, cluster.cluster_id)
+    return failed
+
+
+@asyncio.coroutine
+def verify(cluster, wanted):
+    """Reads the reporting configuration of attributes and compares it
+
+    The reportable change is only compared when the device sends it, which
+    it does for analog data types.
+
+    :param cluster: The cluster of the attributes
+    :param wanted: The profiles by attribute id and manufacturer code
+    :returns: The attributes that are not configured as wanted
+    :rtype: List
+
+    """
+    codes = {}
+    for attribute, manufacturer in wanted:
+        codes.setdefault(manufacturer, []).append(attribute)
+
+    failed = []
+    for manufacturer, attributes in codes.items():
+        configured = yield from _read_configuration(cluster, attributes, manufacturer)
+        for a in attributes:
+            profile = wanted[(a, manufacturer)]
+            record = configured.get(a)
+            if record is None or \
+                    record.min_interval != profile.min_interval or \
+                    record.max_interval != profile.max_interval or \
+                    record.reportable_change not in (None, profile.reportable_change):
+                failed.append((a, manufacturer))
+    return failed
+
+
+@asyncio.coroutine
+def _read_configuration(cluster, attributes, manufacturer=None):
+    """Reads the reporting configuration of attributes
+
+    :param cluster: The cluster of the attributes
+    :param attributes: The ids of the attributes
+    :param manufacturer: The manufacturer code of the attributes
+    :returns: The configured records by attribute id
+    :rtype: Dict
+
+    """
+    records = []
+    for a in attributes:
+        r = foundation.ReadReportingConfigRecord()
+        r.direction = t.uint8_t(0)
+        r.attrid = t.uint16_t(a)
+        records.append(r)
+
+    schema = foundation.COMMANDS[_READ_REPORTING_CONFIGURATION][1]
+    try:
+        v = yield from zigbee.request(cluster, True, _READ_REPORTING_CONFIGURATION, schema, records,
+                                      manufacturer=manufacturer)
+    except Exception as e:
+        LOGGER.error("Failed to read the reporting configuration of %s: %s", attributes, e)
+        return {}
+
+    configured = {}
+    for record in (v[0] if v and isinstance(v[0], list) else []):
+        if record.status == foundation.Status.SUCCESS and not record.direction:
+            configured[record.attrid] = record
+    return configured
@@ -4,6 +4,7 @@ import enum
 import traceback
 
 import qzig.model as model
+import qzig.timestamp as timestamp
 from bellows.zigbee.exceptions import DeliveryError
 
 LOGGER = logging.getLogger(__name__)
@@ -23,6 +24,9 @@ class StateStatus(enum.Enum):
 
 
 class State(model.Model):
+    __slots__ = ("_parent", "data", "_cached_path", "_cached_url")
+    _child_name = ""
+    _children = ()
 
     def __init__(self, parent, state_type=None, load=None):
         """Creates a new State
@@ -33,8 +37,8 @@ class State(model.Model):
 
         """
         self._parent = parent
-        self.attr = {}
-        self._children = []
+        self._cached_path = None
+        self._cached_url = None
 
         if load is None:
             self._init(state_type)
@@ -54,8 +58,23 @@ class State(model.Model):
         if self._parent.data.get("number") is None:
             self.data["data"] = ""
 
+    @property
+    def attr(self):
+        """States have no attributes
+
+        :returns: An empty dict
+        :rtype: Dict
+
+        """
+        return {}
+
+    def _load(self, load):
+        self.data = load["data"]
+        self._parse()
+
     def _parse(self):
         self.data["type"] = StateType(self.data["type"])
+        self.data["timestamp"] = timestamp.parse(self.data["timestamp"])
 
     @property
     def type(self):
@@ -115,6 +134,8 @@ class State(model.Model):
 
         try:
             res = yield from self._parent._handle_control(data["data"])
+            if res is True:
+                self._parent._controlled()
             return res
         except DeliveryError as e:  # pragma: nocover
             LOGGER.error("Faild to send message")
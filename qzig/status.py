@@ -23,6 +23,8 @@ class StatusType(enum.Enum):
 
 
 class Status(model.Model):
+    __slots__ = ("_parent", "data", "_cached_path", "_cached_url")
+    _children = ()
 
     def __init__(self, parent, status_type=None, status_level=None, message=None):
         """Creates a new Status
@@ -34,8 +36,8 @@ class Status(model.Model):
 
         """
         self._parent = parent
-        self.attr = {}
-        self._children = []
+        self._cached_path = None
+        self._cached_url = None
 
         self._init(status_type, status_level, message)
 
@@ -49,6 +51,16 @@ class Status(model.Model):
             "message": message
         }
 
+    @property
+    def attr(self):
+        """A status has no attributes
+
+        :returns: An empty dict
+        :rtype: Dict
+
+        """
+        return {}
+
     def get_data(self):
         """Gets the status data
 
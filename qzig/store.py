@@ -0,0 +1,580 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+
+import qzig.util
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _dump(obj):
+    return json.dumps(
+        {
+            "data": obj._get_raw_data(),
+            "attr": obj.attr
+        },
+        cls=qzig.util.QZigEncoder
+    )
+
+
+class FileStore():
+    """Stores the models as a directory tree of JSON files
+
+    Every model is saved in ``<path>/<name>.json``, where the path of a
+    model is the path of its parent followed by ``<name>/<id>/``.
+
+    The blocking calls (preload, write and remove) are meant to run on the
+    persistence thread of the network, the others run on the event loop.
+
+    """
+
+    def __init__(self):
+        self._files = None
+        self._dirs = None
+
+    def open(self):
+        pass
+
+    def preload(self, root):
+        """Reads and parses all files below root
+
+        load and load_children are served from the preloaded files until the
+        next write or remove.
+
+        :param root: The path of the network
+
+        """
+        files = {}
+        dirs = {}
+        for (path, subdirs, names) in os.walk(root):
+            path = os.path.join(path, "")
+            files[path] = {}
+            dirs.setdefault(os.path.dirname(path.rstrip("/")), []).append(path)
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(path + name, 'r') as f:
+                        files[path][name] = json.load(f)
+                except ValueError:
+                    LOGGER.debug("Invalid JSON in " + path + name)
+
+        self._files = files
+        self._dirs = dirs
+
+    def load(self, obj):
+        """Loads the saved data of a model
+
+        :param obj: The model to load
+        :returns: The saved data, or None if the model is not saved
+        :rtype: Dict
+
+        """
+        files = self._files
+        if files is not None:
+            return files.get(obj._path, {}).get(obj.name + ".json")
+
+        try:
+            with open(obj._path + obj.name + ".json", 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_children(self, obj):
+        """Loads the saved data of the children of a model
+
+        :param obj: The parent model
+        :returns: The saved data of the children, invalid entries are skipped
+        :rtype: List
+
+        """
+        path = obj._child_path
+        name = obj._get_child_name() + ".json"
+
+        files, dirs = self._files, self._dirs
+        if files is not None:
+            children = (files[d].get(name) for d in dirs.get(path, []))
+            return [c for c in children if c is not None]
+
+        try:
+            dirs = os.listdir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+        children = []
+        for d in dirs:
+            file = path + "/" + d + "/" + name
+            try:
+                with open(file, 'r') as f:
+                    children.append(json.load(f))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except ValueError:
+                LOGGER.debug("Invalid JSON in " + file)
+        return children
+
+    def prepare(self, objs):
+        """Converts models to the entries written by write
+
+        :param objs: The models to convert
+        :returns: The entries to write
+        :rtype: List
+
+        """
+        return [(obj, obj._path, obj.name + ".json", _dump(obj)) for obj in objs]
+
+    def write(self, entries):
+        """Writes prepared entries to the store
+
+        :param entries: The entries from prepare
+        :returns: The models that could not be written
+        :rtype: List
+
+        """
+        if not entries:
+            return []
+
+        self._files = None
+        failed = []
+        for obj, path, name, data in entries:
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(path)
+
+                with open(path + name, 'w') as f:
+                    f.write(data)
+            except OSError:
+                LOGGER.exception("Failed to save %s", path + name)
+                failed.append(obj)
+        return failed
+
+    def clear(self):
+        """Frees the preloaded files"""
+        self._files = None
+        self._dirs = None
+
+    def remove(self, path):
+        """Removes a model and all its children from the store
+
+        :param path: The path of the model
+
+        """
+        self._files = None
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:  # pragma: nocover
+            pass
+
+    def close(self):
+        pass
+
+
+class SqliteStore():
+    """Stores the models in a single SQLite database
+
+    Every model is a row keyed by its path relative to the network, so a
+    model and its children can be removed with a single prefix delete.
+    The database runs in WAL mode and every write is one transaction.
+
+    The database is opened by the first preload, write or remove, and the
+    connection is shared with the persistence thread of the network, so
+    those calls and close must only run there. load and load_children are
+    served from the preloaded rows on the event loop.
+
+    """
+
+    def __init__(self, filename, root):
+        """Creates a store, the database is opened when it is first used
+
+        :param filename: The database file
+        :param root: The path of the network in the JSON directory tree
+
+        """
+        self._filename = filename
+        self._root = root
+        self._rows = None
+        self._children = None
+        self._db = None
+
+    def open(self):
+        """Opens the database, creating it if needed
+
+        If the database is new and a JSON directory tree exists at root, the
+        tree is migrated into the database and moved to ``<root>.migrated``.
+
+        """
+        if self._db is not None:
+            return
+
+        filename, root = self._filename, self._root
+        new = not os.path.exists(filename)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS model ("
+                "path TEXT PRIMARY KEY, parent TEXT NOT NULL, data TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS model_parent ON model (parent)")
+
+        if new and os.path.isdir(root):
+            count = self.migrate(root)
+            migrated = root.rstrip("/") + ".migrated"
+            # An earlier migrated tree is kept, move would put root inside it
+            n = 1
+            while os.path.exists(migrated):
+                migrated = root.rstrip("/") + ".migrated." + str(n)
+                n += 1
+            shutil.move(root, migrated)
+            LOGGER.info("Migrated %d models from %s to %s", count, root, filename)
+
+    def _key(self, path):
+        return path[len(self._root):]
+
+    @staticmethod
+    def _parent_key(key):
+        return key.rstrip("/").rpartition("/")[0]
+
+    def migrate(self, root):
+        """Imports a JSON directory tree into the database
+
+        :param root: The path of the network in the JSON directory tree
+        :returns: The number of models imported
+        :rtype: Integer
+
+        """
+        rows = []
+        for (path, dirs, files) in os.walk(root):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+
+                with open(os.path.join(path, name), 'r') as f:
+                    data = f.read()
+                try:
+                    json.loads(data)
+                except ValueError:
+                    LOGGER.debug("Invalid JSON in " + os.path.join(path, name))
+                    continue
+
+                key = os.path.relpath(path, root).replace(os.sep, "/") + "/"
+                if key == "./":
+                    key = ""
+                rows.append((key, self._parent_key(key), data))
+
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO model VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def preload(self, root):
+        """Reads and parses all rows in one query
+
+        load and load_children are served from the preloaded rows until the
+        next write or remove.
+
+        :param root: The path of the network
+
+        """
+        self.open()
+        rows = {}
+        children = {}
+        for parent, path, data in self._db.execute("SELECT parent, path, data FROM model"):
+            try:
+                rows[path] = json.loads(data)
+            except ValueError:
+                LOGGER.debug("Invalid JSON in " + path)
+                continue
+            children.setdefault(parent, []).append(path)
+
+        self._children = children
+        self._rows = rows
+
+    def _preloaded(self):
+        if self._rows is None:
+            # The database is only read on the persistence thread
+            raise RuntimeError("The store must be preloaded before it is loaded")
+        return self._rows
+
+    def load(self, obj):
+        """Loads the saved data of a model from the preloaded rows
+
+        :param obj: The model to load
+        :returns: The saved data, or None if the model is not saved
+        :rtype: Dict
+
+        """
+        return self._preloaded().get(self._key(obj._path))
+
+    def load_children(self, obj):
+        """Loads the saved data of the children of a model from the preloaded rows
+
+        :param obj: The parent model
+        :returns: The saved data of the children, invalid entries are skipped
+        :rtype: List
+
+        """
+        rows = self._preloaded()
+        return [rows[path] for path in self._children.get(self._key(obj._child_path), [])]
+
+    def prepare(self, objs):
+        """Converts models to the entries written by write
+
+        :param objs: The models to convert
+        :returns: The entries to write
+        :rtype: List
+
+        """
+        entries = []
+        for obj in objs:
+            key = self._key(obj._path)
+            entries.append((obj, key, self._parent_key(key), _dump(obj)))
+        return entries
+
+    def write(self, entries):
+        """Writes prepared entries to the store in one transaction
+
+        :param entries: The entries from prepare
+        :returns: The models that could not be written
+        :rtype: List
+
+        """
+        if not entries:
+            return []
+
+        self._rows = None
+        try:
+            self.open()
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO model VALUES (?, ?, ?)", [e[1:] for e in entries])
+        except sqlite3.Error:
+            LOGGER.exception("Failed to save %d models", len(entries))
+            return [e[0] for e in entries]
+        return []
+
+    def clear(self):
+        """Frees the preloaded rows"""
+        self._rows = None
+        self._children = None
+
+    def remove(self, path):
+        """Removes a model and all its children from the store
+
+        :param path: The path of the model
+
+        """
+        self._rows = None
+        key = self._key(path)
+        try:
+            self.open()
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM model WHERE substr(path, 1, ?) = ?", (len(key), key))
+        except sqlite3.Error:
+            LOGGER.exception("Failed to remove %s", path)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+
+class Snapshot():
+    """A single file with the complete model tree
+
+    The snapshot is written atomically and can be loaded in one read
+    instead of one read per model. It serves load and load_children like
+    a store once read. Children are keyed by the id of their parent, so
+    loading does not need the model paths.
+
+    """
+    version = 1
+
+    def __init__(self, filename):
+        """Creates a new snapshot
+
+        :param filename: The snapshot file
+
+        """
+        self._filename = filename
+        self._network = None
+        self._children = None
+
+    def prepare(self, network):
+        """Converts the network to the snapshot written by write
+
+        :param network: The network
+        :returns: The snapshot
+        :rtype: String
+
+        """
+        children = {}
+        objs = [network]
+        while objs:
+            obj = objs.pop()
+            if obj._children:
+                children[obj.id] = [
+                    {"data": c._get_raw_data(), "attr": c.attr} for c in obj._children]
+                objs.extend(obj._children)
+
+        return json.dumps(
+            {
+                "version": self.version,
+                "network": {"data": network._get_raw_data(), "attr": network.attr},
+                "children": children
+            },
+            cls=qzig.util.QZigEncoder,
+            separators=(",", ":")
+        )
+
+    def write(self, data):
+        """Writes the snapshot atomically
+
+        :param data: The snapshot from prepare
+
+        """
+        tmp = self._filename + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._filename)
+        except OSError:
+            LOGGER.exception("Failed to write snapshot %s", self._filename)
+
+    def read(self):
+        """Reads the snapshot
+
+        :returns: True if a valid snapshot was read
+        :rtype: Boolean
+
+        """
+        try:
+            with open(self._filename, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != self.version:
+                LOGGER.warning("Ignoring snapshot %s with version %s", self._filename, snapshot.get("version"))
+                return False
+            self._network = snapshot["network"]
+            self._children = snapshot["children"]
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, AttributeError):
+            LOGGER.warning("Ignoring invalid snapshot %s", self._filename)
+            return False
+        return True
+
+    def remove(self):
+        """Removes the snapshot"""
+        try:
+            os.remove(self._filename)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Frees the data read from the snapshot"""
+        self._network = None
+        self._children = None
+
+    def load(self, obj):
+        """Loads the saved data of the network
+
+        :param obj: The network
+        :returns: The saved data
+        :rtype: Dict
+
+        """
+        return self._network
+
+    def load_children(self, obj):
+        """Loads the saved data of the children of a model
+
+        :param obj: The parent model
+        :returns: The saved data of the children
+        :rtype: List
+
+        """
+        return self._children.get(obj.id, [])
+
+
+class _Node():
+    """Stands in for a model that is not created yet when capturing a subtree"""
+
+    def __init__(self, id, path, child_name):
+        self.id = id
+        self._path = path
+        self._child_name = child_name
+
+    @property
+    def _child_path(self):
+        return self._path + self._child_name
+
+    def _get_child_name(self):
+        return self._child_name
+
+
+class Subtree():
+    """The saved data of all descendants of a model
+
+    A subtree is captured from a store without creating any models, so the
+    models can be created later on when they are needed. The data is kept
+    as compact JSON, which takes a fraction of the memory of the parsed
+    data, and is parsed again every time it is read.
+
+    """
+
+    def __init__(self, children, id):
+        """Creates a new subtree
+
+        :param children: The saved data of the children keyed by the id of their parent
+        :param id: The id of the model
+
+        """
+        self.ids = [raw["data"][":id"] for loaded in children.values() for raw in loaded]
+        self.attrs = [raw["attr"] for raw in children.get(id, [])]
+        self._data = json.dumps(children, separators=(",", ":"))
+
+    @classmethod
+    def capture(cls, loader, obj, names):
+        """Captures the saved data of the descendants of a model
+
+        :param loader: The store or snapshot to read from
+        :param obj: The model
+        :param names: The child names of the levels below the children of obj
+        :returns: The subtree
+        :rtype: Subtree
+
+        """
+        children = {}
+        nodes = [(obj, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            loaded = loader.load_children(node)
+            if not loaded:
+                continue
+            children[node.id] = loaded
+            if depth < len(names):
+                for raw in loaded:
+                    id = raw["data"][":id"]
+                    path = node._child_path + "/" + id + "/"
+                    nodes.append((_Node(id, path, names[depth]), depth + 1))
+        return cls(children, obj.id)
+
+    def read(self):
+        """Parses the subtree
+
+        :returns: A loader that serves load_children from the subtree
+        :rtype: _Children
+
+        """
+        return _Children(json.loads(self._data))
+
+
+class _Children():
+    def __init__(self, children):
+        self._children = children
+
+    def load_children(self, obj):
+        return self._children.get(obj.id, [])
@@ -0,0 +1,78 @@
+import calendar
+import time
+
+
+class Timestamp():
+    """A point in time in whole seconds since the epoch
+
+    The ISO-8601 text is only made when the timestamp is serialised, and
+    then only once.
+
+    """
+    __slots__ = ("epoch", "_text")
+
+    def __init__(self, epoch, text=None):
+        """Creates a new timestamp
+
+        :param epoch: The seconds since the epoch
+        :param text: The ISO-8601 text, if it is already known
+
+        """
+        self.epoch = epoch
+        self._text = text
+
+    def isoformat(self):
+        """Formats the timestamp
+
+        :returns: The timestamp as ``YYYY-MM-DDTHH:MM:SSZ``
+        :rtype: String
+
+        """
+        if self._text is None:
+            self._text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.epoch))
+        return self._text
+
+    def __str__(self):
+        return self.isoformat()
+
+    def __eq__(self, other):
+        return isinstance(other, Timestamp) and other.epoch == self.epoch
+
+    def __hash__(self):
+        return hash(self.epoch)
+
+
+_now = Timestamp(0)
+
+
+def now():
+    """Gets the current time
+
+    All calls within the same second return the same timestamp, so the
+    time is formatted at most once per second.
+
+    :returns: The current time
+    :rtype: Timestamp
+
+    """
+    global _now
+    epoch = int(time.time())
+    if _now.epoch != epoch:
+        _now = Timestamp(epoch)
+    return _now
+
+
+def parse(text):
+    """Parses a saved ISO-8601 timestamp
+
+    :param text: The timestamp as ``YYYY-MM-DDTHH:MM:SSZ``
+    :returns: The timestamp, or the text if it is not a valid timestamp
+    :rtype: Timestamp
+
+    """
+    try:
+        epoch = calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                 int(text[11:13]), int(text[14:16]), int(text[17:19])))
+    except (TypeError, ValueError):
+        return text
+    return Timestamp(epoch, text)
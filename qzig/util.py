@@ -1,11 +1,33 @@
+import asyncio
 import json
 
 import qzig.value as value
 import qzig.state as state
 import qzig.status as status
+import qzig.timestamp as timestamp
+
+
+def _enum_value(obj):
+    return obj._value_
 
 
 class QZigEncoder(json.JSONEncoder):
+    _converters = {
+        value.ValuePermission: _enum_value,
+        value.ValueStatus: _enum_value,
+        state.StateType: _enum_value,
+        state.StateStatus: _enum_value,
+        status.StatusType: _enum_value,
+        status.StatusLevel: _enum_value,
+        value.ValueNumberType: value.ValueNumberType.get_data,
+        value.ValueStringType: value.ValueStringType.get_data,
+        # status.Status is not converted and is encoded as null
+        timestamp.Timestamp: timestamp.Timestamp.isoformat,
+        # value.ValueSetType: vars,
+        # value.ValueBlobType: vars,
+        # value.ValueXmlType: vars,
+    }
+
     def default(self, obj):
         """Converts a qzig obj to json
 
@@ -14,26 +36,75 @@ class QZigEncoder(json.JSONEncoder):
         :rtype: JSON
 
         """
-        if type(obj) is value.ValuePermission:
-            return obj.value
-        if type(obj) is value.ValueStatus:
-            return obj.value
-        if type(obj) is state.StateType:
-            return obj.value
-        if type(obj) is state.StateStatus:
-            return obj.value
-        if type(obj) is value.ValueNumberType:
-            return obj.__dict__
-        if type(obj) is value.ValueStringType:
-            return obj.__dict__
-        if type(obj) is status.StatusType:
-            return obj.value
-        if type(obj) is status.StatusLevel:
-            return obj.value
-        # if type(obj) is value.ValueSetType:
-        #    return obj.__dict__
-        # if type(obj) is value.ValueBlobType:
-        #    return obj.__dict__
-        # if type(obj) is value.ValueXmlType:
-        #    return obj.__dict__
-        # return json.JSONEncoder.default(self, obj)
+        try:
+            return self._converters[type(obj)](obj)
+        except KeyError:
+            return None
+
+
+def to_json(obj):
+    """Converts a qzig obj to something the json encoder supports
+
+    :param obj: The object that should be converted
+    :returns: The obj as a plain json type
+    :rtype: JSON
+
+    """
+    try:
+        return QZigEncoder._converters[type(obj)](obj)
+    except KeyError:
+        return obj
+
+
+class LoopLag():
+    """Measures how late the event loop runs a periodic timer
+
+    A loop that is blocked by synchronous work, like file I/O, runs the
+    timer late. The lag is the time between when the timer should have
+    fired and when it did.
+
+    """
+
+    def __init__(self, interval=1):
+        """Creates a new loop lag monitor
+
+        :param interval: The time between samples in seconds
+
+        """
+        self.interval = interval
+        self.samples = 0
+        self.last = 0
+        self.max = 0
+        self.total = 0
+
+    @property
+    def mean(self):
+        """The mean lag of all samples
+
+        :returns: The mean lag in seconds
+        :rtype: Float
+
+        """
+        if self.samples == 0:
+            return 0
+        return self.total / self.samples
+
+    def add(self, lag):
+        """Adds a lag sample
+
+        :param lag: The lag in seconds
+
+        """
+        self.samples += 1
+        self.last = lag
+        self.total += lag
+        self.max = max(self.max, lag)
+
+    @asyncio.coroutine
+    def run(self):
+        """Samples the loop lag until cancelled"""
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            yield from asyncio.sleep(self.interval)
+            self.add(max(0, loop.time() - start - self.interval))
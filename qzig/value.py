@@ -1,13 +1,191 @@
 import asyncio
 import logging
 import enum
+import sys
+import time
+import weakref
 
+import qzig
 import qzig.model as model
 import qzig.state as state
 
 
 LOGGER = logging.getLogger(__name__)
 
+_metadata = {}
+
+# The read aggregator of each cluster
+_readers = weakref.WeakKeyDictionary()
+
+# Cached for attributes the device did not return
+_unsupported = object()
+
+
+class ClusterReader():
+    """Reads the attributes of a cluster through a cache and merges the reads
+
+    The last known value of each attribute is kept together with the time
+    it was read or reported, and is used until it is older than its TTL.
+    Attributes that are requested within a short window are read with one
+    read_attributes call per manufacturer code, and the reply is given to
+    every requester.
+
+    :param cluster: The cluster to read from
+    :param window: The time to wait for more requests
+
+    """
+    window = .02
+    ttl = 60
+
+    # Cache hits and misses of all clusters
+    stats = {"hits": 0, "misses": 0}
+
+    def __init__(self, cluster, window=None):
+        self._cluster = cluster
+        if window is not None:
+            self.window = window
+        self._pending = {}
+        self._cache = {}
+        self._codes = {None}
+        self._listening = False
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get(cls, cluster):
+        """Gets the read aggregator of a cluster
+
+        :param cluster: The cluster
+        :returns: The read aggregator of the cluster
+        :rtype: ClusterReader
+
+        """
+        reader = _readers.get(cluster)
+        if reader is None:
+            reader = _readers[cluster] = cls(cluster)
+        return reader
+
+    def listen(self):
+        """Keeps the cache up to date with the reports of the cluster"""
+        if not self._listening:
+            self._listening = True
+            self._cluster.add_listener(self)
+
+    def attribute_updated(self, attribute, value):
+        """Called when an attribute is reported
+
+        A report has no manufacturer code, so only the standard attribute
+        is updated. The manufacturer specific attributes with the same id
+        are dropped, as the report may have been for one of them.
+
+        :param attribute: The id of the attribute
+        :param value: The new value of the attribute
+
+        """
+        self._cache[(attribute, None)] = (value, time.monotonic())
+        for code in self._codes:
+            if code is not None:
+                self._cache.pop((attribute, code), None)
+
+    def invalidate(self, attribute, manufacturer=None):
+        """Drops a cached attribute, so the next read goes to the cluster
+
+        :param attribute: The id of the attribute
+        :param manufacturer: The manufacturer code of the attribute
+
+        """
+        self._cache.pop((attribute, manufacturer), None)
+
+    def cluster_command(self, *args):
+        """Cluster Command handler stub"""
+        pass
+
+    def zdo_command(self, *args):
+        """zdo command stub"""
+        pass
+
+    @asyncio.coroutine
+    def read_attributes(self, attributes, manufacturer=None, ttl=None, force=False):
+        """Reads attributes from the cache, or from the cluster when stale
+
+        :param attributes: The ids of the attributes
+        :param manufacturer: The manufacturer code of the attributes
+        :param ttl: The time in seconds a cached value is used, or None for the default
+        :param force: Read all the attributes from the cluster
+        :returns: The found attributes and the ids of the missing attributes
+        :rtype: List
+
+        """
+        if ttl is None:
+            ttl = self.ttl
+        found = {}
+        missing = []
+        oldest = time.monotonic() - ttl
+        for a in attributes:
+            cached = None if force else self._cache.get((a, manufacturer))
+            if cached is not None and cached[1] >= oldest:
+                if cached[0] is not _unsupported:
+                    found[a] = cached[0]
+                self.hits += 1
+                ClusterReader.stats["hits"] += 1
+            else:
+                missing.append(a)
+                if not force:
+                    self.misses += 1
+                    ClusterReader.stats["misses"] += 1
+
+        if missing:
+            replies = yield from asyncio.gather(*[self.read(a, manufacturer) for a in missing])
+            for v in replies:
+                if v and v[0]:
+                    found.update(v[0])
+
+        return [found, [a for a in attributes if a not in found]]
+
+    def read(self, attribute, manufacturer=None):
+        """Requests an attribute to be read from the cluster
+
+        :param attribute: The id of the attribute
+        :param manufacturer: The manufacturer code of the attribute
+        :returns: Future with the reply of read_attributes
+        :rtype: Asyncio.Future
+
+        """
+        pending = self._pending.get(manufacturer)
+        if pending is None:
+            pending = self._pending[manufacturer] = {}
+            async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+            async_fun(self._read(manufacturer))
+
+        future = pending.get(attribute)
+        if future is None:
+            future = pending[attribute] = asyncio.Future()
+        return future
+
+    @asyncio.coroutine
+    def _read(self, manufacturer):
+        if self.window:
+            yield from asyncio.sleep(self.window)
+        pending = self._pending.pop(manufacturer)
+        try:
+            v = yield from self._cluster.read_attributes(list(pending), allow_cache=False,
+                                                         manufacturer=manufacturer)
+        except Exception as e:
+            for f in pending.values():
+                if not f.done():
+                    f.set_exception(e)
+            return
+
+        if v:
+            now = time.monotonic()
+            self._codes.add(manufacturer)
+            for a in pending:
+                self._cache[(a, manufacturer)] = (v[0][a] if v[0] and a in v[0] else _unsupported, now)
+
+        for f in pending.values():
+            if not f.done():
+                f.set_result(v)
+
 
 class ValuePermission(enum.Enum):
     """Enum for value permission"""
@@ -17,6 +195,9 @@ class ValuePermission(enum.Enum):
 
 
 class ValueNumberType():
+    __slots__ = ("min", "max", "step", "unit")
+    _shared = {}
+
     def __init__(self, data=None):
         """Class to handle a Number value type
 
@@ -35,12 +216,45 @@ class ValueNumberType():
             self.unit = data["unit"]
 
     def __getitem__(self, item):  # pragma: no cover
+        return getattr(self, item)
+
+    @classmethod
+    def shared(cls, data):
+        """Gets the shared number type with the given data
+
+        The shared instances are referenced by many values and must not be
+        changed.
+
+        :param data: A number type or the saved data of one
+        :returns: The shared number type
+        :rtype: ValueNumberType
+
+        """
+        if isinstance(data, cls):
+            min, max, step, unit = data.min, data.max, data.step, data.unit
+        else:
+            min, max, step, unit = data["min"], data["max"], data["step"], data["unit"]
+
+        # 1 and 1.0 are equal but serialised differently, so the types are part of the key
+        key = (min, max, step, unit, type(min), type(max), type(step))
+        obj = cls._shared.get(key)
+        if obj is None:
+            obj = cls._shared[key] = data if isinstance(data, cls) else cls(data)
+        return obj
+
+    def get_data(self):
+        """Gets the number type as dict
+
+        :returns: The data
+        :rtype: Dict
+
+        """
         return {
             'min': self.min,
             'max': self.max,
             'step': self.step,
             'unit': self.unit
-        }[item]
+        }
 
 
 class ValueSetType():
@@ -49,6 +263,12 @@ class ValueSetType():
 
 
 class ValueStringType():
+    # Some values give their string type number fields as well, these are
+    # only serialised when set
+    __slots__ = ("max", "encoding", "min", "step", "unit")
+    _shared = {}
+    _optional = ("min", "step", "unit")
+
     def __init__(self, data=None):
         """Class to handle a String value type
 
@@ -61,6 +281,46 @@ class ValueStringType():
         else:
             self.max = data["max"]
             self.encoding = data["encoding"]
+            for k in self._optional:
+                if k in data:
+                    setattr(self, k, data[k])
+
+    @classmethod
+    def shared(cls, data):
+        """Gets the shared string type with the given data
+
+        The shared instances are referenced by many values and must not be
+        changed.
+
+        :param data: A string type or the saved data of one
+        :returns: The shared string type
+        :rtype: ValueStringType
+
+        """
+        if isinstance(data, cls):
+            data = data.get_data()
+        key = tuple((k, data[k], type(data[k])) for k in data)
+
+        obj = cls._shared.get(key)
+        if obj is None:
+            obj = cls._shared[key] = cls(data)
+        return obj
+
+    def get_data(self):
+        """Gets the string type as dict
+
+        :returns: The data
+        :rtype: Dict
+
+        """
+        tmp = {
+            'max': self.max,
+            'encoding': self.encoding
+        }
+        for k in self._optional:
+            if hasattr(self, k):
+                tmp[k] = getattr(self, k)
+        return tmp
 
 
 class ValueBlobType():
@@ -75,6 +335,20 @@ class ValueXmlType():
     namespace = ""
 
 
+def _shared_type(data):
+    """Gets the shared number or string type of a value
+
+    :param data: A value type or the saved data of one
+    :returns: The shared value type
+
+    """
+    if isinstance(data, (ValueNumberType, ValueStringType)):
+        return type(data).shared(data)
+    # Saved data of a string type has an encoding, also under the number key
+    cls = ValueStringType if "encoding" in data else ValueNumberType
+    return cls.shared(data)
+
+
 class ValueStatus(enum.Enum):
     """Enum for Value Status"""
     OK = "ok"
@@ -87,6 +361,12 @@ class Value(model.Model):
     _index = 0
     _singleton = False
     _name = "value"
+    _child_name = "state"
+    _metadata = None
+    # The time in seconds a read or reported attribute is used, None for the default
+    _ttl = None
+    # How often the device should report the attribute, see reporting.Profile
+    _reporting = None
 
     def __init__(self, parent, endpoint_id=None, cluster_id=None, load=None):
         """Creates a new value
@@ -109,6 +389,7 @@ class Value(model.Model):
         if load is None:
             self._should_bind = True
             self._init()
+            self._share_metadata()
             if self.data["permission"] == ValuePermission.READ_ONLY:
                 self._add_states([state.StateType.REPORT])
             elif self.data["permission"] == ValuePermission.WRITE_ONLY:
@@ -125,6 +406,17 @@ class Value(model.Model):
     def _rebind(self):
         self._should_bind = True
 
+    def _controlled(self):
+        """Called when a control changed the attribute on the device
+
+        The cached attribute is dropped, so a GET does not report the
+        value from before the control.
+
+        """
+        cluster = getattr(self, "_cluster", None)
+        if cluster is not None and hasattr(self, "_attribute"):
+            ClusterReader.get(cluster).invalidate(self._attribute, getattr(self, "_manufacturer", None))
+
     @property
     def endpoint_id(self):
         """Returns the id of the endpoint of the value
@@ -161,24 +453,39 @@ class Value(model.Model):
     def _parse(self):
         self.data["permission"] = ValuePermission(self.data["permission"])
         self.data["status"] = ValueStatus(self.data["status"])
+        self._share_metadata()
 
-        if "number" in self.data:
-            self.data["number"] = ValueNumberType(self.data["number"])
-        elif "string" in self.data:
-            self.data["string"] = ValueStringType(self.data["string"])
         # elif "blob" in self.data:
         #     self.data["blob"] = ValueBlobType(self.data["blob"])
         # elif "xml" in self.data:
         #    self.data["xml"] = ValueSetType(self.data["xml"])
 
-    @asyncio.coroutine
-    def parse_cluster(self, endpoint, cluster):
-        """Handle the enpoint and cluster
+    def _share_metadata(self):
+        """Replaces the metadata of the value with shared instances
+
+        Values of the same class have the same metadata, so only one copy
+        of it is kept.
+
+        """
+        data = self.data
+        for key in ("number", "string"):
+            if key in data:
+                data[key] = _shared_type(data[key])
+        for key in (":type", "type"):
+            if key in data:
+                data[key] = sys.intern(data[key])
+
+    def _attach_cluster(self, endpoint, cluster, listen=True):
+        """Connects the value to its endpoint and cluster
 
         :param endpoint: The endpoint of this value
         :param cluster: The cluster of this value
+        :param listen: Should the report state listen on the cluster
 
         """
+        if getattr(self, "_cluster", None) is cluster:
+            # Already attached by an earlier interview of the device
+            return
         self._endpoint = endpoint
         self._cluster = cluster
 
@@ -187,15 +494,9 @@ class Value(model.Model):
             cluster.handle_cluster_request = self._handle_command
 
         rep = self._get_state(state.StateType.REPORT)
-        if rep is not None:
+        if rep is not None and listen:
             cluster.add_listener(rep)
-
-        if self._should_bind:
-            if self._bind:
-                LOGGER.debug("Binding to %s" % self.data["name"])
-                yield from self._do_bind(self.endpoint_id, self.cluster_id)
-
-            yield from self._handle_get()
+            ClusterReader.get(cluster).listen()
 
     def _add_states(self, types):
         for t in types:
@@ -223,13 +524,27 @@ class Value(model.Model):
         :rtype: Dict
 
         """
-        tmp = self._get_raw_data()
+        tmp = dict(self._get_raw_data())
+        tmp.update(self._get_metadata())
         if len(self._children):
-            tmp["state"] = []
-        for s in self._children:
-            tmp["state"].append(s.get_data())
+            tmp["state"] = [s.get_data() for s in self._children]
         return tmp
 
+    def _get_metadata(self):
+        """Gets the static metadata of the value converted to json once
+
+        The converted metadata is shared by all values with the same metadata.
+
+        """
+        if self._metadata is None:
+            keys = [k for k in ("permission", "status", "number", "string") if k in self.data]
+            shared = tuple((k, self.data[k]) for k in keys)
+            metadata = _metadata.get(shared)
+            if metadata is None:
+                metadata = _metadata[shared] = {k: qzig.util.to_json(v) for k, v in shared}
+            self._metadata = metadata
+        return self._metadata
+
     def _handle_report(self, attribute, data):
         if hasattr(self, '_attribute'):
             if self._attribute == attribute:
@@ -260,14 +575,15 @@ class Value(model.Model):
         LOGGER.error("Called unhandled handle_control")
 
     @asyncio.coroutine
-    def _handle_get(self):
+    def _handle_get(self, force=False):
         if hasattr(self, '_attribute'):
             if hasattr(self, '_manufacturer'):
                 manufacturer = self._manufacturer
             else:
                 manufacturer = None
-            v = yield from self._cluster.read_attributes([self._attribute], allow_cache=False, manufacturer=manufacturer)
-            if v and self._attribute in v[0]:
+            reader = ClusterReader.get(self._cluster)
+            v = yield from reader.read_attributes([self._attribute], manufacturer, self._ttl, force)
+            if self._attribute in v[0]:
                 self.delayed_report(0, self._attribute, v[0][self._attribute])
                 return True
 
@@ -1,5 +1,6 @@
 import logging
 
+import qzig.reporting as reporting
 import qzig.value as value
 
 LOGGER = logging.getLogger(__name__)
@@ -8,6 +9,7 @@ LOGGER = logging.getLogger(__name__)
 class DiagnosticsRetries(value.Value):
     """Class to handle the diagnostics retries report"""
     _bind = True
+    _reporting = reporting.Profile(600, 3600, 10)
     _attribute = 0x011B
 
     def _init(self):
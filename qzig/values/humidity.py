@@ -1,5 +1,6 @@
 import logging
 
+import qzig.reporting as reporting
 import qzig.value as value
 
 LOGGER = logging.getLogger(__name__)
@@ -9,6 +10,7 @@ class Humidity(value.Value):
     """Class to handle the humidity report"""
     _attribute = 0
     _bind = True
+    _reporting = reporting.Profile(30, 900, 100)
 
     def _init(self):
         self.data = {
@@ -1,6 +1,7 @@
 import logging
 import asyncio
 
+import qzig.reporting as reporting
 import qzig.value as value
 import bellows.types as t
 from bellows.zigbee.zcl import Cluster
@@ -41,6 +42,7 @@ class KaercherDeviceState(Cluster):
 class DeviceState(value.Value):
     """Value to handle device state reports"""
     _bind = True
+    _reporting = reporting.Profile(0, 3600, 1)
     _attribute = 0
     _singleton = True
     _manufacturer = 0x122C
@@ -88,6 +90,7 @@ class DeviceStateOtaUpdate(value.Value):
 class DeviceStateValueError(value.Value):
     """Value to handle device state value error"""
     _bind = True
+    _reporting = reporting.Profile(0, 3600, 1)
     _attribute = 0x0100
     _manufacturer = 0x122C
 
@@ -1,7 +1,9 @@
 import asyncio
 import logging
 
+import qzig.reporting as reporting
 import qzig.value as value
+import qzig.zigbee as zigbee
 import bellows.types as t
 
 LOGGER = logging.getLogger(__name__)
@@ -10,6 +12,7 @@ LOGGER = logging.getLogger(__name__)
 class OnOff(value.Value):
     """Value to handle the On/Off command"""
     _bind = True
+    _reporting = reporting.Profile(0, 900, 1)
     _attribute = 0
 
     def _init(self):
@@ -118,7 +121,7 @@ class OnTimeout(value.Value):
     def _handle_control(self, data=None):
         if self._get_manufacturer() == "Kaercher":
             data = int(data)
-            v = yield from self._cluster.request(False, 0x42, (t.uint16_t, ), data, manufacturer=0x122C)
+            v = yield from zigbee.request(self._cluster, False, 0x42, (t.uint16_t, ), data, manufacturer=0x122C)
         else:
             v = yield from self._cluster.on_with_timed_off()
 
@@ -70,15 +70,17 @@ class Ota(value.Value):
         :param args: The arguments for the command
 
         """
+        async_fun = getattr(asyncio, "ensure_future", asyncio.async)
         if command_id == 0x01:
-            self._handle_query_next_image(*args)
+            async_fun(self._handle_query_next_image(*args))
         elif command_id == 0x03:
-            self._handle_image_block(*args)
+            async_fun(self._handle_image_block(*args))
         elif command_id == 0x04:
             self._handle_image_page(*args)
         elif command_id == 0x06:
             self._handle_update_end(*args)
 
+    @asyncio.coroutine
     def _handle_query_next_image(self, control, manufacturer_id, image_type, version, *args):
         info = "Query Next Image Request - Control %d Manufactor Code %d Image Type %d Version %d" % (control, manufacturer_id, image_type, version)
         if control == 1:
@@ -90,10 +92,8 @@ class Ota(value.Value):
         filename = "ota/%s.upgrade" % name
 
         try:
-            file = open(filename, 'r')
-            upgrade = file.read().rstrip()
+            upgrade, size = yield from self._run_io(_read_upgrade, filename)
             new_version = upgrade.split('.')[0].split('-')[2]
-            size = os.path.getsize("ota/%s" % upgrade)
 
             LOGGER.debug("Upgrading %s to %s (%s) size %s", filename, upgrade, new_version, size)
 
@@ -105,18 +105,15 @@ class Ota(value.Value):
             LOGGER.warning("Failed to find %s", filename)
             self._cluster.query_next_image_response(Status.NO_IMAGE_AVAILABLE, 0, 0, 0, 0)
 
+    @asyncio.coroutine
     def _handle_image_block(self, control, manufacturer_id, image_type, version, offset, max_size, *args):
         LOGGER.debug("Image Block Request - Control %d Manufactor %d Type %d Version %d Offset %d Max size %d",
                      control, manufacturer_id, image_type, version, offset, max_size)
 
         filename = "ota/%d-%d-%d.bin" % (manufacturer_id, image_type, version)
         try:
-            f = open(filename, "rb")
-            f.seek(offset)
-            data = f.read(max_size)
+            data, total = yield from self._run_io(_read_block, filename, offset, max_size)
             size = len(data)
-            f.seek(0, os.SEEK_END)
-            total = f.tell()
             progress = int(offset / total * 100)
             self.delayed_report(0, self._attribute, str(progress) + "%")
 
@@ -134,19 +131,22 @@ class Ota(value.Value):
             LOGGER.debug("Done sending OTA page")
             return
 
-        try:
-            # Send the next image block
-            self._handle_image_block(0, self._manufacturer_id, self._image_type, self._version, self._offset, self._max_size)
+        offset = self._offset
 
-            # Update values with progress
-            self._page_size -= self._max_size
-            self._offset += self._max_size
-        except Exception as e:  # pragma: nocover
-            LOGGER.error("Error when sending OTA frame from Timer: %s\n", e.message)
+        # Update values with progress
+        self._page_size -= self._max_size
+        self._offset += self._max_size
 
-        # Start a timer to send the next block
+        # Start a timer to send the next block, the spacing does not depend
+        # on how long it takes to read this block
         Timer(self._response_spacing, self._send_next_image_block)
 
+        try:
+            # Send the next image block
+            yield from self._handle_image_block(0, self._manufacturer_id, self._image_type, self._version, offset, self._max_size)
+        except Exception as e:  # pragma: nocover
+            LOGGER.error("Error when sending OTA frame from Timer: %s\n", e)
+
     def _handle_image_page(self, control, manufacturer_id, image_type, version, offset, max_size, page_size, response_spacing, *args):
         LOGGER.debug("Image Page Request - Control %d Manufacturer %d Type %d Version %d Offset %d Max %d Page %d Response %d",
                      control, manufacturer_id, image_type, version, offset, max_size, page_size, response_spacing)
@@ -169,6 +169,20 @@ class Ota(value.Value):
         self.delayed_report(0, self._attribute, "Update End Status: %d" % status)
 
 
+def _read_upgrade(filename):
+    with open(filename, 'r') as f:
+        upgrade = f.read().rstrip()
+    return upgrade, os.path.getsize("ota/%s" % upgrade)
+
+
+def _read_block(filename, offset, max_size):
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        data = f.read(max_size)
+        f.seek(0, os.SEEK_END)
+        return data, f.tell()
+
+
 class Timer:
     def __init__(self, timeout, callback):
         self._timeout = timeout / 1000
@@ -1,5 +1,6 @@
 import logging
 
+import qzig.reporting as reporting
 import qzig.value as value
 
 LOGGER = logging.getLogger(__name__)
@@ -8,6 +9,7 @@ LOGGER = logging.getLogger(__name__)
 class PowerConfiguration(value.Value):
     """Class to handle Power measurements"""
     _bind = True
+    _reporting = reporting.Profile(3600, 43200, 1)
     _attribute = 0x20
 
     def _init(self):
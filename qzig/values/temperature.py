@@ -1,5 +1,6 @@
 import logging
 
+import qzig.reporting as reporting
 import qzig.value as value
 
 LOGGER = logging.getLogger(__name__)
@@ -8,6 +9,7 @@ LOGGER = logging.getLogger(__name__)
 class Temperature(value.Value):
     """Class to handle Temperature measurements"""
     _bind = True
+    _reporting = reporting.Profile(30, 900, 50)
     _attribute = 0
 
     def _init(self):
@@ -3,11 +3,40 @@ import logging
 import serial
 import sys
 
+import bellows.types as t
 import bellows.zigbee.application as zigbee
 import bellows.ezsp
 
 LOGGER = logging.getLogger(__name__)
 
+_MANUFACTURER_SPECIFIC = 0x04
+
+
+def request(cluster, general, command_id, schema, *args, manufacturer=None):
+    """Sends a ZCL command to a cluster
+
+    Cluster.request has no manufacturer code, so a manufacturer specific
+    command is framed here and sent through the device of the cluster.
+
+    :param cluster: The cluster to send the command to
+    :param general: Is this a general command
+    :param command_id: The id of the command
+    :param schema: The types of the arguments
+    :param args: The arguments of the command
+    :param manufacturer: The manufacturer code of the command
+    :returns: Future with the reply of the command
+    :rtype: Asyncio.Future
+
+    """
+    if manufacturer is None:
+        return cluster.request(general, command_id, schema, *args)
+
+    aps = cluster._endpoint.get_aps(cluster.cluster_id)
+    frame_control = _MANUFACTURER_SPECIFIC | (0x00 if general else 0x01)
+    data = bytes([frame_control]) + t.uint16_t(manufacturer).serialize()
+    data += bytes([aps.sequence, command_id]) + t.serialize(args, schema)
+    return cluster._endpoint.device.request(aps, data)
+
 
 class ZigBee():
     """Class to talk to the ZigBee network using bellows"""
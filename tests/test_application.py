@@ -1,6 +1,18 @@
+import asyncio
+import json
 import os
 import shutil
+import threading
+import time
 import tests.util as util
+import qzig.application as application
+import qzig.util
+import qzig.network as network
+import qzig.state as state
+import qzig.status as status
+import qzig.timestamp as timestamp
+import qzig.value as value
+from qzig.values import kaercher
 from tests.util import MockDevice, MockEndpoint, MockCluster
 
 
@@ -120,6 +132,38 @@ def test_wrong_devices_from_server(app):
     assert "/network/test_id/device/1" in app._rpc._transport.write.call_args[0][0].decode()
 
 
+def test_wrong_devices_batched(app):
+    util._startup(app=app, server_devices=["1", "2", "3"])
+
+    writes = [json.loads(c[0][0].decode()) for c in app._rpc._transport.write.call_args_list]
+    batches = [w for w in writes if isinstance(w, list)]
+    assert [[r["params"]["url"] for r in b] for b in batches] == [
+        ["/network/test_id/device/" + id for id in ["1", "2", "3"]]]
+    assert all(r["method"] == "DELETE" for b in batches for r in b)
+
+    # Known devices are kept
+    gw = app._network._get_device("gateway")
+    util._startup(app=app, server_devices=[gw.id, "4"])
+    writes = [json.loads(c[0][0].decode()) for c in app._rpc._transport.write.call_args_list]
+    deletes = [w["params"]["url"] for w in writes if isinstance(w, dict) and w.get("method") == "DELETE"]
+    assert deletes == ["/network/test_id/device/4"]
+
+
+def test_remove_unknown_devices(app):
+    util._startup(app, util._get_device())
+    d = app._network._get_device("00:11:22:33:44:55:66:77")
+    assert d is not None
+
+    app._zb.controller.devices = {}
+    asyncio.get_event_loop().run_until_complete(app._remove_unknown_devices())
+    util.run_loop()
+    assert not os.path.exists(d._path)
+    assert app._network._get_device("00:11:22:33:44:55:66:77") is None
+    assert d not in app._network._children
+    assert app._network._get_device("gateway") is not None
+    assert "/network/test_id/device/" + d.id in app._rpc._transport.write.call_args[0][0].decode()
+
+
 def test_gateway_add(app, store):
     util._startup(app)
 
@@ -170,3 +214,323 @@ def test_remove_deivce_at_boot(app):
     device = MockDevice("00:11:22:33:44:55:66:77", 1)
     devices = {"wrong": device}
     util._startup(app, devices)
+
+
+def test_resync_after_reconnect(app):
+    util._startup(app)
+
+    count = app._rpc._transport.write.call_count
+
+    app.rpc_reconnected()
+    util.run_loop()
+
+    writes = [c[0][0].decode() for c in app._rpc._transport.write.call_args_list[count:]]
+    assert '"POST"' in writes[0] and '"/network"' in writes[0]
+    assert '"GET"' in writes[1]
+
+
+def test_encode_network(app):
+    app._gateway = None
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    dev = app._network._children[0]
+    dev.add_status(status.StatusType.APPLICATION, status.StatusLevel.WARNING, "Low battery")
+
+    data = json.loads(json.dumps(app._network.get_data(), cls=qzig.util.QZigEncoder))
+    dev_data = data["device"][0]
+    assert dev_data["status"] == [None]
+    assert dev_data["value"][0]["permission"] == "rw"
+    assert dev_data["value"][0]["number"]["unit"] == "boolean"
+    assert dev_data["value"][0]["state"][0]["type"] in ["Report", "Control"]
+
+    # The model keeps the typed metadata
+    assert dev._children[0].data["permission"] == value.ValuePermission.READ_WRITE
+    assert "state" not in dev._children[0].data
+
+    # States, statuses and value types are slotted
+    assert dev_data["value"][0]["number"] == {"min": 0, "max": 1, "step": 1, "unit": "boolean"}
+    for obj in [dev._children[0]._children[0], dev.data["status"][0], dev._children[0].data["number"]]:
+        assert not hasattr(obj, "__dict__")
+    assert dev._children[0]._children[0].attr == {}
+
+
+def test_encode_string_type_with_number(app):
+    devices = util._get_device(kaercher.KaercherDeviceState.cluster_id)
+    util._startup(app, devices)
+
+    val = [v for v in app._network._get_device("00:11:22:33:44:55:66:77")._children if isinstance(v, kaercher.DeviceStateValueError)][0]
+    data = json.loads(json.dumps(val.get_data(), cls=qzig.util.QZigEncoder))
+    expected = {"max": 2, "encoding": "", "min": 0, "step": 1, "unit": "State"}
+    assert data["number"] == expected
+
+    # The saved data loads as the same slotted string type
+    loaded = value._shared_type(data["number"])
+    assert isinstance(loaded, value.ValueStringType)
+    assert loaded.get_data() == expected
+    assert not hasattr(loaded, "__dict__")
+
+
+class _HangingCluster(MockCluster):
+    hanging = set()
+    peak = 0
+
+    @asyncio.coroutine
+    def read_attributes(self, *args, **kwargs):
+        cls = _HangingCluster
+        cls.hanging.add(self)
+        cls.peak = max(cls.peak, len(cls.hanging))
+        try:
+            yield from asyncio.sleep(10)
+        finally:
+            cls.hanging.discard(self)
+
+
+class _FailingCluster(MockCluster):
+    @asyncio.coroutine
+    def read_attributes(self, *args, **kwargs):
+        raise RuntimeError("Unreachable")
+
+
+def _interview_devices(clusters):
+    devices = {}
+    for i, cls in enumerate(clusters):
+        ieee = "00:11:22:33:44:55:66:%02d" % i
+        endpoint = MockEndpoint(1)
+        endpoint.in_clusters[0] = cls(0)
+        endpoint.in_clusters[6] = MockCluster(6)
+        devices[ieee] = MockDevice(ieee, i)
+        devices[ieee].endpoints[1] = endpoint
+    return devices
+
+
+def test_parallel_interview(app, monkeypatch):
+    monkeypatch.setattr(value.ClusterReader, "window", 0)
+    monkeypatch.setattr(_HangingCluster, "peak", 0)
+    devices = _interview_devices([MockCluster, _HangingCluster, _FailingCluster, _HangingCluster, MockCluster])
+
+    app._interview_concurrency = 2
+    app._interview_timeout = .2
+    util._startup(app, devices)
+
+    # The two hanging devices are interviewed at the same time
+    assert _HangingCluster.peak == 2
+    assert app.interview == {"total": 5, "done": 5, "failed": 3}
+    for ieee in ["00:11:22:33:44:55:66:00", "00:11:22:33:44:55:66:04"]:
+        assert app._network._get_device(ieee).get_value(1, 6) is not None
+
+
+def test_interview_retry(app, monkeypatch):
+    monkeypatch.setattr(value.ClusterReader, "window", 0)
+    devices = _interview_devices([MockCluster, _HangingCluster])
+
+    app._interview_timeout = .2
+    util._startup(app, devices)
+
+    # The device keeps its values, but not the data that was not read
+    ieee = "00:11:22:33:44:55:66:01"
+    d = app._network._get_device(ieee)
+    assert app._retry_interview == {ieee}
+    assert app.interview["failed"] == 1
+    assert d.get_value(1, 6) is not None
+    assert d.data["version"] == "N/A"
+
+    # The device answers again when it rejoins
+    devices[ieee].endpoints[1].in_clusters[0] = MockCluster(0)
+    util.run_tasks(app._zb.controller._cb.device_joined, devices[ieee])
+
+    assert app._retry_interview == set()
+    assert app.interview["failed"] == 0
+    assert app._network._get_device(ieee) is d
+    assert d.data["version"] != "N/A"
+    assert devices[ieee].zdo._cb == [d]
+    listeners = devices[ieee].endpoints[1].in_clusters[6]._cb
+    assert len(listeners) == len(set(map(id, listeners)))
+
+
+def test_shared_metadata(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    d = app._network._get_device("00:11:22:33:44:55:66:77")
+    v = d.get_value(1, 6)
+    other = d._create_child(endpoint_id=2, cluster_id=6)[0]
+    assert other.data["number"] is v.data["number"]
+    assert other._get_metadata() is v._get_metadata()
+    assert v._get_metadata()["number"] == {"min": 0, "max": 1, "step": 1, "unit": "boolean"}
+
+    # Equal numbers of another type are not shared, as they serialise differently
+    number = value.ValueNumberType.shared({"min": 0.0, "max": 1, "step": 1, "unit": "boolean"})
+    assert number is not v.data["number"]
+
+    app._network._flush()
+    loaded = network.Network(app, app._network.id)
+    loaded._rootdir = app._network._rootdir
+    asyncio.get_event_loop().run_until_complete(loaded._load())
+    assert loaded._find_child(v.id).data["number"] is v.data["number"]
+
+
+def test_timestamp(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    s = app._network._children[0]._children[0]._children[0]
+    ts = timestamp.now()
+    assert timestamp.now() is ts or timestamp.now().epoch > ts.epoch
+    assert str(timestamp.Timestamp(1495189000)) == "2017-05-19T10:16:40Z"
+    assert timestamp.parse("2017-05-19T10:16:40Z").epoch == 1495189000
+    assert timestamp.parse("invalid") == "invalid"
+
+    s.data["timestamp"] = timestamp.Timestamp(1495189000)
+    s._save()
+    data = json.loads(json.dumps(s.get_data(), cls=qzig.util.QZigEncoder))
+    assert data["timestamp"] == "2017-05-19T10:16:40Z"
+
+    app._network._flush()
+    with open(s._path + "state.json") as f:
+        assert json.load(f)["data"]["timestamp"] == "2017-05-19T10:16:40Z"
+    loaded = network.Network(app, app._network.id)
+    loaded._rootdir = app._network._rootdir
+    asyncio.get_event_loop().run_until_complete(loaded._load())
+    assert loaded._find_child(s.id).data["timestamp"] == timestamp.Timestamp(1495189000)
+
+
+def test_id_index(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    net = app._network
+    objs = [o for d in net._children for v in d._children for o in [d, v] + v._children]
+    for o in objs:
+        assert net._find_child(o.id) is o
+
+    loaded = network.Network(app, net.id)
+    loaded._rootdir = net._rootdir
+    asyncio.get_event_loop().run_until_complete(loaded._load())
+    for o in objs:
+        assert loaded._find_child(o.id).id == o.id
+
+    dev = next(iter(devices.values()))
+    d = net._get_device(str(dev.ieee))
+    net.remove_device(dev)
+    assert net._find_child(d.id) is None
+    assert net._find_child(d._children[0]._children[0].id) is None
+    assert net._find_child("unknown") is None
+
+
+def test_cached_paths(app, tmpdir):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    d = app._network._get_device("00:11:22:33:44:55:66:77")
+    s = d._children[0]._children[0]
+    assert s._path == d._children[0]._path + "state/" + s.id + "/"
+    assert s._get_url() == (app, "/network/test_id/device/" + d.id + "/value/" + d._children[0].id + "/state/" + s.id)
+
+    other = network.Network(app, "other_id")
+    other._rootdir = str(tmpdir) + "other/"
+    d._reparent(other)
+    assert s._path.startswith(str(tmpdir) + "other/store/device/" + d.id + "/")
+    assert s._get_url()[1].startswith("/network/other_id/device/")
+    d._reparent(app._network)
+
+
+def test_device_and_value_index(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    net = app._network
+    dev = net._get_device("00:11:22:33:44:55:66:77")
+    assert dev is not None
+    assert net._get_device("", dev.id) is dev
+    assert net._get_device("", dev._children[0].id) is None
+    assert net._get_device("gateway").ieee == "gateway"
+
+    val = dev._children[0]
+    assert dev.get_value(1, 6) is val
+    assert dev.get_value("1", "6", "0") is val
+    assert dev.get_value(1, 6, 9) is None
+    assert dev.get_value(2, 6) is None
+    count = len(dev._children)
+    assert dev.add_value(1, 6)[0] is val
+    assert len(dev._children) == count
+
+    net.remove_device(next(iter(devices.values())))
+    assert net._get_device("00:11:22:33:44:55:66:77") is None
+
+
+def test_write_behind(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    dev = next(iter(devices.values()))
+    cluster = dev.endpoints[1].in_clusters[6]
+    s = app._network._get_device(str(dev.ieee))._children[0]._get_state(state.StateType.REPORT)
+    path = s._path + "state.json"
+    app._network._flush()
+
+    for c in cluster._cb:
+        c.attribute_updated(0, 1)
+
+    with open(path) as f:
+        assert json.load(f)["data"]["data"] == "0"
+    assert s in app._network._dirty
+
+    assert app._network._flush() == 1
+    with open(path) as f:
+        assert json.load(f)["data"]["data"] == "1"
+
+    for c in cluster._cb:
+        c.attribute_updated(0, 0)
+    app.close()
+    with open(path) as f:
+        assert json.load(f)["data"]["data"] == "0"
+
+    d = app._network._get_device(str(dev.ieee))
+    d._save()
+    app._network.remove_device(dev)
+    assert not app._network._dirty
+    app._network._flush()
+    assert not os.path.exists(d._path)
+
+
+def test_persistence_thread(app):
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    threads = []
+    write = app._network._store.write
+
+    def _write(entries):
+        threads.append(threading.current_thread())
+        return write(entries)
+
+    app._network._store.write = _write
+    s = app._network._get_device("00:11:22:33:44:55:66:77")._children[0]._children[0]
+    s.data["data"] = "42"
+    s._save()
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(app._network._flush_async()) == 1
+    assert threads and threads[0] is not threading.main_thread()
+    with open(s._path + "state.json") as f:
+        assert json.load(f)["data"]["data"] == "42"
+
+
+def test_loop_lag(app):
+    app.loop_lag.interval = .001
+    util._startup(app)
+
+    time.sleep(.01)
+    util.run_loop(.01)
+
+    assert app.loop_lag.samples > 0
+    assert app.loop_lag.max >= .005
+    assert app.loop_lag.max >= app.loop_lag.mean > 0
+
+
+def test_spool_option(app, tmpdir):
+    assert "spool" not in app.rpc_options
+
+    spooled = application.Application("/dev/null", "test_id", rootdir=str(tmpdir) + "/", spool="outbox/")
+    assert spooled.rpc_options["spool"] == str(tmpdir) + "/outbox/"
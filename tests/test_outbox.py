@@ -0,0 +1,121 @@
+import asyncio
+import json
+from unittest import mock
+
+import qzig.json_rpc as json_rpc
+from qzig.outbox import Outbox, Spool
+
+
+def test_outbox_folds_keyed_items():
+    q = Outbox()
+
+    assert q.put_nowait("a") is False
+    assert q.put_nowait("b1", "b") is False
+    assert q.put_nowait("c") is False
+    assert q.put_nowait("b2", "b") is True
+
+    assert [q.get_nowait() for i in range(3)] == ["a", "b2", "c"]
+    assert q.put_nowait("b3", "b") is False
+    assert q.get_nowait() == "b3"
+
+
+def test_spool_segments(tmpdir):
+    spool = Spool(str(tmpdir), max_size=80, segment_size=30)
+
+    for i in range(0, 10):
+        spool.append('{"id": %d}' % i)
+
+    # 10 bytes per message, 3 messages per segment and max 80 bytes
+    assert spool.evicted == 1
+    assert len(spool) == 3
+    assert spool.size <= 80
+
+    segment, frames = spool.pop()
+    assert frames == ['{"id": 3}', '{"id": 4}', '{"id": 5}']
+    spool.remove(segment)
+    spool.close()
+
+    spool = Spool(str(tmpdir))
+    assert len(spool) == 2
+    assert [spool.pop()[1] for i in range(2)] == [['{"id": 6}', '{"id": 7}', '{"id": 8}'], ['{"id": 9}']]
+    assert spool.pop() == (None, [])
+
+    spool.rewind()
+    assert len(spool) == 2
+
+
+def _wait_io(rpc):
+    asyncio.get_event_loop().run_until_complete(rpc._io(lambda: None))
+
+
+def _written(transport):
+    return json_rpc.JsonStream().feed(b"".join(c[0][0] for c in transport.write.call_args_list))
+
+
+def test_spool_while_disconnected(tmpdir):
+    app = mock.MagicMock()
+    rpc = json_rpc.JsonRPC(app, asyncio.Future(), spool=str(tmpdir))
+    rpc.connection_made(mock.MagicMock())
+    rpc.connection_lost(None)
+    rpc._task_reconnect.cancel()
+
+    rpc.put("/state/1", {"data": "1"})
+    rpc.put("/state/1", {"data": "2"})
+    assert rpc.stats["spooled"] == 2
+    _wait_io(rpc)
+    assert len(tmpdir.listdir()) == 1
+
+    transport = mock.MagicMock()
+    rpc.connection_made(transport)
+
+    # New requests are spooled until the old ones have been replayed
+    rpc.put("/state/1", {"data": "3"})
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(rpc._task_replay)
+
+    assert app.rpc_reconnected.called
+    assert rpc.stats["replayed"] == 3
+    frames = _written(transport)
+    assert [f["params"]["data"]["data"] for f in frames] == ["1", "2", "3"]
+
+    for f in frames:
+        rpc.data_received(json.dumps({"jsonrpc": "2.0", "id": f["id"], "result": True}).encode())
+
+    _wait_io(rpc)
+    assert len(tmpdir.listdir()) == 0
+
+    rpc.put("/state/1", {"data": "4"})
+    assert rpc.stats["spooled"] == 3
+
+    rpc.close()
+
+
+def test_spool_replayed_before_send_queue(tmpdir):
+    app = mock.MagicMock()
+    rpc = json_rpc.JsonRPC(app, asyncio.Future(), spool=str(tmpdir))
+    rpc.connection_made(mock.MagicMock())
+    rpc.connection_lost(None)
+    rpc._task_reconnect.cancel()
+
+    # Results are queued, requests are spooled while disconnected
+    rpc.put("/state/1", {"data": "1"})
+    rpc._send_result(5, True)
+    rpc.put("/state/1", {"data": "2"})
+
+    transport = mock.MagicMock()
+    rpc.connection_made(transport)
+    rpc.put("/state/1", {"data": "3"})
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(rpc._task_replay)
+    loop.run_until_complete(asyncio.sleep(.001))
+
+    frames = _written(transport)
+    assert [f["params"]["data"]["data"] if "params" in f else f["id"] for f in frames] == ["1", "2", "3", 5]
+
+    # Requests after the replay are sent directly
+    rpc.put("/state/1", {"data": "4"})
+    loop.run_until_complete(asyncio.sleep(.001))
+    assert _written(transport)[-1]["params"]["data"]["data"] == "4"
+    assert rpc.stats["spooled"] == 3
+
+    rpc.close()
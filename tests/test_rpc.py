@@ -1,6 +1,10 @@
 import asyncio
+import json
+from unittest import mock
 import tests.util as util
 import qzig.state as state
+import qzig.json_rpc as json_rpc
+import qzig.value as value
 
 import bellows.zigbee.zcl.clusters.general as general_clusters
 from qzig.values import kaercher
@@ -66,6 +70,24 @@ def test_wrong_service(app):
     assert "error" in app._rpc._transport.write.call_args[0][0].decode()
 
 
+def test_request_exception(app, monkeypatch, caplog):
+    util._startup(app)
+
+    @asyncio.coroutine
+    def _put(**params):
+        assert False, "Broken handler"
+    monkeypatch.setattr(app, "put", _put)
+
+    count = app._rpc._transport.write.call_count
+    util.run_tasks(app._rpc.data_received, util._rpc_delete("state", "1").replace("DELETE", "PUT").encode())
+
+    # The server gets an error response, and the traceback is logged
+    assert app._rpc._transport.write.call_count == (count + 1)
+    response = json.loads(app._rpc._transport.write.call_args[0][0].decode())
+    assert response["id"] == "1" and "Broken handler" in json.dumps(response["error"])
+    assert "Traceback" in caplog.text
+
+
 def test_wrong_put(app):
     devices = util._get_device()
     util._startup(app, devices)
@@ -229,6 +251,8 @@ def test_state_kaercher_on_timeout_change(app):
     assert app._rpc._transport.write.call_count == (count + 1)
 
     assert "result" in app._rpc._transport.write.call_args[0][0].decode()
+    cluster = next(iter(devices.values())).endpoints[1].in_clusters[6]
+    assert cluster.commands == [(0x42, 0x122C, b"\x01\x00")]
 
 
 def test_state_report_change(app):
@@ -511,11 +535,9 @@ def test_delete_device(app, store):
 
     id = d.id
     rpc = util._rpc_delete("device", id)
-    app._rpc.data_received(rpc.encode())
-
     count = app._rpc._transport.write.call_count
 
-    util.run_loop()
+    util.run_tasks(app._rpc.data_received, rpc.encode())
 
     assert app._rpc._transport.write.call_count == (count + 2)
     assert "result" in app._rpc._transport.write.call_args[0][0].decode()
@@ -533,16 +555,91 @@ def test_get_value(app):
 
     id = s.id
     rpc = util._rpc_get("state", id)
-    app._rpc.data_received(rpc.encode())
-
     count = app._rpc._transport.write.call_count
 
-    util.run_loop()
+    util.run_tasks(app._rpc.data_received, rpc.encode())
 
     assert app._rpc._transport.write.call_count == (count + 2)
     assert "PUT" in app._rpc._transport.write.call_args[0][0].decode()
 
 
+def test_get_value_cached(app):
+    app._gateway = None
+    devices = util._get_device()
+    dev = next(iter(devices.values()))
+    dev.endpoints[1].in_clusters[general_clusters.Basic.cluster_id] = util.MockCluster(general_clusters.Basic.cluster_id)
+    util._startup(app, devices)
+
+    cluster = dev.endpoints[1].in_clusters[general_clusters.OnOff.cluster_id]
+    basic = dev.endpoints[1].in_clusters[general_clusters.Basic.cluster_id]
+    reads = len(cluster.reads)
+    basic_reads = basic.reply_count
+    hits = app.attribute_cache["hits"]
+    misses = app.attribute_cache["misses"]
+
+    s = app._network._children[0]._children[0]._get_state(state.StateType.REPORT)
+    d = app._network._children[0]
+    key = (s._parent._attribute, getattr(s._parent, "_manufacturer", None))
+
+    # The interview reads are fresh, so the device info is taken from the cache
+    asyncio.get_event_loop().run_until_complete(d.read_device_info())
+    assert basic.reply_count == basic_reads
+    assert app.attribute_cache["hits"] - hits == 13
+    assert app.attribute_cache["misses"] == misses
+
+    # GETs from the server always read from the device
+    util.run_tasks(app._rpc.data_received, util._rpc_get("state", s.id).encode())
+    assert cluster.reads[reads:] == [([key[0]], key[1])]
+    util.run_tasks(app._rpc.data_received, util._rpc_get("device", d.id).encode())
+    assert basic.reply_count > basic_reads
+    assert app.attribute_cache["misses"] == misses
+    assert s.data["data"] == "0"
+
+
+def test_cluster_reader_manufacturer_report():
+    cluster = util.MockCluster(kaercher.KaercherFallback.cluster_id)
+    cluster.written = {(0, None): 5, (0, 0x122C): 7}
+    reader = value.ClusterReader(cluster)
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(reader.read_attributes([0])) == [{0: 5}, []]
+    assert loop.run_until_complete(reader.read_attributes([0], 0x122C)) == [{0: 7}, []]
+
+    # A report updates the standard attribute and drops the manufacturer one
+    reader.attribute_updated(0, 6)
+    reads = len(cluster.reads)
+    assert loop.run_until_complete(reader.read_attributes([0])) == [{0: 6}, []]
+    assert len(cluster.reads) == reads
+    assert loop.run_until_complete(reader.read_attributes([0], 0x122C)) == [{0: 7}, []]
+    assert cluster.reads[reads:] == [([0], 0x122C)]
+
+    # Stale attributes are read again
+    reader._cache[(0, None)] = (6, reader._cache[(0, None)][1] - reader.ttl - 1)
+    assert loop.run_until_complete(reader.read_attributes([0])) == [{0: 5}, []]
+    assert cluster.reads[reads:] == [([0], 0x122C), ([0], None)]
+
+
+def test_get_value_after_control(app):
+    app._gateway = None
+    devices = util._get_device(kaercher.KaercherFallback.cluster_id)
+    util._startup(app, devices)
+
+    v = app._network._children[0]._children[0]
+    control = v._get_state(state.StateType.CONTROL)
+    report = v._get_state(state.StateType.REPORT)
+
+    util.run_tasks(app._rpc.data_received, util._rpc_state(control.id, "1").encode())
+    assert report.data["data"] == "1"
+
+    # The GET does not report the value cached from before the control
+    count = app._rpc._transport.write.call_count
+    util.run_tasks(app._rpc.data_received, util._rpc_get("state", report.id).encode())
+    assert report.data["data"] == "1"
+    puts = [c[0][0].decode() for c in app._rpc._transport.write.call_args_list[count:]]
+    puts = [w for w in puts if '"PUT"' in w]
+    assert len(puts) == 1
+    assert '"data": "1"' in puts[0]
+
+
 def test_get_device(app):
     app._gateway = None
     devices = util._get_device()
@@ -617,3 +714,302 @@ def test_ota_notify_invalid_format(app):
 
 def test_ota_notify_invalid_type(app):
     failed_rpc_call(app, general_clusters.Ota.cluster_id, 0, True)
+
+
+def test_stream_split_documents():
+    stream = json_rpc.JsonStream()
+
+    assert stream.feed(b'{"a": "}{\\"", "b": [1, 2') == []
+    assert stream.feed(b']}  {"c": "\\') == [{"a": "}{\"", "b": [1, 2]}]
+    assert stream.feed(b'\\"} {"d": "\xc3') == [{"c": "\\"}]
+    assert stream.feed(b'\xa6"}') == [{"d": "\u00e6"}]
+    assert len(stream) == 0
+
+
+def test_stream_invalid_data():
+    stream = json_rpc.JsonStream()
+
+    assert stream.feed(b'}{"a": 1}{"b": x}[2]') == [{"a": 1}, [2]]
+    assert len(stream) == 0
+
+
+def test_concatenated_requests(app):
+    app._gateway = None
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    s = app._network._children[0]._children[0]._get_state(state.StateType.CONTROL)
+    rpc = util._rpc_state(s.id, "1") + util._rpc_get("device", app._network._children[0].id)
+
+    count = app._rpc._transport.write.call_count
+
+    app._rpc.data_received(rpc.encode())
+    util.run_loop()
+
+    assert app._rpc._transport.write.call_count == (count + 3)
+
+
+def test_fragmented_request(app):
+    app._gateway = None
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    s = app._network._children[0]._children[0]._get_state(state.StateType.CONTROL)
+    rpc = util._rpc_state(s.id, "1").encode()
+
+    count = app._rpc._transport.write.call_count
+
+    for i in range(0, len(rpc), 7):
+        app._rpc.data_received(rpc[i:i + 7])
+    util.run_loop()
+
+    assert app._rpc._transport.write.call_count == (count + 1)
+    assert "result" in app._rpc._transport.write.call_args[0][0].decode()
+
+
+def test_get_does_not_block_send_queue(app):
+    util._startup(app)
+
+    async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+    first = async_fun(app._rpc.get("/first"))
+    second = async_fun(app._rpc.get("/second"))
+    util.run_loop()
+
+    count = app._rpc._transport.write.call_count
+    app._rpc.put("/state/test", {"data": "1"})
+    util.run_loop()
+
+    assert app._rpc._transport.write.call_count == (count + 1)
+    assert len(app._rpc._pending) == 2
+
+    ids = sorted(app._rpc._pending.keys())
+    app._rpc.data_received(('{"jsonrpc":"2.0","id":%d,"result":"second"}' % ids[1]).encode())
+    app._rpc.data_received(('{"jsonrpc":"2.0","id":%d,"result":"first"}' % ids[0]).encode())
+    util.run_loop()
+
+    assert first.result() == "first"
+    assert second.result() == "second"
+    assert len(app._rpc._pending) == 0
+
+
+def test_request_window(app):
+    util._startup(app)
+
+    app._rpc._window = asyncio.Semaphore(1)
+
+    async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+    first = async_fun(app._rpc.get("/first"))
+    async_fun(app._rpc.get("/second"))
+    util.run_loop()
+
+    count = app._rpc._transport.write.call_count
+    assert len(app._rpc._pending) == 1
+
+    id = next(iter(app._rpc._pending))
+    app._rpc.data_received(('{"jsonrpc":"2.0","id":%d,"result":true}' % id).encode())
+    util.run_loop()
+
+    assert first.result() is True
+    assert app._rpc._transport.write.call_count == (count + 1)
+    assert "/second" in app._rpc._transport.write.call_args[0][0].decode()
+
+
+def test_get_timeout(app):
+    util._startup(app)
+
+    app._rpc._retries = 2
+    app._rpc._backoff = 0
+
+    count = app._rpc._transport.write.call_count
+
+    loop = asyncio.get_event_loop()
+    res = loop.run_until_complete(app._rpc.get("/timeout", timeout=.001))
+
+    assert res["code"] == -32000
+    assert app._rpc._transport.write.call_count == (count + 3)
+    assert app._rpc.stats["timeouts"] == 3
+    assert app._rpc.stats["retries"] == 2
+    assert app._rpc.stats["failures"] == 1
+    assert len(app._rpc._pending) == 0
+
+
+def test_get_deadline(app):
+    util._startup(app)
+
+    app._rpc._retries = 100
+    app._rpc._backoff = 0
+    app._rpc._deadline = .05
+
+    # The retries stop at the deadline
+    loop = asyncio.get_event_loop()
+    res = loop.run_until_complete(app._rpc.get("/timeout", timeout=.02))
+
+    assert res["code"] == -32000
+    assert app._rpc.stats["retries"] < 100
+    assert app._rpc.stats["failures"] == 1
+
+
+def test_batch_requests(app):
+    util._startup(app)
+
+    app._rpc._batch_size = 3
+    app._rpc._batch_delay = 0
+
+    count = app._rpc._transport.write.call_count
+
+    async_fun = getattr(asyncio, "ensure_future", asyncio.async)
+    first = async_fun(app._rpc.get("/first"))
+    second = async_fun(app._rpc.get("/second"))
+    for i in range(0, 3):
+        app._rpc.put("/state/" + str(i), {"data": str(i)})
+    app._rpc._send_result("1", True)
+    util.run_loop(.01)
+
+    assert app._rpc._transport.write.call_count == (count + 3)
+    batch = json.loads(app._rpc._transport.write.call_args_list[count][0][0].decode())
+    assert [b["method"] for b in batch] == ["PUT", "PUT", "PUT"]
+    assert "result" in app._rpc._transport.write.call_args_list[count + 1][0][0].decode()
+    batch = json.loads(app._rpc._transport.write.call_args[0][0].decode())
+    assert [b["params"]["url"] for b in batch] == ["/first", "/second"]
+    assert app._rpc.stats["batches"] == 2
+
+    rpc = [{"jsonrpc": "2.0", "id": b["id"], "result": b["params"]["url"]} for b in batch]
+    app._rpc.data_received(json.dumps(rpc).encode())
+    util.run_loop()
+
+    assert first.result() == "/first"
+    assert second.result() == "/second"
+
+
+def test_coalesce_state_reports(app):
+    util._startup(app)
+
+    app._rpc._coalesce = True
+
+    count = app._rpc._transport.write.call_count
+
+    for i in range(0, 5):
+        app._rpc.put("/network/1/device/2/value/3/state/4", {"data": str(i)})
+        app._rpc.put("/network/1/device/2/value/3/state/5", {"data": str(i)})
+    app._rpc._send_result("1", True)
+    app._rpc.put("/network/1/device/2/value/3/state/4", {"data": "5"})
+    util.run_loop()
+
+    assert app._rpc._transport.write.call_count == (count + 3)
+    writes = [c[0][0].decode() for c in app._rpc._transport.write.call_args_list[count:]]
+    assert "state/4" in writes[0] and '"data": "5"' in writes[0]
+    assert "state/5" in writes[1] and '"data": "4"' in writes[1]
+    assert "result" in writes[2]
+    assert app._rpc.stats["folded"] == 9
+
+
+class ServerApp():
+    ssl = None
+    host = "127.0.0.1"
+
+    def __init__(self, port):
+        self.port = port
+        self.reconnected = 0
+
+    def rpc_reconnected(self):
+        self.reconnected += 1
+
+
+def test_reconnect_to_server():
+    loop = asyncio.get_event_loop()
+    received = []
+    connections = []
+
+    @asyncio.coroutine
+    def handle(reader, writer):
+        connections.append(writer)
+        while True:
+            data = yield from reader.read(4096)
+            if not data:
+                break
+            received.append(data)
+            if len(connections) == 1:
+                # Drop the first connection after the first message
+                writer.close()
+                break
+
+    server = loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0))
+    app = ServerApp(server.sockets[0].getsockname()[1])
+
+    fut = asyncio.Future()
+    rpc = json_rpc.JsonRPC(app, fut, reconnect_delay=.2)
+    loop.run_until_complete(rpc._open())
+    loop.run_until_complete(fut)
+
+    rpc.put("/state/1", {"data": "1"})
+    util.run_loop(.05)
+
+    assert b"/state/1" in b"".join(received)
+    assert rpc._transport is None
+
+    rpc.put("/state/2", {"data": "2"})
+    util.run_loop(.3)
+
+    assert len(connections) == 2
+    assert app.reconnected == 1
+    assert rpc.stats["reconnects"] == 1
+    assert b"/state/2" in b"".join(received)
+
+    rpc.close()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+class DispatchApp():
+    def __init__(self):
+        self.done = []
+
+    def request_key(self, url):
+        return url.split("/")[2]
+
+    @asyncio.coroutine
+    def put(self, url, data):
+        if url.endswith("slow"):
+            yield from asyncio.sleep(.01)
+        self.done.append(url)
+        return True
+
+
+def test_concurrent_requests():
+    app = DispatchApp()
+    rpc = json_rpc.JsonRPC(app, asyncio.Future())
+    rpc.connection_made(mock.MagicMock())
+
+    for id, url in enumerate(["/device/A/slow", "/device/B/fast", "/device/A/fast"]):
+        rpc.data_received(json.dumps({"jsonrpc": "2.0", "id": id, "method": "PUT", "params": {"url": url, "data": {}}}).encode())
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.wait(list(rpc._dispatching)))
+    util.run_loop()
+
+    assert app.done == ["/device/B/fast", "/device/A/slow", "/device/A/fast"]
+    results = [json.loads(c[0][0].decode())["id"] for c in rpc._transport.write.call_args_list]
+    assert results == [1, 0, 2]
+    assert len(rpc._lanes) == 0
+
+    rpc.close()
+
+
+def test_close_without_connect():
+    rpc = json_rpc.JsonRPC(DispatchApp(), asyncio.Future())
+    rpc.close()
+
+    assert rpc._closing
+    assert rpc._app is None
+
+
+def test_request_key(app):
+    app._gateway = None
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    d = app._network._children[0]
+    s = d._children[0]._get_state(state.StateType.CONTROL)
+
+    assert app.request_key("/state/" + s.id) == d.id
+    assert app.request_key("/device/" + d.id) == d.id
+    assert app.request_key("/state/unknown") == "/state/unknown"
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+import qzig.application as application
+import qzig.util
+import qzig.network as network
+import qzig.state as state
+import qzig.store as store
+import tests.util as util
+
+
+def _sqlite_app(tmpdir):
+    return application.Application("/dev/null", "test_id", rootdir=str(tmpdir), port=1, host="test", ssl="no",
+                                   store="sqlite")
+
+
+def _ids(net):
+    return sorted(o.id for d in net._children for v in d._children for o in [d, v] + v._children)
+
+
+def test_sqlite_store(app, tmpdir, store):
+    app = _sqlite_app(tmpdir)
+    devices = util._get_device()
+    util._startup(app, devices)
+    app.close()
+
+    assert os.path.exists(str(tmpdir) + "store.db")
+    assert not os.path.exists(str(store))
+
+    loaded = _sqlite_app(tmpdir)
+    asyncio.get_event_loop().run_until_complete(loaded._network._load())
+    assert _ids(loaded._network) == _ids(app._network)
+    assert loaded._network._get_device("00:11:22:33:44:55:66:77") is not None
+
+    d = loaded._network._get_device("00:11:22:33:44:55:66:77")
+    d._remove_files()
+    loaded.close()
+
+    db = sqlite3.connect(str(tmpdir) + "store.db")
+    assert db.execute("SELECT count(*) FROM model WHERE path LIKE ?", ("%" + d.id + "%",)).fetchone()[0] == 0
+    assert db.execute("SELECT count(*) FROM model WHERE path = ''").fetchone()[0] == 1
+    db.close()
+
+
+def test_sqlite_store_batches_writes(app, tmpdir):
+    app = _sqlite_app(tmpdir)
+    devices = util._get_device()
+    util._startup(app, devices)
+
+    app._network._flush()
+    s = app._network._children[0]._children[0]._children[0]
+    s.data["data"] = "42"
+    s._save()
+    assert app._network._flush() == 1
+
+    loaded = network.Network(app, "test_id")
+    loaded._rootdir = str(tmpdir)
+    loaded._store = store.SqliteStore(str(tmpdir) + "store.db", loaded._path)
+    asyncio.get_event_loop().run_until_complete(loaded._load())
+    assert loaded._find_child(s.id).data["data"] == "42"
+    loaded._close()
+    app.close()
+
+
+def test_sqlite_store_thread(app, tmpdir):
+    app = _sqlite_app(tmpdir)
+    util._startup(app, util._get_device())
+
+    threads = set()
+    s = app._network._store
+    for name in ["write", "remove", "close"]:
+        def _call(*args, fn=getattr(s, name)):
+            threads.add(threading.current_thread())
+            return fn(*args)
+        setattr(s, name, _call)
+
+    d = app._network._get_device("00:11:22:33:44:55:66:77")
+    d._save()
+    app._network._flush()
+    d._remove_files()
+    app.close()
+
+    assert len(threads) == 1
+    assert threading.main_thread() not in threads
+
+
+def test_sqlite_store_remove_error(tmpdir, caplog):
+    s = store.SqliteStore(str(tmpdir) + "store.db", str(tmpdir) + "test_id/")
+    s.open()
+    s.close()
+    s.remove(str(tmpdir) + "test_id/device/1/")
+
+    assert "Failed to remove" in caplog.text
+
+
+def test_migrate_file_store(app, tmpdir, store):
+    devices = util._get_device()
+    util._startup(app, devices)
+    app.close()
+    assert os.path.exists(str(store) + "/network.json")
+
+    migrated = _sqlite_app(tmpdir)
+    asyncio.get_event_loop().run_until_complete(migrated._network._load())
+    migrated.close()
+
+    assert not os.path.exists(str(store))
+    assert os.path.exists(str(store) + ".migrated/network.json")
+    assert _ids(migrated._network) == _ids(app._network)
+    assert migrated._network._get_device("gateway") is not None
+
+
+def test_migrate_file_store_again(app, tmpdir, store):
+    util._startup(app, util._get_device())
+    app.close()
+    os.makedirs(str(store) + ".migrated")
+
+    # The database is opened and migrated on the persistence thread
+    migrated = _sqlite_app(tmpdir)
+    assert not os.path.exists(str(tmpdir) + "store.db")
+    threads = set()
+    open_store = migrated._network._store.open
+
+    def _open():
+        threads.add(threading.current_thread())
+        open_store()
+    migrated._network._store.open = _open
+    asyncio.get_event_loop().run_until_complete(migrated._network._load())
+    migrated.close()
+
+    assert threads and threading.main_thread() not in threads
+    assert os.listdir(str(store) + ".migrated") == []
+    assert os.path.exists(str(store) + ".migrated.1/network.json")
+    assert _ids(migrated._network) == _ids(app._network)
+
+
+def _file_app(tmpdir):
+    return application.Application("/dev/null", "test_id", rootdir=str(tmpdir), port=1, host="test", ssl="no")
+
+
+def _fail_preload(root):
+    raise AssertionError("The store should not be read")
+
+
+def test_snapshot(app, tmpdir):
+    devices = util._get_device()
+    util._startup(app, devices)
+    app.close()
+
+    snapshot = str(tmpdir) + "snapshot.json"
+    assert os.path.exists(snapshot)
+
+    loaded = _file_app(tmpdir)
+    loaded._network._store.preload = _fail_preload
+    asyncio.get_event_loop().run_until_complete(loaded._network._load())
+    assert _ids(loaded._network) == _ids(app._network)
+    assert loaded._network.id == "test_id"
+    assert loaded._network._get_device("gateway") is not None
+
+    # The first change to the store makes the snapshot stale
+    s = loaded._network._get_device("00:11:22:33:44:55:66:77")._children[0]._children[0]
+    s._save()
+    loaded._network._flush()
+    assert not os.path.exists(snapshot)
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(loaded._network._save_snapshot()) is True
+    assert loop.run_until_complete(loaded._network._save_snapshot()) is False
+    assert os.path.exists(snapshot)
+
+    loop.run_until_complete(loaded._network._get_device("00:11:22:33:44:55:66:77")._remove_files())
+    loaded._network._flush()
+    assert not os.path.exists(snapshot)
+
+    loaded.close()
+    assert os.path.exists(snapshot)
+    assert not os.path.exists(snapshot + ".tmp")
+
+
+def test_snapshot_reconnect(app, tmpdir):
+    devices = util._get_device()
+    util._startup(app, devices)
+    app.close()
+
+    # Booting and resyncing an unchanged network keeps the snapshot
+    loaded = _file_app(tmpdir)
+    util._startup(loaded, devices)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.gather(loaded._resync(), util._delayed_reply(loaded, [])))
+    loaded._network._flush()
+    assert loaded._network._snapshot_saved
+    assert os.path.exists(str(tmpdir) + "snapshot.json")
+    loaded.close()
+
+
+def test_invalid_snapshot(app, tmpdir):
+    devices = util._get_device()
+    util._startup(app, devices)
+    app.close()
+
+    with open(str(tmpdir) + "snapshot.json", 'w') as f:
+        f.write('{"version": 0}')
+
+    loaded = _file_app(tmpdir)
+    asyncio.get_event_loop().run_until_complete(loaded._network._load())
+    assert _ids(loaded._network) == _ids(app._network)
+
+
+def _dump(dev):
+    data = dict(dev.get_data())
+    data["value"] = sorted(data["value"], key=lambda v: v[":id"])
+    for v in data["value"]:
+        v["state"] = sorted(v["state"], key=lambda s: s[":id"])
+    return json.dumps(data, cls=qzig.util.QZigEncoder, sort_keys=True)
+
+
+def _lazy_app(tmpdir):
+    return application.Application("/dev/null", "test_id", rootdir=str(tmpdir), port=1, host="test", ssl="no",
+                                   lazy=True)
+
+
+def test_lazy_load(app, tmpdir):
+    util._startup(app, util._get_device())
+    eager = _dump(app._network._get_device("00:11:22:33:44:55:66:77"))
+    app.close()
+    app._network._store.close()
+
+    devices = util._get_device()
+    lazy = _lazy_app(tmpdir)
+    util._startup(lazy, devices)
+    net = lazy._network
+    assert net._snapshot is None
+
+    d = net._get_device("00:11:22:33:44:55:66:77")
+    assert d._subtree is not None
+    assert not d._loaded_children
+    assert _dump(d) == eager
+    assert d._subtree is not None
+
+    # A report loads the device and is forwarded to the report state
+    cluster = next(iter(devices.values())).endpoints[1].in_clusters[6]
+    for c in cluster._cb:
+        c.attribute_updated(0, 1)
+    assert d._subtree is None
+    assert not net._lazy_ids
+    s = d.get_value(1, 6)._get_state(state.StateType.REPORT)
+    assert s.data["data"] == "1"
+    assert net._find_child(s.id) is s
+    lazy.close()
+
+    # A lookup by id loads the device
+    lazy = _lazy_app(tmpdir)
+    asyncio.get_event_loop().run_until_complete(lazy._network._load())
+    d = lazy._network._get_device("00:11:22:33:44:55:66:77")
+    assert d._subtree is not None
+    assert lazy._network._find_child(s.id).data["data"] == "1"
+    assert d._subtree is None
+    assert _ids(lazy._network) == _ids(app._network)
+    lazy.close()
@@ -1,11 +1,17 @@
+import asyncio
 import os
 
 import tests.util as util
+import bellows.types as t
+import bellows.zigbee.zcl.foundation as foundation
 import bellows.zigbee.zcl.clusters.general as general_clusters
 import bellows.zigbee.zcl.clusters.measurement as measurement_clusters
 import bellows.zigbee.zcl.clusters.homeautomation as homeautomation_clusters
 
+import qzig.application as application
+import qzig.reporting as reporting
 import qzig.state as state
+import qzig.value as value
 from qzig.values import kaercher
 
 
@@ -47,14 +53,13 @@ def test_zigbee_device_initialized(app):
 
     assert app._zb.controller._cb is not None
 
-    app._zb.controller._cb.device_initialized(dev)
-
     count = app._rpc._transport.write.call_count
 
-    util.run_loop()
+    util.run_tasks(app._zb.controller._cb.device_initialized, dev)
 
-    assert app._rpc._transport.write.call_count == (count + 10)
-    assert '"PUT"' in app._rpc._transport.write.call_args[0][0].decode()
+    writes = [c[0][0].decode() for c in app._rpc._transport.write.call_args_list[count:]]
+    assert len(writes) == 10
+    assert len([w for w in writes if '"PUT"' in w]) == 2
 
 
 def test_zigbee_device_left(app):
@@ -87,6 +92,88 @@ def test_zigbee_device_annoucement(app):
         c.device_announce(dev)
 
 
+def test_zigbee_reporting(app):
+    devices = util._get_device(measurement_clusters.TemperatureMeasurement.cluster_id)
+    util._startup(app, devices)
+
+    dev = next(iter(devices.values()))
+    cluster = dev.endpoints[1].in_clusters[measurement_clusters.TemperatureMeasurement.cluster_id]
+
+    # Configured after the bind
+    assert cluster.reporting == {(0, None): (30, 900, 50)}
+    assert cluster.configured == [(0, None)]
+
+    # Nothing is configured again when the device kept the configuration
+    for c in dev.zdo._cb:
+        c.device_announce(dev)
+    util.run_loop(.01)
+    assert cluster.configured == [(0, None)]
+
+    # A device that lost the configuration gets it again
+    cluster.reporting.clear()
+    for c in dev.zdo._cb:
+        c.device_announce(dev)
+    util.run_loop(.01)
+    assert cluster.configured == [(0, None), (0, None)]
+    assert cluster.reporting == {(0, None): (30, 900, 50)}
+
+    # The configuration is verified
+    v = app._network._get_device(str(dev.ieee)).get_value(1, measurement_clusters.TemperatureMeasurement.cluster_id)
+    cluster.reporting[(0, None)] = (1, 2, 3)
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(reporting.verify(cluster, {(0, None): v._reporting})) == [(0, None)]
+    cluster.reporting[(0, None)] = (30, 900, 10)
+    assert loop.run_until_complete(reporting.verify(cluster, {(0, None): v._reporting})) == [(0, None)]
+    cluster.configure_reporting = util.MockCluster.dummy.__get__(cluster)
+    assert loop.run_until_complete(reporting.configure(cluster, [v])) == [(0, None)]
+
+
+def test_zigbee_reporting_config_response():
+    unsupported = bytes([0x86, 0x00, 0x01, 0x00])
+    configured = bytes([0x00, 0x00, 0x00, 0x00, 0x29, 30, 0x00, 0x84, 0x03, 50, 0x00])
+    discrete = bytes([0x00, 0x00, 0x02, 0x00, 0x10, 0x00, 0x00, 0x84, 0x03])
+    args, rest = t.deserialize(unsupported + configured + discrete, foundation.COMMANDS[0x09][1])
+
+    records = args[0]
+    assert rest == b""
+    assert [(r.status, r.attrid) for r in records] == [(0x86, 1), (0, 0), (0, 2)]
+    assert (records[1].min_interval, records[1].max_interval, records[1].reportable_change) == (30, 900, 50)
+    assert records[2].reportable_change is None
+    assert b"".join(r.serialize() for r in records) == unsupported + configured + discrete
+
+
+def test_zigbee_reporting_lazy(app, tmpdir):
+    devices = util._get_device(measurement_clusters.TemperatureMeasurement.cluster_id)
+    util._startup(app, devices)
+    app.close()
+
+    devices = util._get_device(measurement_clusters.TemperatureMeasurement.cluster_id)
+    lazy = application.Application("/dev/null", "test_id", rootdir=str(tmpdir), port=1, host="test", ssl="no",
+                                   lazy=True)
+    util._startup(lazy, devices)
+    dev = next(iter(devices.values()))
+    cluster = dev.endpoints[1].in_clusters[measurement_clusters.TemperatureMeasurement.cluster_id]
+    assert lazy._network._get_device(str(dev.ieee))._subtree is not None
+    assert cluster.configured == []
+
+    # A lazy device that lost the configuration gets it again
+    for c in dev.zdo._cb:
+        c.device_announce(dev)
+    util.run_loop(.01)
+    assert cluster.configured == [(0, None)]
+    lazy.close()
+
+
+def test_zigbee_reporting_manufacturer():
+    cluster = util.MockCluster(kaercher.KaercherDeviceState.cluster_id)
+    cluster.attributes = kaercher.KaercherDeviceState.attributes
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(reporting.configure(cluster, [kaercher.DeviceState])) == []
+    assert cluster.configured == [(0, 0x122C)]
+    assert cluster.reporting == {(0, 0x122C): (0, 3600, 1)}
+
+
 def test_zigbee_zdo_command(app):
     devices = util._get_device()
     util._startup(app, devices)
@@ -259,16 +346,12 @@ def test_zigbee_ota_page_update(app):
     os.system("echo 2-2-2.bin > ota/2-2-2.upgrade")
     os.system("dd if=/dev/zero of=ota/2-2-2.bin bs=1M count=1")
 
-    cluster.handle_cluster_request(0, 0, 1, (1, 2, 2, 2, 2))
-    util.run_loop()
+    util.run_tasks(cluster.handle_cluster_request, 0, 0, 1, (1, 2, 2, 2, 2))
     assert app._rpc._transport.write.call_count == (count + 1)
 
-    cluster.handle_cluster_request(0, 0, 4, (0, 2, 2, 2, 0, 50, 150, 10))
-    util.run_loop(.006)
-    assert app._rpc._transport.write.call_count == (count + 2)
-
-    util.run_loop(.006)
-    assert app._rpc._transport.write.call_count == (count + 3)
+    util.run_tasks(cluster.handle_cluster_request, 0, 0, 4, (0, 2, 2, 2, 0, 50, 150, 10))
+    # One progress report for each block of the page
+    assert app._rpc._transport.write.call_count == (count + 4)
 
     os.system("rm ota/2-2-2.*")
 
@@ -500,3 +583,32 @@ def test_zigbee_poll_checkin(app):
     util.run_loop()
 
     assert app._rpc._transport.write.call_count == count
+
+
+def test_zigbee_merged_reads(app):
+    devices = util._get_device(general_clusters.PollControl.cluster_id)
+    util._startup(app, devices)
+
+    dev = next(iter(devices.values()))
+    cluster = dev.endpoints[1].in_clusters[general_clusters.PollControl.cluster_id]
+
+    assert [(sorted(a), m) for a, m in cluster.reads] == [([0, 1, 2, 3], None)]
+
+    for v in app._network._children[1]._children:
+        s = v._get_state(state.StateType.REPORT)
+        if s is not None:
+            assert s.data["data"] == "0"
+
+
+def test_zigbee_merged_reads_manufacturer():
+    cluster = util.MockCluster(kaercher.KaercherFallback.cluster_id)
+    reader = value.ClusterReader.get(cluster)
+    assert value.ClusterReader.get(cluster) is reader
+
+    futures = [reader.read(0), reader.read(1, 0x122C), reader.read(2), reader.read(2, 0x122C)]
+    loop = asyncio.get_event_loop()
+    res = loop.run_until_complete(asyncio.gather(*futures))
+
+    assert sorted((sorted(a), str(m)) for a, m in cluster.reads) == [([0, 2], 'None'), ([1, 2], str(0x122C))]
+    assert res[0] == res[2] == [{0: 0, 2: 0}, 0]
+    assert res[1] == res[3] == [{1: 0, 2: 0}, 0]
@@ -1,6 +1,7 @@
 import asyncio
 import bellows
 import json
+import qzig.reporting
 from unittest import mock
 
 app_devices = {}
@@ -62,17 +63,50 @@ class MockEndpoint():
         self.status = bellows.zigbee.endpoint.Status.ZDO_INIT
 
 
+class MockClusterEndpoint():
+    """Decodes the raw ZCL frames a cluster sends through its device"""
+    def __init__(self, cluster):
+        self.device = self
+        self._cluster = cluster
+
+    def get_aps(self, cluster_id):
+        aps = mock.MagicMock()
+        aps.sequence = 1
+        return aps
+
+    @asyncio.coroutine
+    def request(self, aps, data):
+        frame_control, data = data[0], data[1:]
+        manufacturer = None
+        if frame_control & 0x04:
+            manufacturer, data = bellows.types.uint16_t.deserialize(data)
+        command_id, data = data[1], data[2:]
+        if frame_control & 0x01:
+            self._cluster.commands.append((command_id, manufacturer, data))
+            return [0, self._cluster._status]
+        args, data = bellows.types.deserialize(data, bellows.zigbee.zcl.foundation.COMMANDS[command_id][1])
+        return self._cluster._general(True, command_id, args[0], manufacturer)
+
+
 class MockCluster():
     def __init__(self, id):
         self.name = "Mock"
         self.cluster_id = id
+        self._endpoint = MockClusterEndpoint(self)
+        self.attributes = {}
         self._cb = None
         self.reply_count = 0
+        self.reads = []
+        self.reporting = {}
+        self.configured = []
+        self.written = {}
+        self.commands = []
         self._status = 0
 
     @asyncio.coroutine
     def read_attributes(self, *args, **kwargs):
         self.reply_count += 1
+        self.reads.append((list(args[0]), kwargs.get("manufacturer")))
         if self.cluster_id == 6:
             return [{0: 0}, 0]
         elif self.cluster_id == 0:
@@ -85,17 +119,58 @@ class MockCluster():
             else:
                 return None
         else:
-            return [{args[0][0]: 0}, 0]
+            return [{a: self.written.get((a, kwargs.get("manufacturer")), 0) for a in args[0]}, 0]
 
     @asyncio.coroutine
     def write_attributes(self, attributes, is_report=False, manufacturer=None):
         if is_report:
             return [0, self._status]
         else:
+            if self._status == 0:
+                for a, v in attributes.items():
+                    self.written[(a, manufacturer)] = v
             res = bellows.zigbee.zcl.foundation.WriteAttributesStatusRecord()
             res.status = self._status
             return [[res]]
 
+    @asyncio.coroutine
+    def configure_reporting(self, attribute, min_interval, max_interval, reportable_change):
+        return self._configure(attribute, min_interval, max_interval, reportable_change)
+
+    def _configure(self, attribute, min_interval, max_interval, reportable_change, manufacturer=None):
+        self.configured.append((attribute, manufacturer))
+        self.reporting[(attribute, manufacturer)] = (min_interval, max_interval, reportable_change)
+        res = bellows.zigbee.zcl.foundation.ConfigureReportingResponseRecord()
+        res.status = self._status
+        return [[res]]
+
+    @asyncio.coroutine
+    def request(self, general, command_id, schema, *args):
+        return self._general(general, command_id, args[0] if args else None)
+
+    def _general(self, general, command_id, records, manufacturer=None):
+        if general and command_id == 0x06:
+            for cfg in records:
+                res = self._configure(cfg.attrid, cfg.min_interval, cfg.max_interval, cfg.reportable_change,
+                                      manufacturer)
+            return res
+        if not general or command_id != 0x08:
+            return [0, self._status]
+        res = []
+        for r in records:
+            cfg = qzig.reporting.ReportingConfigRecord()
+            cfg.direction = 0
+            cfg.attrid = r.attrid
+            cfg.status = bellows.zigbee.zcl.foundation.Status.UNREPORTABLE_ATTRIBUTE
+            if (r.attrid, manufacturer) in self.reporting:
+                cfg.status = 0
+                cfg.datatype = bellows.zigbee.zcl.foundation.DATA_TYPE_IDX.get(
+                    self.attributes.get(r.attrid, (None, bellows.types.int16s))[1])
+                cfg.min_interval, cfg.max_interval, cfg.reportable_change = self.reporting[(r.attrid, manufacturer)]
+            res.append(cfg)
+        data = b"".join(cfg.serialize() for cfg in res)
+        return bellows.types.deserialize(data, bellows.zigbee.zcl.foundation.COMMANDS[0x09][1])[0]
+
     @asyncio.coroutine
     def leave(self):
         self._leave = True
@@ -144,9 +219,26 @@ def run_loop(delay=.00001):
     loop.run_until_complete(asyncio.sleep(delay))
 
 
+def run_tasks(fn, *args):
+    """Calls fn and runs the loop until the tasks it started are done"""
+    loop = asyncio.get_event_loop()
+    before = asyncio.Task.all_tasks(loop)
+    res = fn(*args)
+    while True:
+        pending = [t for t in asyncio.Task.all_tasks(loop) - before if not t.done()]
+        if not pending:
+            break
+        done, pending = loop.run_until_complete(asyncio.wait(pending, timeout=5))
+        assert done, "Tasks did not finish: %s" % pending
+    run_loop()
+    return res
+
+
 @asyncio.coroutine
 def _delayed_reply(app, server_devices):
     yield from asyncio.sleep(.00001)
+    while not getattr(app, "_rpc", None) or not app._rpc._pending:
+        yield from asyncio.sleep(.00001)
     data = {
         "type": "urn:seluxit:xml:bastard:device-1.1",
         ":type": "urn:seluxit:xml:bastard:idlist-1.0",
@@ -154,7 +246,7 @@ def _delayed_reply(app, server_devices):
     }
     rpc = {
         "jsonrpc": "2.0",
-        "id": 2,
+        "id": next(iter(app._rpc._pending)),
         "result": json.dumps(data)
     }
     app._rpc.data_received(json.dumps(rpc).encode())